@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Event dispatch path: precomputed handler table against per-event getattr.
+import time
+from iotapp import entities
+from iotapp.base import IotApp
+from iotapp.events import Event
+from iotapp.test import TestClient, TestLogger
+
+
+EVENTS = 200000
+
+
+class App(IotApp):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.add_entity('button', 'button')
+        self.add_entity('light', 'light')
+
+    def on_button_click(self):
+        pass
+
+    def legacy_process_event(self, name, event):
+        self.logger.debug('process_event - {} {}'.format(name, event))
+        func_name = 'on_{}_{}'.format(name, event.type)
+        func = getattr(self, func_name, None)
+        if func:
+            func(*event.args, **event.kwargs)
+
+
+def get_app():
+    entity_library = dict(
+        button=entities.Button(state_topic='button/state'),
+        light=entities.Light(state_topic='light/state', availability_topic='light/online'),
+    )
+    return App(entity_library=entity_library, client=TestClient(), logger=TestLogger())
+
+
+def run(process_event, name, event):
+    start = time.perf_counter()
+    for i in range(EVENTS):
+        process_event(name, event)
+    return EVENTS / (time.perf_counter() - start)
+
+
+def run_messages(app):
+    client = app.client
+    messages = EVENTS // 10
+    start = time.perf_counter()
+    for i in range(messages):
+        client.receive('button/state', 'click')
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    app = get_app()
+    click = Event('click')
+    availability = Event('availability', 'online')
+    print('events: {}'.format(EVENTS))
+    print('handled event   getattr: {:10.0f} ev/s  table: {:10.0f} ev/s'.format(
+        run(app.legacy_process_event, 'button', click),
+        run(app.process_event, 'button', click),
+    ))
+    print('unhandled event getattr: {:10.0f} ev/s  table: {:10.0f} ev/s'.format(
+        run(app.legacy_process_event, 'light', availability),
+        run(app.dispatch, 'light', availability),
+    ))
+    print('TestClient.receive click: {:10.0f} msg/s'.format(run_messages(app)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# End to end latency: button press to light command through a local broker.
+import argparse
+import os
+import queue
+import socket
+import threading
+import time
+import paho.mqtt.client as mqtt
+from iotapp.broker import Broker
+from iotapp.manager import AppManager
+
+
+DEVICES = dict(
+    button=dict(type='aqara-button'),
+    light=dict(type='shelly-rgbw2', channel1='light'),
+)
+APPS = dict(app=dict(app='iotapp.apps.toggle.Toggle', button='button', light='light'))
+STATUS = '{"ison":true,"has_timer":false,"timer_remaining":0,"mode":"white","brightness":11,"power":8.26,"overpower":false}'
+
+
+def get_client(broker, client_id):
+    client = mqtt.Client(client_id=client_id)
+    client.connect(broker.host, broker.port, 60)
+    client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    client.loop_start()
+    return client
+
+
+def flood(broker, rate, stopped):
+    client = get_client(broker, 'flood')
+    interval = 1.0 / rate
+    next_time = time.perf_counter()
+    while not stopped.is_set():
+        client.publish('shellies/light/white/0/status', STATUS)
+        next_time += interval
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    client.loop_stop()
+    client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Button press to command latency.')
+    parser.add_argument('-p', '--presses', type=int, default=500)
+    parser.add_argument('-l', '--load', type=int, default=0, help='Background status messages per second')
+    parser.add_argument('-e', '--engine', choices=['sync', 'asyncio'], default='sync')
+    args = parser.parse_args()
+
+    with Broker() as broker:
+        os.environ.update(broker.get_environ())
+        os.environ['LOG_LEVEL'] = 'warning'
+        commands = queue.Queue()
+        device = get_client(broker, 'device')
+        device.on_message = lambda client, userdata, msg: commands.put(time.perf_counter())
+        device.subscribe('shellies/light/white/0/command')
+        device.publish('shellies/light/white/0', 'on', retain=True)
+        manager = AppManager(name='app', devices=DEVICES, apps=APPS)
+        threading.Thread(target=manager.run, kwargs=dict(engine=args.engine), daemon=True).start()
+        app = manager.app_instance
+        while app.light.state is None:
+            time.sleep(0.01)
+        stopped = threading.Event()
+        if args.load:
+            threading.Thread(target=flood, args=(broker, args.load, stopped), daemon=True).start()
+        latencies = []
+        for press in range(args.presses):
+            # Keep the light state consistent so every press produces a command
+            device.publish('shellies/light/white/0', 'on')
+            time.sleep(0.002)
+            start = time.perf_counter()
+            device.publish('zigbee/button', '{"click": "single"}')
+            latencies.append(commands.get(timeout=5) - start)
+        stopped.set()
+        latencies.sort()
+        print('engine: {}  presses: {}  background load: {} msg/s'.format(args.engine, args.presses, args.load))
+        print('p50: {:.2f} ms  p99: {:.2f} ms  max: {:.2f} ms'.format(
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000,
+            latencies[-1] * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
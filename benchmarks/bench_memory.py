@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Memory footprint of a large fleet: bytes per Light entity and per Event.
+#
+#   PYTHONPATH=. python benchmarks/bench_memory.py --entities 50000
+import argparse
+import gc
+import time
+import tracemalloc
+from iotapp.base import IotApp
+from iotapp.config import DeviceManager, EntityLibrary
+from iotapp.events import Event
+from iotapp.test import TestClient, TestLogger
+
+
+ENTITIES = 50000
+EVENTS = 100000
+
+
+class FleetApp(IotApp):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        for name in self.entity_library:
+            self.add_entity(name, name)
+
+
+def get_library(size):
+    devices = dict(
+        ('rgbw2_{}'.format(number), dict(type='shelly-rgbw2', channel1='light{}'.format(number)))
+        for number in range(size)
+    )
+    return EntityLibrary(DeviceManager(devices=devices).entities)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objects, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Entity memory benchmark.')
+    parser.add_argument('--entities', type=int, default=ENTITIES)
+    parser.add_argument('--events', type=int, default=EVENTS)
+    args = parser.parse_args()
+
+    library = get_library(args.entities)
+    # Entities as built for an app: library spec, name, client and logger
+    app, size, elapsed = measure(lambda: FleetApp(entity_library=library, client=TestClient(), logger=TestLogger()))
+    print('entities: {}  {:8.0f} bytes/entity  ({:.2f}s)'.format(args.entities, size / args.entities, elapsed))
+    # Entities alone, without the app routing tables
+    lights, size, elapsed = measure(lambda: [library.build(name) for name in library])
+    print('entities: {}  {:8.0f} bytes/Light (bare)  ({:.2f}s)'.format(args.entities, size / args.entities, elapsed))
+    events, size, elapsed = measure(lambda: [Event('brightness_change', number) for number in range(args.events)])
+    print('events:   {}  {:8.0f} bytes/Event  ({:.2f}s)'.format(args.events, size / args.events, elapsed))
+
+
+if __name__ == '__main__':
+    main()
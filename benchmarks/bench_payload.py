@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# Shared payload: 4 consumers reading the same Shelly status message.
+import time
+from iotapp import entities
+from iotapp.utils import Payload
+
+
+TOPIC = 'shellies/kitchen/white/0/status'
+PAYLOAD = b'{"ison":true,"has_timer":false,"timer_remaining":0,"mode":"white","brightness":11,"power":8.26,"overpower":false}'
+CONSUMERS = 4
+MESSAGES = 20000
+
+
+def get_consumers():
+    return [
+        entities.Light(
+            state_topic=TOPIC,
+            state_template='{{ "on" if value.ison else "off" }}',
+            brightness_state_topic=TOPIC,
+            brightness_state_template='{{ value.brightness }}',
+        )
+        for i in range(CONSUMERS)
+    ]
+
+
+def run(decode):
+    consumers = get_consumers()
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        payload = decode(PAYLOAD)
+        for entity in consumers:
+            entity.reset_state()
+            entity.get_events(TOPIC, payload)
+    return MESSAGES / (time.perf_counter() - start)
+
+
+def main():
+    before = run(lambda data: data.decode('utf-8'))
+    after = run(Payload.decode)
+    print('consumers: {}  messages: {}'.format(CONSUMERS, MESSAGES))
+    print('str payload (json per template): {:10.0f} msg/s'.format(before))
+    print('shared Payload (json once):      {:10.0f} msg/s'.format(after))
+    print('speedup: {:.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
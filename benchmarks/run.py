@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# Ingestion pipeline benchmark suite.
+#
+#   PYTHONPATH=. python benchmarks/run.py --output benchmarks/results/current.json
+#   PYTHONPATH=. python benchmarks/run.py --compare benchmarks/results/current.json
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from iotapp import entities, logger, version
+from iotapp.base import IotApp
+from iotapp.test import TestClient
+
+
+SIZES = [10, 100, 1000, 10000]
+MESSAGES = 20000
+ALLOCATION_MESSAGES = 2000
+THRESHOLD = 0.1
+DEVNULL = open(os.devnull, 'w')
+
+
+class BenchApp(IotApp):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        for name in self.entity_library:
+            self.add_entity(name, name)
+
+
+def on_click(self):
+    pass
+
+
+def get_app_class(library):
+    # One on_<button>_click method per button, found by the real handler table build
+    handlers = dict(('on_{}_click'.format(name), on_click) for name in library if name.startswith('button'))
+    return type('BenchApp', (BenchApp,), handlers)
+
+
+def get_shelly(size):
+    library = dict()
+    for number in range(size):
+        library['light{}'.format(number)] = entities.Light(
+            availability_topic='shellies/rgbw2_{}/online'.format(number),
+            availability_online='true',
+            availability_offline='false',
+            state_topic='shellies/rgbw2_{}/white/0'.format(number),
+            command_topic='shellies/rgbw2_{}/white/0/command'.format(number),
+            brightness_state_topic='shellies/rgbw2_{}/white/0/status'.format(number),
+            brightness_state_template='{{ value.brightness }}',
+            brightness_command_topic='shellies/rgbw2_{}/white/0/set'.format(number),
+            brightness_command_template='{"brightness": {{ value }}}',
+        )
+    return library
+
+
+def get_aqara(size):
+    library = dict()
+    for number in range(size):
+        library['button{}'.format(number)] = entities.Button(
+            state_topic='zigbee/button_{}'.format(number),
+            state_value_click='single',
+            state_template='{{ value.click }}',
+        )
+    return library
+
+
+def shelly_status(size, count):
+    status = '{{"ison":true,"has_timer":false,"timer_remaining":0,"mode":"white","brightness":{},"power":8.26,"overpower":false}}'
+    for index in range(count):
+        number = index % size
+        yield 'shellies/rgbw2_{}/white/0/status'.format(number), status.format(index % 100)
+
+
+def aqara_click(size, count):
+    click = '{"battery":100,"voltage":3015,"linkquality":0,"click":"single"}'
+    for index in range(count):
+        yield 'zigbee/button_{}'.format(index % size), click
+
+
+def availability_flap(size, count):
+    for index in range(count):
+        number = index % size
+        online = 'true' if (index // size) % 2 == 0 else 'false'
+        yield 'shellies/rgbw2_{}/online'.format(number), online
+
+
+SCENARIOS = dict(
+    shelly_status=(get_shelly, shelly_status),
+    aqara_click=(get_aqara, aqara_click),
+    availability_flap=(get_shelly, availability_flap),
+)
+
+
+def get_app(scenario, size):
+    get_library, get_messages = SCENARIOS[scenario]
+    library = get_library(size)
+    # Real app and entity loggers, the queue listener output goes nowhere
+    app = get_app_class(library)(entity_library=library, client=TestClient(), log_level='info')
+    for handler in logger.listener.handlers:
+        handler.setStream(DEVNULL)
+    return app
+
+
+def get_percentile(values, percentile):
+    index = min(len(values) - 1, int(round(percentile * (len(values) - 1))))
+    return values[index]
+
+
+def run_scenario(scenario, size, messages=MESSAGES, allocation_messages=ALLOCATION_MESSAGES):
+    get_library, get_messages = SCENARIOS[scenario]
+    # Throughput and latency
+    app = get_app(scenario, size)
+    receive = app.client.receive
+    stream = list(get_messages(size, messages))
+    latencies = []
+    gc.collect()
+    start = time.perf_counter()
+    for topic, payload in stream:
+        message_start = time.perf_counter()
+        receive(topic, payload)
+        latencies.append(time.perf_counter() - message_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    # Allocations
+    app = get_app(scenario, size)
+    receive = app.client.receive
+    stream = list(get_messages(size, allocation_messages))
+    gc.collect()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    for topic, payload in stream:
+        receive(topic, payload)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+    return dict(
+        scenario=scenario,
+        entities=size,
+        messages=messages,
+        messages_per_second=messages / elapsed,
+        p50_us=get_percentile(latencies, 0.5) * 1e6,
+        p99_us=get_percentile(latencies, 0.99) * 1e6,
+        retained_blocks_per_message=blocks / allocation_messages,
+        peak_bytes_per_message=peak / allocation_messages,
+    )
+
+
+def get_git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    regressions = []
+    previous = dict(((item['scenario'], item['entities']), item) for item in baseline['results'])
+    for item in results['results']:
+        old = previous.get((item['scenario'], item['entities']))
+        if not old:
+            continue
+        throughput = item['messages_per_second'] / old['messages_per_second'] - 1
+        p99 = item['p99_us'] / old['p99_us'] - 1
+        flag = ''
+        if throughput < -threshold or p99 > threshold:
+            flag = '  REGRESSION'
+            regressions.append(item)
+        print('{scenario:18} {entities:6}  msg/s {throughput:+7.1%}  p99 {p99:+7.1%}{flag}'.format(
+            throughput=throughput, p99=p99, flag=flag, **item))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='iotapp ingestion benchmarks.')
+    parser.add_argument('-s', '--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('-n', '--sizes', nargs='+', type=int, default=SIZES, help='Number of entities')
+    parser.add_argument('-m', '--messages', type=int, default=MESSAGES)
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write results as JSON')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='Compare with previous JSON results')
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD, help='Regression threshold')
+    args = parser.parse_args()
+
+    results = dict(
+        version=version,
+        commit=get_git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        results=[],
+    )
+    print('{:18} {:>6} {:>10} {:>9} {:>9} {:>9} {:>10}'.format('scenario', 'size', 'msg/s', 'p50 us', 'p99 us', 'blocks', 'peak B'))
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            item = run_scenario(scenario, size, messages=args.messages)
+            results['results'].append(item)
+            print('{scenario:18} {entities:6} {messages_per_second:10.0f} {p50_us:9.1f} {p99_us:9.1f} '
+                  '{retained_blocks_per_message:9.2f} {peak_bytes_per_message:10.1f}'.format(**item))
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('\ncompared with {} ({})'.format(baseline.get('commit'), baseline.get('timestamp')))
+        if compare(results, baseline, threshold=args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
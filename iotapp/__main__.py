@@ -1,7 +1,14 @@
 #!/bin/env python
 import argparse
 import os
+import sys
+import time
+from iotapp.check import check_config
+from iotapp.config import load_yaml
 from iotapp.manager import AppManager
+from iotapp.record import RecordReader, replay
+from iotapp.test import TestClient
+from iotapp.workers import Supervisor
 
 
 def get_default():
@@ -10,15 +17,76 @@ def get_default():
         config=os.environ.get('IOTAPP_CONFIG', None),
         apps=os.environ.get('IOTAPP_APPS', None),
         devices=os.environ.get('IOTAPP_DEVICES', None),
+        engine=os.environ.get('IOTAPP_ENGINE', 'sync'),
+        cache=os.environ.get('IOTAPP_CACHE_DIR', None),
+        watch=os.environ.get('IOTAPP_WATCH', '') in ['1', 'true', 'yes'],
+        workers=int(os.environ.get('IOTAPP_WORKERS', 0)),
+        record=os.environ.get('IOTAPP_RECORD_FILE', 'iotapp.rec'),
+        speed=float(os.environ.get('IOTAPP_REPLAY_SPEED', 1)),
     )
 
+def read_config(file_name):
+    with open(file_name, 'rb') as config_file:
+        return load_yaml(config_file.read())
+
+def check(devices_file, apps_file):
+    start = time.perf_counter()
+    files = dict(devices=devices_file, apps=apps_file)
+    config = dict()
+    errors = []
+    for section, file_name in files.items():
+        try:
+            config[section] = read_config(file_name)
+        except Exception as e:
+            errors.append((section, '-', str(e).replace('\n', ' ')))
+    loaded = time.perf_counter()
+    if not errors:
+        errors = check_config(config['devices'], config['apps'])
+    for section, name, error in errors:
+        print('{}: {}: {}'.format(files[section], name, error))
+    print('{} devices, {} apps, {} errors (load {:.3f}s, check {:.3f}s)'.format(
+        len(config.get('devices') or dict()), len(config.get('apps') or dict()), len(errors),
+        loaded - start, time.perf_counter() - loaded))
+    return 1 if errors else 0
+
+def print_summary(name, summary, unit=1000):
+    if not summary['count']:
+        return
+    print('{}: {} calls, mean {:.3f}ms, p50 <= {}ms, p99 <= {}ms'.format(
+        name, summary['count'], summary['mean'] * unit, summary['p50'] * unit, summary['p99'] * unit))
+
+def replay_file(manager, file_name, speed):
+    app = manager.app_instance
+    app.client.connect()
+    app.scheduler.start()
+    reader = RecordReader(file_name)
+    try:
+        report = replay(app, reader, speed=speed)
+    finally:
+        reader.close()
+    print('{messages} messages in {seconds:.3f}s ({rate:.0f} msg/s)'.format(**report))
+    print_summary('lag', report['lag'])
+    print_summary('get_events', report['parse'])
+    for name, summary in sorted(report['handlers'].items()):
+        print_summary(name, summary)
+    for where, count in report['exceptions'].items():
+        print('exceptions in {}: {}'.format(where, count))
+    return 1 if report['exceptions'] else 0
+
 def main():
     default = get_default()
     parser = argparse.ArgumentParser(prog='iotapp', description='Iot Applications.')
-    parser.add_argument('-n', '--name', metavar='NAME', help='Application name', default=default['name'])
+    parser.add_argument('command', nargs='?', choices=['run', 'check', 'record', 'replay'], help='Run the apps, check the configuration, run the apps recording the received messages or replay a recording offline (default: run)', default='run')
+    parser.add_argument('-n', '--name', metavar='NAME', help='Application names, comma separated (default: all apps)', default=default['name'])
     parser.add_argument('-c', '--config', metavar='DIR', help='Configuration directory', default=default['config'])
     parser.add_argument('-d', '--devices', metavar='FILE', help='Devices file', default=default['devices'])
     parser.add_argument('-a', '--apps', metavar='FILE', help='Apps file', default=default['apps'])
+    parser.add_argument('--cache', metavar='DIR', help='Compiled configuration cache directory', default=default['cache'])
+    parser.add_argument('-e', '--engine', choices=['sync', 'asyncio'], help='Event loop engine', default=default['engine'])
+    parser.add_argument('-w', '--watch', action='store_true', help='Reload devices and apps files when they change', default=default['watch'])
+    parser.add_argument('--workers', metavar='N', type=int, help='Worker processes, apps are partitioned between them (default: 0, single process)', default=default['workers'])
+    parser.add_argument('-f', '--file', metavar='FILE', help='Record file for record and replay (default: iotapp.rec)', default=default['record'])
+    parser.add_argument('--speed', metavar='X', type=float, help='Replay speed factor, 0 replays as fast as possible (default: 1)', default=default['speed'])
     args = parser.parse_args()
 
     # Config
@@ -30,9 +98,25 @@ def main():
     if not apps_file:
         apps_file = os.path.join(config_dir, 'apps.yml')
 
+    if args.command == 'check':
+        sys.exit(check(devices_file, apps_file))
+
+    if args.command == 'replay':
+        # Never record the replayed messages into the file being read
+        os.environ.pop('IOTAPP_RECORD_FILE', None)
+        manager = AppManager(name=args.name, devices=devices_file, apps=apps_file, cache_dir=args.cache, client=TestClient())
+        sys.exit(replay_file(manager, args.file, args.speed))
+    if args.command == 'record':
+        # Read by every app and worker process
+        os.environ['IOTAPP_RECORD_FILE'] = args.file
+
     # Manager
-    manager = AppManager(name=args.name, devices=devices_file, apps=apps_file, )
-    manager.run()
+    if args.workers > 1:
+        manager = AppManager(name=args.name, devices=devices_file, apps=apps_file, cache_dir=args.cache, create_app=False)
+        Supervisor(manager, workers=args.workers).run(engine=args.engine, watch=args.watch)
+        return
+    manager = AppManager(name=args.name, devices=devices_file, apps=apps_file, cache_dir=args.cache)
+    manager.run(engine=args.engine, watch=args.watch)
 
 
 if __name__ == '__main__':
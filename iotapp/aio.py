@@ -0,0 +1,83 @@
+import asyncio
+import paho.mqtt.client as mqtt
+from iotapp.logger import LoggerMixin
+
+
+class AsyncioHelper:
+    def __init__(self, loop, client, misc_interval=1):
+        self.loop = loop
+        self.client = client
+        self.misc_interval = misc_interval
+        self.misc = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc:
+            self.misc.cancel()
+            self.misc = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(self.misc_interval)
+            except asyncio.CancelledError:
+                break
+
+
+class AsyncEngine(LoggerMixin):
+    def __init__(self, app, reconnect_delay=1, logger=None):
+        self.app = app
+        self.client = app.client
+        self.reconnect_delay = reconnect_delay
+        self.logger = logger or app.logger
+        self.loop = None
+        self.disconnected = None
+        self.stopped = False
+
+    def on_disconnect(self, client, userdata, *args):
+        if self.disconnected and not self.disconnected.done():
+            self.disconnected.set_result(args)
+
+    def connect(self):
+        config = self.app.mqtt_config
+        if config['username']:
+            self.client.username_pw_set(config['username'], password=config['password'])
+        self.client.connect(config['host'], config['port'], config['keepalive'])
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.app.loop = self.loop
+        AsyncioHelper(self.loop, self.client)
+        self.client.on_disconnect = self.on_disconnect
+        scheduler = self.loop.create_task(self.app.scheduler.run_async())
+        while not self.stopped:
+            self.disconnected = self.loop.create_future()
+            try:
+                self.connect()
+            except OSError:
+                self.logger.exception('Could not connect to {host}:{port}'.format(**self.app.mqtt_config), exc_info=True)
+                self.disconnected.set_result(None)
+            await self.disconnected
+            if not self.stopped:
+                await asyncio.sleep(self.reconnect_delay)
+        self.app.scheduler.stop()
+        await scheduler
+        await self.app.wait_tasks()
+
+    def stop(self):
+        self.stopped = True
+        self.client.disconnect()
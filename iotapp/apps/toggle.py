@@ -2,6 +2,8 @@ from iotapp.base import IotApp
 
 
 class Toggle(IotApp):
+    entity_options = ('button', 'light')
+
     def __init__(self, button=None, light=None, **kwargs):
         super().__init__(**kwargs)
         self.add_entity('button', button)
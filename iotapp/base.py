@@ -1,33 +1,260 @@
+import asyncio
+import inspect
+import logging
 import os
+import threading
+import time
 import paho.mqtt.client as mqtt
 from copy import copy
+from iotapp.commands import CommandCoalescer
 from iotapp.config import DeviceManager
-from iotapp.logger import LoggerMixin
+from iotapp.dispatch import PoolDispatcher
+from iotapp.logger import LoggerMixin, TopicSampler
+from iotapp.metrics import Metrics, MetricsReporter
+from iotapp.outbound import OutboundQueue
+from iotapp.record import Recorder
+from iotapp.router import TopicRouter, topic_matches
+from iotapp.scheduler import Scheduler
+from iotapp.state import StateStore
+from iotapp.utils import Payload
+
+
+MQTT_PROTOCOLS = {
+    '3.1': mqtt.MQTTv31,
+    '3.1.1': mqtt.MQTTv311,
+    '5': mqtt.MQTTv5,
+}
 
 
 class IotApp(LoggerMixin):
     entities = dict()
+    # Constructor options naming entities, checked by iotapp check
+    entity_options = ()
 
-    def __init__(self, name=None, entity_library=dict(), availability_topic=None, log_level=None, client=None, logger=None):
+    def __init__(self, name=None, entity_library=dict(), availability_topic=None, subscribe_wildcards=None, dispatch_workers=None, dispatch_queue_size=None, dispatch_overflow=None, command_interval=None, outbound_size=None, state_file=None, record_file=None, log_sample_rate=None, metrics_interval=None, metrics_topic=None, metrics_file=None, log_level=None, client=None, logger=None, host=None):
         self.name = name or type(self).__name__.lower()
         self.entity_library = entity_library
         self.availability_topic = availability_topic or 'iotapp/{}/state'.format(self.name)
+        if subscribe_wildcards is None:
+            subscribe_wildcards = os.environ.get('IOTAPP_SUBSCRIBE_WILDCARDS', '') in ['1', 'true', 'yes']
+        self.subscribe_wildcards = subscribe_wildcards
         self.logger = logger or self.get_logger(level=log_level)
-        self.mqtt_config = self.get_mqtt_config()
-        self.client = client or mqtt.Client(client_id=self.mqtt_config['client_id'])
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.topic_entity = dict()
+        if log_sample_rate is None:
+            log_sample_rate = int(os.environ.get('LOG_SAMPLE_RATE', 1))
+        self.log_sampler = TopicSampler(log_sample_rate)
+        self.host = host
+        if host:
+            self.mqtt_config = host.mqtt_config
+            self.client = host.client
+        else:
+            self.mqtt_config = self.get_mqtt_config()
+            self.client = client or mqtt.Client(client_id=self.mqtt_config['client_id'], protocol=MQTT_PROTOCOLS[self.mqtt_config['protocol']])
+            self.client.on_connect = self.on_connect
+            self.client.on_message = self.on_message
+        self.app_entities = dict()
+        self.entity_sources = dict()
+        self.lock = threading.RLock()
+        self.router = TopicRouter()
+        self.subscriptions = None
+        self.subscription_report = dict()
+        self.handlers = dict()
+        self.handler_names = None
+        self.loop = None
+        self.tasks = set()
+        self.metrics = host.metrics if host else Metrics()
+        self.metrics_reporter = None
+        if metrics_interval is None:
+            metrics_interval = float(os.environ.get('IOTAPP_METRICS_INTERVAL', 0))
+        if metrics_interval and not host:
+            metrics_file = metrics_file or os.environ.get('IOTAPP_METRICS_FILE', None)
+            metrics_topic = None if metrics_file else metrics_topic or 'iotapp/{}/metrics'.format(self.name)
+            self.metrics_reporter = MetricsReporter(self, interval=metrics_interval, topic=metrics_topic, file_name=metrics_file)
+        self.publisher = None
+        if command_interval is None:
+            command_interval = float(os.environ.get('IOTAPP_COMMAND_INTERVAL', 0))
+        if outbound_size is None:
+            outbound_size = int(os.environ.get('IOTAPP_OUTBOUND_SIZE', 0))
+        self.outbound = None
+        if outbound_size and not host:
+            self.outbound = OutboundQueue(
+                self.client,
+                max_depth=outbound_size,
+                max_inflight=int(os.environ.get('IOTAPP_OUTBOUND_INFLIGHT', 100)),
+                batch_size=int(os.environ.get('IOTAPP_OUTBOUND_BATCH_SIZE', 50)),
+                metrics=self.metrics,
+                logger=self.logger,
+            )
+            self.client.on_publish = self.outbound.on_publish
+            self.outbound.start()
+            self.publisher = self.outbound
+            self.metrics.add_gauge('outbound_queue_depth', self.outbound.depth)
+            self.metrics.add_gauge('outbound_inflight', lambda: len(self.outbound.inflight))
+            self.metrics.add_gauge('outbound_merged', lambda: self.outbound.merged)
+            self.metrics.add_gauge('outbound_dropped', lambda: self.outbound.dropped)
+        if host:
+            self.publisher = host.publisher
+        elif command_interval:
+            self.publisher = CommandCoalescer(self.outbound or self.client, interval=command_interval)
+            self.metrics.add_gauge('commands_sent', lambda: self.publisher.sent)
+            self.metrics.add_gauge('commands_merged', lambda: self.publisher.merged)
+            self.metrics.add_gauge('commands_dropped', lambda: self.publisher.dropped)
+        self.scheduler = host.scheduler if host else Scheduler(logger=self.logger)
+        if not host:
+            self.metrics.add_gauge('timers_pending', self.scheduler.pending)
+        self.state_store = None
+        state_file = state_file or os.environ.get('IOTAPP_STATE_FILE', None)
+        if state_file and not host:
+            self.state_store = StateStore(state_file, compact_size=int(os.environ.get('IOTAPP_STATE_COMPACT_SIZE', 1000)), logger=self.logger)
+            self.state_store.load()
+        self.recorder = None
+        record_file = record_file or os.environ.get('IOTAPP_RECORD_FILE', None)
+        if record_file and not host:
+            self.recorder = Recorder(record_file)
+            self.metrics.add_gauge('recorded_messages', lambda: self.recorder.count)
+        self.dispatcher = None
+        if dispatch_workers is None:
+            dispatch_workers = int(os.environ.get('IOTAPP_DISPATCH_WORKERS', 0))
+        if dispatch_workers and not host:
+            self.dispatcher = PoolDispatcher(
+                workers=dispatch_workers,
+                queue_size=dispatch_queue_size or int(os.environ.get('IOTAPP_DISPATCH_QUEUE_SIZE', 1000)),
+                overflow=dispatch_overflow or os.environ.get('IOTAPP_DISPATCH_OVERFLOW', 'block'),
+                logger=self.logger,
+            )
+            self.dispatcher.start()
+            self.metrics.add_gauge('dispatch_queue_depth', self.dispatcher.depth)
+            self.metrics.add_gauge('dispatch_lag_seconds', lambda: self.dispatcher.lag)
+            self.metrics.add_gauge('dispatch_dropped', lambda: self.dispatcher.dropped)
 
     def add_entity(self, name, entity_name):
-        entity = copy(self.entity_library[entity_name])
+        if self.host:
+            entity = self.host.share_entity(entity_name, self, name)
+        else:
+            entity = self.register_entity(name, self.build_entity(name, entity_name))
+            self.entity_sources[name] = entity_name
+        setattr(self, name, entity)
+        for event_type, handler in self.get_handlers(name).items():
+            self.handlers[(name, event_type)] = handler
+        return entity
+
+    def get_handlers(self, name):
+        handlers = dict()
+        if self.handler_names is None:
+            self.handler_names = self.get_handler_names()
+        for event_type, func_name in self.handler_names.get(name, ()):
+            func = getattr(self, func_name)
+            if callable(func):
+                handlers[event_type] = (func_name, func)
+        return handlers
+
+    def get_handler_names(self):
+        # Handlers are methods, scan the class once: entities set on the instance make dir(self) grow.
+        # Entity names may contain '_', index on_<entity>_<event> under every possible entity name
+        handler_names = dict()
+        for func_name in dir(type(self)):
+            if func_name.startswith('on_'):
+                parts = func_name[3:].split('_')
+                for index in range(1, len(parts)):
+                    handler_names.setdefault('_'.join(parts[:index]), []).append(('_'.join(parts[index:]), func_name))
+        return handler_names
+
+    def build_entity(self, name, entity_name):
+        if isinstance(self.entity_library, dict):
+            entity = copy(self.entity_library[entity_name])
+        else:
+            entity = self.entity_library.build(entity_name)
         entity.set_name(name=name)
         entity.set_client(self.client)
+        if self.publisher:
+            entity.set_publisher(self.publisher)
         entity.set_logger(name=name)
         entity.reset_state()
-        setattr(self, name, entity)
+        if self.state_store:
+            # Last known state until the retained messages arrive
+            state = self.state_store.get(entity_name)
+            if state:
+                entity.set_state(state)
+        return entity
+
+    def register_entity(self, name, entity):
+        self.app_entities[name] = entity
+        for topic in entity.get_subscribe_topics():
+            self.router.add(topic, name)
+        self.subscriptions = None
+        return entity
+
+    def unregister_entity(self, name):
+        entity = self.app_entities.pop(name)
         for topic in entity.get_subscribe_topics():
-            self.topic_entity[topic] = name
+            self.router.remove(topic, name)
+        self.subscriptions = None
+        return entity
+
+    def replace_entity(self, name, entity):
+        self.unregister_entity(name)
+        self.register_entity(name, entity)
+        setattr(self, name, entity)
+        return entity
+
+    def get_subscriptions(self):
+        if self.subscriptions is None:
+            subscriptions = dict()
+            topics = set()
+            share_group = self.mqtt_config['share_group']
+            entries = []
+            unshareable = set()
+            for entity in self.app_entities.values():
+                wildcard = entity.subscribe_wildcard if self.subscribe_wildcards else None
+                shareable = entity.get_shareable_topics() if share_group else []
+                for topic, qos in entity.get_subscriptions():
+                    entries.append((topic, qos, wildcard))
+                    if topic not in shareable:
+                        unshareable.add(topic)
+            shared = set()
+            if share_group:
+                # Stateless topics: any replica of the group can process them
+                shared = set(entry[0] for entry in entries if entry[0] not in unshareable)
+            covered = dict()
+            for topic, qos, wildcard in entries:
+                if wildcard and topic not in shared and topic_matches(wildcard, topic):
+                    covered.setdefault(wildcard, set()).add(topic)
+            wildcards = set()
+            for wildcard, wildcard_topics in covered.items():
+                # A wildcard for a single device would receive the whole fleet,
+                # and one covering a shared topic would deliver it to every replica
+                if len(wildcard_topics) >= self.mqtt_config['wildcard_min_topics'] and not any(topic_matches(wildcard, shared_topic) for shared_topic in shared):
+                    wildcards.add(wildcard)
+            for topic, qos, wildcard in entries:
+                topics.add(topic)
+                if topic in shared:
+                    topic = '$share/{}/{}'.format(share_group, topic)
+                elif wildcard in wildcards and topic_matches(wildcard, topic):
+                    topic = wildcard
+                subscriptions[topic] = max(qos, subscriptions.get(topic, qos))
+            self.subscriptions = subscriptions
+            self.subscription_report = dict(
+                topics=len(topics),
+                subscriptions=len(subscriptions),
+                saved=len(topics) - len(subscriptions),
+                shared=len(shared),
+            )
+        return self.subscriptions
+
+    def subscribe(self, subscriptions):
+        chunk_size = self.mqtt_config['subscribe_chunk_size']
+        items = list(subscriptions.items())
+        for start in range(0, len(items), chunk_size):
+            self.client.subscribe(items[start:start + chunk_size])
+
+    def update_subscriptions(self, old_subscriptions):
+        subscriptions = self.get_subscriptions()
+        unsubscribed = [topic for topic in old_subscriptions if topic not in subscriptions]
+        subscribed = dict((topic, qos) for topic, qos in subscriptions.items() if old_subscriptions.get(topic) != qos)
+        if unsubscribed:
+            self.client.unsubscribe(unsubscribed)
+        if subscribed:
+            self.subscribe(subscribed)
+        return subscribed, unsubscribed
 
     def get_mqtt_config(self):
         username = os.environ.get('MQTT_USERNAME', None)
@@ -37,49 +264,163 @@ class IotApp(LoggerMixin):
             keepalive=int(os.environ.get('MQTT_KEEPALIVE', 10)),
             username=os.environ.get('MQTT_USERNAME', None),
             password=os.environ.get('MQTT_PASSWORD', None),
-            client_id=os.environ.get('MQTT_CLIENT_ID', None)
+            client_id=os.environ.get('MQTT_CLIENT_ID', None),
+            subscribe_chunk_size=int(os.environ.get('MQTT_SUBSCRIBE_CHUNK_SIZE', 100)),
+            wildcard_min_topics=int(os.environ.get('MQTT_WILDCARD_MIN_TOPICS', 2)),
+            share_group=os.environ.get('MQTT_SHARE_GROUP', None),
+            protocol=os.environ.get('MQTT_PROTOCOL', '3.1.1'),
         )
 
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
-            try:
-                self.logger.info('Connected to {host}:{port}'.format(**self.mqtt_config))
-                self.client.will_set(self.availability_topic, 'offline', retain=True)
-                self.client.publish(self.availability_topic, 'online', retain=True)
-                for topic, entity_name in self.topic_entity.items():
-                    entity = getattr(self, entity_name)
-                    for topic in entity.get_subscribe_topics():
-                        self.client.subscribe(topic)
-                    try:
-                        entity.on_connect()
-                    except:
-                        self.logger.exception('on_connect {}'.format(entity_name), exc_info=True)
-                        raise
-            except:
-                self.logger.exception('on_connect', exc_info=True)
-        else:
-            msg = mqtt.error_string(rc)
-            self.logger.error('Could not connect to {host}:{port} - Return code {} ({})'.format(rc, msg, **self.mqtt_config))
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        with self.lock:
+            if rc == 0:
+                try:
+                    self.logger.info('Connected to {host}:{port}'.format(**self.mqtt_config))
+                    self.client.will_set(self.availability_topic, 'offline', retain=True)
+                    self.client.publish(self.availability_topic, 'online', retain=True)
+                    self.subscribe(self.get_subscriptions())
+                    if self.outbound:
+                        self.outbound.on_connect()
+                    if self.metrics_reporter and self.metrics_reporter.ident is None:
+                        self.metrics_reporter.start()
+                    if self.subscribe_wildcards:
+                        self.logger.info('Subscribed {subscriptions} filters for {topics} topics ({saved} saved)'.format(**self.subscription_report))
+                    if self.mqtt_config['share_group']:
+                        self.logger.info('Sharing {} topics in group {}'.format(self.subscription_report['shared'], self.mqtt_config['share_group']))
+                    for entity_name, entity in self.app_entities.items():
+                        try:
+                            entity.on_connect()
+                        except:
+                            self.logger.exception('on_connect {}'.format(entity_name), exc_info=True)
+                            raise
+                except:
+                    self.metrics.count_exception('on_connect')
+                    self.logger.exception('on_connect', exc_info=True)
+            else:
+                # MQTT 5 reports a ReasonCode instead of an int
+                msg = mqtt.error_string(rc) if isinstance(rc, int) else str(rc)
+                self.logger.error('Could not connect to {host}:{port} - Return code {} ({})'.format(rc, msg, **self.mqtt_config))
 
     def on_message(self, client, userdata, msg):
+        with self.lock:
+            if self.recorder:
+                self.recorder.record(msg.topic, msg.payload)
+            if self.logger.isEnabledFor(logging.DEBUG) and self.log_sampler.sample(msg.topic):
+                self.logger.debug('on_message - %s %s', msg.topic, msg.payload)
+            metrics = self.metrics
+            metrics.count_message(msg.topic)
+            payload = None
+            for entity_name in self.router.match(msg.topic):
+                try:
+                    if payload is None:
+                        payload = Payload.decode(msg.payload)
+                    entity = self.app_entities[entity_name]
+                    metrics.count_entity(entity_name)
+                    start = time.perf_counter()
+                    events = entity.get_events(msg.topic, payload)
+                    metrics.observe_parse(time.perf_counter() - start)
+                    if self.state_store:
+                        # Keyed by the physical entity, the same in single and host mode
+                        self.state_store.save(self.entity_sources.get(entity_name, entity_name), entity.get_state())
+                    for event in events:
+                        self.dispatch(entity_name, event)
+                except:
+                    metrics.count_exception('on_message')
+                    text = 'on_message - {} - topic: {} - payload: {} - userdata: {}'.format(entity_name, msg.topic, msg.payload, userdata)
+                    self.logger.exception(text, exc_info=True)
+
+    def dispatch(self, name, event):
+        if (name, event.type) not in self.handlers:
+            return
+        if self.dispatcher:
+            self.dispatcher.submit(name, self.process_event, name, event)
+        else:
+            self.process_event(name, event)
+
+    def process_event(self, name, event):
+        handler = self.handlers.get((name, event.type))
+        if handler is None:
+            return
+        func_name, func = handler
+        self.logger.debug('process_event - %s %s', name, event)
         try:
-            self.logger.debug('on_message - {} {}'.format(msg.topic, msg.payload))
-            entity_name = self.topic_entity[msg.topic]
-            entity = getattr(self, entity_name)
-            events = entity.get_events(msg.topic, msg.payload.decode('utf-8'))
-            for event in events:
-                self.process_event(entity_name, event)
+            start = time.perf_counter()
+            result = func(*event.args, **event.kwargs)
+            if result is not None and inspect.isawaitable(result):
+                self.run_coroutine(result, func_name, event)
+            else:
+                self.metrics.observe_handler(self.name, func_name, time.perf_counter() - start)
         except:
-            msg = 'on_message - topic: {} - payload: {} - userdata: {}'.format(msg.topic, msg.payload, userdata)
+            self.metrics.count_exception(func_name)
+            msg = '{} - event: {}'.format(func_name, event)
             self.logger.exception(msg, exc_info=True)
 
-    def process_event(self, name, event):
-        self.logger.debug('process_event - {} {}'.format(name, event))
-        func_name = 'on_{}_{}'.format(name, event.type)
-        func = getattr(self, func_name, None)
-        if func:
-            try:
-                func(*event.args, **event.kwargs)
-            except:
-                msg = '{} - event: {}'.format(func_name, event)
-                self.logger.exception(msg, exc_info=True)
+    def run_in(self, delay, callback, *args, entity=None, name=None):
+        name = name or callback.__name__
+        key = (self.name, entity, name)
+        self.scheduler.run_in(delay, self.fire_timer, args=(entity, name, callback, args), key=key, group=(self.name, entity))
+        return key
+
+    def cancel_timer(self, entity=None, name=None):
+        if name is None:
+            return self.scheduler.cancel_group((self.name, entity))
+        return self.scheduler.cancel((self.name, entity, name))
+
+    def fire_timer(self, entity, func_name, callback, args):
+        # Timers run where the entity handlers run: its dispatch queue with a pool, else under the on_message lock
+        dispatcher = (self.host or self).dispatcher
+        if dispatcher:
+            key = self.entity_sources.get(entity, entity) if self.host else entity
+            dispatcher.submit(key or self.name, self.run_timer, func_name, callback, args)
+            return
+        with (self.host or self).lock:
+            self.run_timer(func_name, callback, args)
+
+    def run_timer(self, func_name, callback, args):
+        try:
+            start = time.perf_counter()
+            result = callback(*args)
+            if result is not None and inspect.isawaitable(result):
+                self.run_coroutine(result, func_name, 'timer')
+            else:
+                self.metrics.observe_handler(self.name, func_name, time.perf_counter() - start)
+        except:
+            self.metrics.count_exception(func_name)
+            self.logger.exception('{} - timer'.format(func_name), exc_info=True)
+
+    def get_loop(self):
+        if self.host:
+            return self.host.get_loop()
+        return self.loop
+
+    def run_coroutine(self, coroutine, func_name, event):
+        loop = self.get_loop()
+        if loop is None:
+            asyncio.run(self.await_handler(coroutine, func_name, event))
+        elif not self.in_loop(loop):
+            loop.call_soon_threadsafe(self.run_coroutine, coroutine, func_name, event)
+        else:
+            task = loop.create_task(self.await_handler(coroutine, func_name, event))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return task
+
+    def in_loop(self, loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    async def await_handler(self, coroutine, func_name, event):
+        try:
+            start = time.perf_counter()
+            await coroutine
+            self.metrics.observe_handler(self.name, func_name, time.perf_counter() - start)
+        except:
+            self.metrics.count_exception(func_name)
+            msg = '{} - event: {}'.format(func_name, event)
+            self.logger.exception(msg, exc_info=True)
+
+    async def wait_tasks(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
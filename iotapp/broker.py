@@ -0,0 +1,381 @@
+import socket
+import socketserver
+import struct
+import threading
+from iotapp.logger import LoggerMixin
+from iotapp.router import TopicRouter, topic_matches
+
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+MAX_QOS = 1
+SUBSCRIBE_FAILURE = 0x80
+SHARE_PREFIX = '$share/'
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_length(length):
+    data = bytearray()
+    while True:
+        byte = length % 128
+        length = length // 128
+        if length:
+            byte |= 0x80
+        data.append(byte)
+        if not length:
+            return bytes(data)
+
+
+def encode_string(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return struct.pack('!H', len(value)) + value
+
+
+def encode_packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + encode_length(len(body)) + body
+
+
+def split_shared(topic_filter):
+    if not topic_filter.startswith(SHARE_PREFIX):
+        return None, topic_filter
+    parts = topic_filter.split('/', 2)
+    if len(parts) < 3 or not parts[1] or not parts[2] or '+' in parts[1] or '#' in parts[1]:
+        raise ProtocolError('Invalid shared subscription {}'.format(topic_filter))
+    return parts[1], parts[2]
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, size):
+        if self.position + size > len(self.data):
+            raise ProtocolError('Packet too short')
+        value = self.data[self.position:self.position + size]
+        self.position += size
+        return value
+
+    def read_byte(self):
+        return self.read(1)[0]
+
+    def read_short(self):
+        return struct.unpack('!H', self.read(2))[0]
+
+    def read_bytes(self):
+        return self.read(self.read_short())
+
+    def read_string(self):
+        return self.read_bytes().decode('utf-8')
+
+    def read_rest(self):
+        value = self.data[self.position:]
+        self.position = len(self.data)
+        return value
+
+    def at_end(self):
+        return self.position >= len(self.data)
+
+
+class Session:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.client_id = None
+        self.keepalive = 0
+        self.will = None
+        self.subscriptions = dict()
+        self.lock = threading.Lock()
+        self.packet_id = 0
+        self.closed = False
+
+    def send(self, data):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.closed = True
+
+    def next_packet_id(self):
+        with self.lock:
+            self.packet_id = self.packet_id % 65535 + 1
+            return self.packet_id
+
+    def deliver(self, topic, payload, qos, retain=False):
+        flags = (qos << 1) | (1 if retain else 0)
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack('!H', self.next_packet_id())
+        self.send(encode_packet(PUBLISH, flags, body + payload))
+
+    def get_qos(self, topic):
+        qos = None
+        for topic_filter, filter_qos in self.subscriptions.items():
+            if topic_matches(topic_filter, topic):
+                qos = filter_qos if qos is None else max(qos, filter_qos)
+        return qos
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.session = Session(self.server.broker, self.request)
+        self.buffer = self.request.makefile('rb')
+
+    def read_packet(self):
+        header = self.buffer.read(1)
+        if not header:
+            return None, None, None
+        length = 0
+        multiplier = 1
+        while True:
+            byte = self.buffer.read(1)
+            if not byte:
+                return None, None, None
+            length += (byte[0] & 0x7f) * multiplier
+            if not byte[0] & 0x80:
+                break
+            multiplier *= 128
+            if multiplier > 128 ** 3:
+                raise ProtocolError('Malformed remaining length')
+        body = self.buffer.read(length) if length else b''
+        if len(body) < length:
+            return None, None, None
+        return header[0] >> 4, header[0] & 0x0f, body
+
+    def handle(self):
+        broker = self.server.broker
+        clean = False
+        try:
+            packet_type, flags, body = self.read_packet()
+            if packet_type != CONNECT:
+                return
+            if not broker.on_connect(self.session, Reader(body)):
+                return
+            if self.session.keepalive:
+                self.request.settimeout(self.session.keepalive * 1.5)
+            while True:
+                packet_type, flags, body = self.read_packet()
+                if packet_type is None:
+                    break
+                if packet_type == DISCONNECT:
+                    clean = True
+                    break
+                broker.on_packet(self.session, packet_type, flags, Reader(body))
+        except (OSError, ProtocolError):
+            pass
+        finally:
+            broker.on_disconnect(self.session, clean)
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Broker(LoggerMixin):
+    def __init__(self, host='127.0.0.1', port=0, logger=None):
+        self.logger = logger or self.get_logger(name='broker')
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.router = TopicRouter()
+        self.shared = TopicRouter()
+        self.share_groups = dict()
+        self.retained = dict()
+        self.sessions = dict()
+        self.server = None
+        self.thread = None
+        self.received = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.server = BrokerServer((self.host, self.port), BrokerHandler)
+        self.server.broker = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs=dict(poll_interval=0.05), name='broker', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        for session in list(self.sessions.values()):
+            session.close()
+        self.server.server_close()
+        self.thread.join()
+
+    def get_environ(self):
+        return dict(MQTT_HOST=self.host, MQTT_PORT=str(self.port))
+
+    def on_connect(self, session, reader):
+        protocol = reader.read_string()
+        level = reader.read_byte()
+        flags = reader.read_byte()
+        session.keepalive = reader.read_short()
+        if protocol not in ('MQTT', 'MQIsdp') or level not in (3, 4):
+            session.send(encode_packet(CONNACK, 0, bytes([0, 1])))
+            return False
+        session.client_id = reader.read_string() or 'auto-{}'.format(id(session))
+        if flags & 0x04:
+            will_topic = reader.read_string()
+            will_payload = reader.read_bytes()
+            session.will = (will_topic, will_payload, (flags >> 3) & 0x03, bool(flags & 0x20))
+        with self.lock:
+            previous = self.sessions.get(session.client_id)
+            self.sessions[session.client_id] = session
+        if previous:
+            previous.will = None
+            previous.close()
+        session.send(encode_packet(CONNACK, 0, bytes([0, 0])))
+        self.logger.debug('connect %s', session.client_id)
+        return True
+
+    def on_packet(self, session, packet_type, flags, reader):
+        if packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = bool(flags & 0x01)
+            topic = reader.read_string()
+            packet_id = reader.read_short() if qos else None
+            payload = reader.read_rest()
+            self.publish(topic, payload, qos=qos, retain=retain)
+            if qos == 1:
+                session.send(encode_packet(PUBACK, 0, struct.pack('!H', packet_id)))
+            elif qos == 2:
+                session.send(encode_packet(PUBREC, 0, struct.pack('!H', packet_id)))
+        elif packet_type == PUBREL:
+            session.send(encode_packet(PUBCOMP, 0, reader.read(2)))
+        elif packet_type == PUBREC:
+            session.send(encode_packet(PUBREL, 0x02, reader.read(2)))
+        elif packet_type == SUBSCRIBE:
+            packet_id = reader.read_short()
+            granted = []
+            filters = []
+            while not reader.at_end():
+                topic_filter = reader.read_string()
+                qos = min(reader.read_byte() & 0x03, MAX_QOS)
+                try:
+                    self.subscribe(session, topic_filter, qos)
+                except ProtocolError:
+                    granted.append(SUBSCRIBE_FAILURE)
+                    continue
+                granted.append(qos)
+                filters.append(topic_filter)
+            session.send(encode_packet(SUBACK, 0, struct.pack('!H', packet_id) + bytes(granted)))
+            self.send_retained(session, filters)
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = reader.read_short()
+            while not reader.at_end():
+                self.unsubscribe(session, reader.read_string())
+            session.send(encode_packet(UNSUBACK, 0, struct.pack('!H', packet_id)))
+        elif packet_type == PINGREQ:
+            session.send(encode_packet(PINGRESP, 0, b''))
+
+    def on_disconnect(self, session, clean):
+        with self.lock:
+            for topic_filter in list(session.subscriptions):
+                self.remove_subscription(session, topic_filter)
+            if self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+        session.close()
+        if session.will and not clean:
+            topic, payload, qos, retain = session.will
+            self.publish(topic, payload, qos=qos, retain=retain)
+        self.logger.debug('disconnect %s', session.client_id)
+
+    def subscribe(self, session, topic_filter, qos):
+        group, shared_filter = split_shared(topic_filter)
+        with self.lock:
+            session.subscriptions[topic_filter] = qos
+            if group is None:
+                self.router.add(topic_filter, session)
+            else:
+                # $share/<group>/<filter>: each message goes to one member of the group
+                key = (group, shared_filter)
+                members = self.share_groups.setdefault(key, [])
+                if session not in members:
+                    members.append(session)
+                self.shared.add(shared_filter, key)
+
+    def unsubscribe(self, session, topic_filter):
+        with self.lock:
+            self.remove_subscription(session, topic_filter)
+
+    def remove_subscription(self, session, topic_filter):
+        if session.subscriptions.pop(topic_filter, None) is None:
+            return
+        group, shared_filter = split_shared(topic_filter)
+        if group is None:
+            self.router.remove(topic_filter, session)
+            return
+        key = (group, shared_filter)
+        members = self.share_groups[key]
+        members.remove(session)
+        if not members:
+            del self.share_groups[key]
+            self.shared.remove(shared_filter, key)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self.lock:
+            self.received += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+            sessions = self.router.match(topic)
+            shared = []
+            for key in self.shared.match(topic):
+                # Round robin between the group members
+                members = self.share_groups[key]
+                member = members.pop(0)
+                members.append(member)
+                shared.append((member, member.subscriptions['{}{}/{}'.format(SHARE_PREFIX, *key)]))
+        for session in sessions:
+            session_qos = session.get_qos(topic)
+            if session_qos is not None:
+                session.deliver(topic, payload, min(qos, session_qos))
+        for session, session_qos in shared:
+            session.deliver(topic, payload, min(qos, session_qos))
+
+    def send_retained(self, session, filters):
+        with self.lock:
+            retained = list(self.retained.items())
+        for topic, (payload, qos) in retained:
+            session_qos = None
+            for topic_filter in filters:
+                if topic_matches(topic_filter, topic):
+                    session_qos = max(session_qos or 0, session.subscriptions.get(topic_filter, 0))
+            if session_qos is not None:
+                session.deliver(topic, payload, min(qos, session_qos), retain=True)
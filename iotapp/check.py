@@ -0,0 +1,102 @@
+import inspect
+from copy import copy
+from importlib import import_module
+from iotapp.config import DEVICE_CLASS, validate_device
+from iotapp.host import HOST_OPTIONS
+
+
+def check_config(devices, apps):
+    errors = []
+    entities = check_devices(devices or dict(), errors)
+    check_apps(apps or dict(), entities, errors)
+    return errors
+
+
+def check_devices(devices, errors):
+    entities = dict()
+    for name, config in devices.items():
+        if not isinstance(config, dict):
+            errors.append(('devices', name, 'Wrong configuration.'))
+            continue
+        error = validate_device(name, config)
+        if error is None and config['type'] not in DEVICE_CLASS:
+            error = 'Unknown type "{}".'.format(config['type'])
+        if error:
+            errors.append(('devices', name, error))
+            continue
+        config = copy(config)
+        device_class = DEVICE_CLASS[config.pop('type')]
+        try:
+            device = device_class(name, **config)
+        except Exception as e:
+            errors.append(('devices', name, 'Wrong configuration: {}'.format(e)))
+            continue
+        for entity_name in device.entities:
+            if entity_name in entities:
+                errors.append(('devices', name, 'Duplicated entity "{}", already defined by "{}".'.format(entity_name, entities[entity_name])))
+            else:
+                entities[entity_name] = name
+    return entities
+
+
+def check_apps(apps, entities, errors):
+    app_classes = dict()
+    host_options = dict()
+    for name, config in apps.items():
+        if not isinstance(config, dict):
+            errors.append(('apps', name, 'Wrong configuration.'))
+            continue
+        if 'app' not in config:
+            errors.append(('apps', name, 'Missing app.'))
+            continue
+        path = config['app']
+        if path not in app_classes:
+            app_class = load_app_class(path)
+            app_classes[path] = app_class if isinstance(app_class, str) else get_app_options(app_class)
+        if isinstance(app_classes[path], str):
+            errors.append(('apps', name, app_classes[path]))
+            continue
+        entity_options, options = app_classes[path]
+        for entity_name in config.get('entities', dict()) or dict():
+            if entity_name not in entities:
+                errors.append(('apps', name, 'Entity "{}" not available.'.format(entity_name)))
+        for option, value in config.items():
+            if option in ['app', 'entities']:
+                continue
+            if option in entity_options:
+                if isinstance(value, str) and value not in entities:
+                    errors.append(('apps', name, 'Entity "{}" not available.'.format(value)))
+            elif option not in options:
+                errors.append(('apps', name, 'Unknown option "{}".'.format(option)))
+            elif option in HOST_OPTIONS:
+                # Apps run hosted on one connection unless started alone
+                if option in host_options and host_options[option][1] != value:
+                    errors.append(('apps', name, 'Option "{}" differs from app "{}", hosted apps share it.'.format(option, host_options[option][0])))
+                else:
+                    host_options.setdefault(option, (name, value))
+
+
+def load_app_class(path):
+    if not isinstance(path, str) or '.' not in path:
+        return 'Wrong app "{}".'.format(path)
+    module_name, class_name = path.rsplit('.', 1)
+    try:
+        return getattr(import_module(module_name), class_name)
+    except Exception as e:
+        return 'Cannot import "{}": {}'.format(path, e)
+
+
+def get_app_options(app_class):
+    # Entity options are declared by each class, subclasses add to their parents ones
+    entity_options = set()
+    options = set()
+    for cls in app_class.__mro__:
+        entity_options.update(cls.__dict__.get('entity_options', ()))
+        init = cls.__dict__.get('__init__')
+        if init is None or cls is object:
+            continue
+        for parameter in inspect.signature(init).parameters.values():
+            if parameter.kind != parameter.POSITIONAL_OR_KEYWORD or parameter.name == 'self':
+                continue
+            options.add(parameter.name)
+    return entity_options, options - entity_options - {'name', 'entity_library', 'client', 'logger', 'host'}
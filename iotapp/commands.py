@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class CommandCoalescer:
+    def __init__(self, client, interval=0.1):
+        self.client = client
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_sent = dict()
+        self.pending = dict()
+        self.timers = dict()
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        now = time.monotonic()
+        with self.lock:
+            pending = self.pending.get(topic)
+            if pending is not None:
+                # Latest value wins, the timer already waits for this topic
+                if pending[0] == payload:
+                    self.dropped += 1
+                else:
+                    self.merged += 1
+                self.pending[topic] = (payload, qos, retain)
+                return
+            last_sent = self.last_sent.get(topic)
+            if last_sent is not None and now - last_sent < self.interval:
+                self.pending[topic] = (payload, qos, retain)
+                timer = threading.Timer(last_sent + self.interval - now, self.flush, args=(topic,))
+                timer.daemon = True
+                self.timers[topic] = timer
+                timer.start()
+                return
+            self.last_sent[topic] = now
+            self.sent += 1
+        self.client.publish(topic, payload, qos=qos, retain=retain)
+
+    def flush(self, topic):
+        with self.lock:
+            self.timers.pop(topic, None)
+            pending = self.pending.pop(topic, None)
+            if pending is None:
+                return
+            self.last_sent[topic] = time.monotonic()
+            self.sent += 1
+        payload, qos, retain = pending
+        self.client.publish(topic, payload, qos=qos, retain=retain)
+
+    def flush_all(self):
+        with self.lock:
+            timers = list(self.timers.items())
+        for topic, timer in timers:
+            timer.cancel()
+            self.flush(topic)
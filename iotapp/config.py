@@ -1,9 +1,22 @@
+import hashlib
+import os
+import pickle
+import platform
+import re
+import sys
 import yaml
+from collections.abc import Mapping
 from copy import copy
+from iotapp import version
 from iotapp.devices import aqara
 from iotapp.devices import shelly
 from iotapp.logger import LoggerMixin
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 DEVICE_CLASS = {
     'aqara-button': aqara.Button,
@@ -11,18 +24,91 @@ DEVICE_CLASS = {
 }
 
 
+def load_yaml(data):
+    return yaml.load(data, Loader=SafeLoader)
+
+
+CACHE_FILE = re.compile(r'^[0-9a-f]{64}\.pickle$')
+
+
+class ConfigCache(LoggerMixin):
+    def __init__(self, directory, keep=3, logger=None):
+        self.directory = directory
+        self.keep = keep
+        self.logger = logger or self.get_logger(name='config_cache')
+
+    def get_key(self, *contents):
+        digest = hashlib.sha256()
+        digest.update('{} {}'.format(version, platform.python_version()).encode('utf-8'))
+        for device_class in DEVICE_CLASS.values():
+            module_file = sys.modules[device_class.__module__].__file__
+            stat = os.stat(module_file)
+            digest.update('{} {} {}'.format(module_file, stat.st_mtime_ns, stat.st_size).encode('utf-8'))
+        for content in contents:
+            digest.update(str(len(content)).encode('utf-8'))
+            digest.update(content)
+        return digest.hexdigest()
+
+    def get_file_name(self, key):
+        return os.path.join(self.directory, '{}.pickle'.format(key))
+
+    def load(self, key):
+        try:
+            with open(self.get_file_name(key), 'rb') as cache_file:
+                return pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.logger.warning('Discarding unreadable config cache {}'.format(key))
+            return None
+
+    def save(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = self.get_file_name(key)
+        temp_name = '{}.{}.tmp'.format(file_name, os.getpid())
+        with open(temp_name, 'wb') as cache_file:
+            pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_name, file_name)
+        self.prune(os.path.basename(file_name))
+
+    def prune(self, current):
+        # Keep a few recent configurations to switch back to, never touch foreign files
+        others = []
+        for other_name in os.listdir(self.directory):
+            if CACHE_FILE.match(other_name) and other_name != current:
+                try:
+                    others.append((os.stat(os.path.join(self.directory, other_name)).st_mtime, other_name))
+                except OSError:
+                    pass
+        others.sort(reverse=True)
+        for mtime, other_name in others[max(self.keep - 1, 0):]:
+            try:
+                os.remove(os.path.join(self.directory, other_name))
+            except OSError:
+                pass
+
+
 class DeviceManager(LoggerMixin):
-    def __init__(self, devices=dict(), log_level=None, logger=None):
+    def __init__(self, devices=dict(), expanded=None, errors=None, log_level=None, logger=None):
         self.logger = logger or self.get_logger(name='manager', level=log_level)
         self.devices = dict()
+        self.errors = dict()
+        if expanded is not None:
+            self.devices = expanded
+            devices = dict()
+            # Cached configuration, report the devices discarded when it was built
+            for name, error in (errors or dict()).items():
+                self.logger.error('device discarded: {} - {}'.format(name, error))
+            self.errors = errors or dict()
         for name, config in devices.items():
             try:
                 config = copy(config)
                 device_type = config.pop('type')
                 device_class = DEVICE_CLASS[device_type]
                 device = device_class(name, **config)
-                self.devices[name] = device.get_entities()
-            except:
+                self.devices[name] = device.entities
+            except Exception as e:
+                self.errors[name] = '{}: {}'.format(type(e).__name__, e)
                 msg = 'device discarded: {}'.format(name)
                 self.logger.exception(msg, exc_info=True)
         self.entities = self.get_entities(self.devices)
@@ -39,6 +125,54 @@ class DeviceManager(LoggerMixin):
         return entities
 
 
+class EntityLibrary(Mapping):
+    def __init__(self, entities=dict(), entities_config=dict()):
+        self.entities = entities
+        self.entities_config = entities_config
+        self.cache = dict()
+
+    def load(self, entities, entities_config, names=()):
+        # Only the entities in use are compared, the others are built from the new config when asked
+        old_specs = dict((entity_name, self.get_spec(entity_name)) for entity_name in names if entity_name in self.entities)
+        self.entities = entities
+        self.entities_config = entities_config
+        changed = set()
+        cache = dict()
+        for entity_name, spec in old_specs.items():
+            if entity_name in entities and self.get_spec(entity_name) == spec:
+                if entity_name in self.cache:
+                    cache[entity_name] = self.cache[entity_name]
+            else:
+                changed.add(entity_name)
+        self.cache = cache
+        return changed
+
+    def get_spec(self, entity_name):
+        entity_data = self.entities[entity_name]
+        entity_config = copy(entity_data['config'])
+        entity_config.update(self.entities_config.get(entity_name, dict()) or dict())
+        return entity_data['class'], entity_config
+
+    def build(self, entity_name):
+        entity_class, entity_config = self.get_spec(entity_name)
+        return entity_class(**entity_config)
+
+    def __getitem__(self, entity_name):
+        entity = self.cache.get(entity_name)
+        if entity is None:
+            entity = self.cache[entity_name] = self.build(entity_name)
+        return entity
+
+    def __contains__(self, entity_name):
+        return entity_name in self.entities
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __len__(self):
+        return len(self.entities)
+
+
 def validate_devices(devices):
     ok = dict()
     ko = dict()
@@ -86,13 +220,12 @@ def validate_apps(devices, apps):
 
 
 def validate_app(app_name, app, entities):
-    available_entities = list(entities.keys())
     if 'module' not in app:
         return 'Missing module.'
     if 'class' not in app:
         return 'Missing class.'
     for entity in app['entities']:
-        if entity not in available_entities:
+        if entity not in entities:
             return 'Entity "{}" not available.'.format(entity)
     return None
 
@@ -103,3 +236,4 @@ def get_entities(devices):
         for entity in value.get('entities', dict()).keys():
             entities[entity] = key
     return entities
+
@@ -3,6 +3,8 @@ from .base import Device
 
 
 class Button(Device):
+    subscribe_wildcard = 'zigbee/+'
+
     def __init__(self, name):
         super().__init__(name=name)
 
@@ -13,6 +15,7 @@ class Button(Device):
             state_topic='zigbee/{}'.format(self.name),
             state_value_click = 'single',
             state_template = '{{ value.click }}',
+            subscribe_wildcard=self.subscribe_wildcard,
         )
         entity[self.name] = {'class': entities.Button, 'config': config}
         return entity
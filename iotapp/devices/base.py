@@ -1,4 +1,6 @@
 class Device:
+    subscribe_wildcard = None
+
     def __init__(self, name):
         self.name = name
         self.entities = self.get_entities()
@@ -3,6 +3,8 @@ from iotapp.devices.base import Device
 
 
 class Rgbw2(Device):
+    subscribe_wildcard = 'shellies/#'
+
     def __init__(self, name, mode='white', channel1=None, channel2=None, channel3=None, channel4=None):
         self.mode = mode
         self.channels = [channel1, channel2, channel3, channel4]
@@ -26,4 +28,5 @@ class Rgbw2(Device):
             brightness_state_template='{{ value.brightness }}',
             brightness_command_topic='shellies/{}/white/{}/set'.format(name, number),
             brightness_command_template='{"brightness": {{ value }}}',
+            subscribe_wildcard=self.subscribe_wildcard,
         )
\ No newline at end of file
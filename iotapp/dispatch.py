@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+import zlib
+from iotapp.logger import LoggerMixin
+
+
+OVERFLOW_POLICIES = ('block', 'drop_new', 'drop_old')
+
+
+class PoolDispatcher(LoggerMixin):
+    def __init__(self, workers=4, queue_size=1000, overflow='block', drop_log_interval=1000, logger=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Wrong overflow policy: {}'.format(overflow))
+        self.logger = logger or self.get_logger(name='dispatch')
+        self.overflow = overflow
+        self.drop_log_interval = drop_log_interval
+        self.queues = [queue.Queue(maxsize=queue_size) for i in range(workers)]
+        self.threads = []
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        for number, work_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self.work, args=(work_queue,), name='dispatch-{}'.format(number), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for work_queue in self.queues:
+            work_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def join(self):
+        for work_queue in self.queues:
+            work_queue.join()
+
+    def get_queue(self, key):
+        return self.queues[zlib.crc32(key.encode('utf-8')) % len(self.queues)]
+
+    def submit(self, key, func, *args):
+        work_queue = self.get_queue(key)
+        item = (time.monotonic(), func, args)
+        if self.overflow == 'block':
+            work_queue.put(item)
+        elif self.overflow == 'drop_new':
+            try:
+                work_queue.put_nowait(item)
+            except queue.Full:
+                self.drop()
+                return False
+        else:
+            while True:
+                try:
+                    work_queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        work_queue.get_nowait()
+                        work_queue.task_done()
+                        self.drop()
+                    except queue.Empty:
+                        pass
+        with self.lock:
+            self.submitted += 1
+        return True
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+            dropped = self.dropped
+        # Under overload every event drops, the dispatch_dropped gauge has the totals
+        if dropped == 1:
+            self.logger.warning('Queue full, event dropped')
+        elif dropped % self.drop_log_interval == 0:
+            self.logger.warning('Queue full, {} events dropped'.format(dropped))
+
+    def work(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                break
+            enqueued, func, args = item
+            lag = time.monotonic() - enqueued
+            with self.lock:
+                self.lag = lag
+                self.max_lag = max(self.max_lag, lag)
+            try:
+                func(*args)
+            except:
+                self.logger.exception('dispatch - {}'.format(func), exc_info=True)
+            finally:
+                with self.lock:
+                    self.processed += 1
+                work_queue.task_done()
+
+    def depth(self):
+        return sum(work_queue.qsize() for work_queue in self.queues)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                workers=len(self.queues),
+                depth=self.depth(),
+                submitted=self.submitted,
+                processed=self.processed,
+                dropped=self.dropped,
+                lag=self.lag,
+                max_lag=self.max_lag,
+            )
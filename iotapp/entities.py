@@ -1,9 +1,26 @@
 from iotapp.events import Event
-from iotapp.logger import LoggerMixin
-from iotapp.utils import get_template_value
+from iotapp.logger import EntityLogger, LoggerMixin
+from iotapp.utils import compile_template, get_template_value
 
 
 class Entity(LoggerMixin):
+    __slots__ = (
+        'name',
+        'client',
+        'publisher',
+        'log_level',
+        'logger',
+        'availability_topic',
+        'availability_online',
+        'availability_offline',
+        'qos',
+        'topic_qos',
+        'command_qos',
+        'command_retain',
+        'subscribe_wildcard',
+        'available',
+    )
+
     def __init__(
                     self,
                     name=None,
@@ -13,24 +30,61 @@ class Entity(LoggerMixin):
                     availability_topic=None,
                     availability_online='online',
                     availability_offline='offline',
+                    qos=0,
+                    topic_qos=None,
+                    command_qos=0,
+                    command_retain=False,
+                    subscribe_wildcard=None,
                 ):
         self.set_name(name)
         self.set_client(client)
         self.log_level = log_level
-        self.logger = logger or self.get_logger(name='entity')
+        self.logger = logger or self.get_entity_logger(name)
         self.availability_topic = availability_topic
         self.availability_online = availability_online
         self.availability_offline = availability_offline
+        self.qos = qos
+        self.topic_qos = topic_qos
+        self.command_qos = command_qos
+        self.command_retain = command_retain
+        self.subscribe_wildcard = subscribe_wildcard
         self.reset_state()
 
     def reset_state(self):
         self.available = None
 
+    def get_state(self):
+        return dict(available=self.available)
+
+    def set_state(self, state):
+        self.available = state.get('available')
+
     def set_name(self, name):
         self.name = name
 
     def set_client(self, client):
         self.client = client
+        self.publisher = client
+
+    def set_publisher(self, publisher):
+        self.publisher = publisher
+
+    def publish(self, topic, payload=None, qos=None, retain=None):
+        if qos is None:
+            qos = self.command_qos
+        if retain is None:
+            retain = self.command_retain
+        self.publisher.publish(topic, payload, qos=qos, retain=retain)
+
+    def get_entity_logger(self, name=None):
+        # One logger per entity class and level, the entity name goes in the message
+        logger_name = 'entity.{}'.format(type(self).__name__.lower())
+        if self.log_level:
+            logger_name = '{}.{}'.format(logger_name, self.log_level)
+        return EntityLogger(self.get_logger(name=logger_name), name)
+
+    def set_logger(self, name=''):
+        self.logger = self.get_entity_logger(name or self.name)
 
     def get_subscribe_topics(self):
         topics = []
@@ -38,8 +92,16 @@ class Entity(LoggerMixin):
             topics.append(self.availability_topic)
         return topics
 
+    def get_shareable_topics(self):
+        return []
+
+    def get_subscriptions(self):
+        if not self.topic_qos:
+            return [(topic, self.qos) for topic in self.get_subscribe_topics()]
+        return [(topic, self.topic_qos.get(topic, self.qos)) for topic in self.get_subscribe_topics()]
+
     def get_events(self, topic, payload):
-        self.logger.debug('get_events - {} {}'.format(topic, payload))
+        self.logger.debug('get_events - %s %s', topic, payload)
         events = []
         if topic == self.availability_topic:
             value = None
@@ -63,6 +125,8 @@ class Entity(LoggerMixin):
 
 
 class StateEntity(Entity):
+    __slots__ = ('state_topic', 'state_template', 'state_compiled', 'state')
+
     def __init__(   self,
                     state_topic=None,
                     state_template='',
@@ -71,12 +135,22 @@ class StateEntity(Entity):
         super().__init__(**kwargs)
         self.state_topic = state_topic
         self.state_template = state_template
+        self.state_compiled = compile_template(state_template)
         self.reset_state()
 
     def reset_state(self):
         super().reset_state()
         self.state = None
 
+    def get_state(self):
+        state = super().get_state()
+        state['state'] = self.state
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.state = state.get('state')
+
     def get_subscribe_topics(self):
         topics = super().get_subscribe_topics()
         if self.state_topic:
@@ -86,7 +160,7 @@ class StateEntity(Entity):
     def get_events(self, topic, payload):
         events = super().get_events(topic, payload)
         if topic == self.state_topic:
-            value = get_template_value(payload, self.state_template)
+            value = get_template_value(payload, self.state_compiled)
             events += self.get_state_events(value)
         return events
 
@@ -95,6 +169,8 @@ class StateEntity(Entity):
 
 
 class Button(StateEntity):
+    __slots__ = ('state_value_click',)
+
     def __init__(   self,
                     state_value_click='click',
                     **kwargs,
@@ -102,6 +178,13 @@ class Button(StateEntity):
         super().__init__(**kwargs)
         self.state_value_click = state_value_click
 
+    def get_shareable_topics(self):
+        # Clicks do not depend on previous messages
+        topics = super().get_shareable_topics()
+        if self.state_topic:
+            topics.append(self.state_topic)
+        return topics
+
     def get_state_events(self, value):
         events = super().get_state_events(value)
         if value == self.state_value_click:
@@ -110,6 +193,23 @@ class Button(StateEntity):
 
 
 class Light(StateEntity):
+    __slots__ = (
+        'state_value_on',
+        'state_value_off',
+        'command_topic',
+        'command_type',
+        'command_value_on',
+        'command_value_off',
+        'command_value_template',
+        'brightness_state_topic',
+        'brightness_state_template',
+        'brightness_state_compiled',
+        'brightness_command_topic',
+        'brightness_command_template',
+        'brightness_command_compiled',
+        '_brightness',
+    )
+
     def __init__(   self,
                     state_value_on='on',
                     state_value_off='off',
@@ -135,13 +235,25 @@ class Light(StateEntity):
         self.command_value_template = command_value_template
         self.brightness_state_topic = brightness_state_topic
         self.brightness_state_template = brightness_state_template
+        self.brightness_state_compiled = compile_template(brightness_state_template)
         self.brightness_command_topic = brightness_command_topic
         self.brightness_command_template = brightness_command_template
+        self.brightness_command_compiled = compile_template(brightness_command_template)
 
     def reset_state(self):
         super().reset_state()
         self._brightness = None
 
+    def get_state(self):
+        state = super().get_state()
+        state['brightness'] = self._brightness
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        # Not the property, restoring must not publish a command
+        self._brightness = state.get('brightness')
+
     def get_subscribe_topics(self):
         topics = super().get_subscribe_topics()
         if self.brightness_state_topic:
@@ -151,11 +263,11 @@ class Light(StateEntity):
     def get_events(self, topic, payload):
         events = super().get_events(topic, payload)
         if topic == self.brightness_state_topic:
-            value = get_template_value(payload, self.brightness_state_template)
+            value = get_template_value(payload, self.brightness_state_compiled)
             value = round(float(value))
             if not value == self._brightness:
                 self._brightness = value
-                self.logger.debug('brightness {}'.format(value))
+                self.logger.debug('brightness %s', value)
                 events.append(Event('brightness_change', value))
         return events
 
@@ -168,15 +280,15 @@ class Light(StateEntity):
         return events
 
     def turn_on(self):
-        self.client.publish(self.command_topic, payload=self.command_value_on)
+        self.publish(self.command_topic, self.command_value_on)
         self.logger.debug('turn_on')
 
     def turn_off(self):
-        self.client.publish(self.command_topic, payload=self.command_value_off)
+        self.publish(self.command_topic, self.command_value_off)
         self.logger.debug('turn_off')
 
     def toggle(self):
-        self.logger.debug('toggle - state: {}'.format(self.state))
+        self.logger.debug('toggle - state: %s', self.state)
         if self.state == 'on':
             self.turn_off()
             return 'off'
@@ -192,7 +304,7 @@ class Light(StateEntity):
     @brightness.setter
     def brightness(self, value):
         self._brightness = value
-        self.client.publish(
+        self.publish(
             self.brightness_command_topic,
-            payload=get_template_value(value, self.brightness_command_template, json=False)
+            get_template_value(value, self.brightness_command_compiled, json=False),
         )
@@ -1,4 +1,6 @@
 class Event(object):
+    __slots__ = ('type', 'args', 'kwargs')
+
     def __init__(self, type, *args, **kwargs):
         self.type = type
         self.args = args
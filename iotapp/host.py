@@ -0,0 +1,95 @@
+from iotapp.base import IotApp
+
+
+# Engine options of the connection, hosted apps share the host ones
+HOST_OPTIONS = (
+    'subscribe_wildcards',
+    'dispatch_workers',
+    'dispatch_queue_size',
+    'dispatch_overflow',
+    'command_interval',
+    'outbound_size',
+    'state_file',
+    'record_file',
+    'log_sample_rate',
+    'metrics_interval',
+    'metrics_topic',
+    'metrics_file',
+)
+
+
+class AppHost(IotApp):
+    def __init__(self, name='iotapp', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.apps = dict()
+        self.entity_apps = dict()
+
+    def add_app(self, name, app_class, **config):
+        for option in HOST_OPTIONS:
+            if option in config:
+                self.logger.warning('{} - option {} ignored, hosted apps use the host one'.format(name, option))
+                del config[option]
+        app = app_class(name=name, entity_library=self.entity_library, host=self, **config)
+        self.apps[name] = app
+        if self.client.is_connected():
+            # Added by a reload, on_connect already ran
+            self.client.publish(app.availability_topic, 'online', retain=True)
+        return app
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        super().on_connect(client, userdata, flags, rc, properties)
+        if rc == 0:
+            with self.lock:
+                # Monitors watch each app topic, but there is one will per connection: only the host topic goes offline on a crash
+                for app in self.apps.values():
+                    self.client.publish(app.availability_topic, 'online', retain=True)
+
+    def share_entity(self, entity_name, app, name):
+        entity = self.app_entities.get(entity_name)
+        if entity is None:
+            entity = self.register_entity(entity_name, self.build_entity(entity_name, entity_name))
+            self.entity_sources[entity_name] = entity_name
+        app.entity_sources[name] = entity_name
+        self.entity_apps.setdefault(entity_name, []).append((app, name))
+        for event_type in app.get_handlers(name):
+            self.handlers.setdefault((entity_name, event_type), []).append((app, name))
+        return entity
+
+    def remove_app(self, name):
+        app = self.apps.pop(name)
+        if self.client.is_connected():
+            self.client.publish(app.availability_topic, 'offline', retain=True)
+        for group in list(self.scheduler.groups):
+            if group[0] == name:
+                self.scheduler.cancel_group(group)
+        for entity_name in list(self.entity_apps):
+            users = [user for user in self.entity_apps[entity_name] if user[0] is not app]
+            if users:
+                self.entity_apps[entity_name] = users
+            else:
+                del self.entity_apps[entity_name]
+                del self.entity_sources[entity_name]
+                self.unregister_entity(entity_name)
+        for key in list(self.handlers):
+            users = [user for user in self.handlers[key] if user[0] is not app]
+            if users:
+                self.handlers[key] = users
+            else:
+                del self.handlers[key]
+        return app
+
+    def replace_entity(self, entity_name, entity):
+        self.unregister_entity(entity_name)
+        self.register_entity(entity_name, entity)
+        for app, name in self.entity_apps.get(entity_name, []):
+            setattr(app, name, entity)
+        return entity
+
+    def process_event(self, name, event):
+        for app, app_entity_name in self.handlers.get((name, event.type), []):
+            app.process_event(app_entity_name, event)
+
+    async def wait_tasks(self):
+        await super().wait_tasks()
+        for app in self.apps.values():
+            await app.wait_tasks()
@@ -1,28 +1,105 @@
+import atexit
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_LEVEL = dict(
+    debug=logging.DEBUG,
+    info=logging.INFO,
+    warning=logging.WARNING,
+    error=logging.ERROR,
+)
+
+listener = None
+
+
+def get_queue_handler():
+    global listener
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(levelname)-8s %(name)s - %(message)s')
+    handler.setFormatter(formatter)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return QueueHandler(log_queue)
+
+
+def restart_listener():
+    # The listener thread does not survive fork, workers need their own
+    global listener
+    if listener is not None:
+        listener = QueueListener(listener.queue, *listener.handlers)
+        listener.start()
+        atexit.register(listener.stop)
+
+
+os.register_at_fork(after_in_child=restart_listener)
 
 
 class LoggerMixin:
+    __slots__ = ()
+
     def get_logger(self, level=None, name=''):
-        log_level = dict(
-            debug=logging.DEBUG,
-            info=logging.INFO,
-            warning=logging.WARNING,
-            error=logging.ERROR,
-        )
         level = level or getattr(self, 'log_level', None) or os.environ.get('LOG_LEVEL', 'info')
         logger_name = 'app'
         if name:
             logger_name = 'app.{}'.format(name)
         logger = logging.getLogger(logger_name)
-        logger.setLevel(log_level[level])
-        if not name:
-            handler = logging.StreamHandler(sys.stdout)
-            formatter = logging.Formatter('%(levelname)-8s %(name)s - %(message)s')
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
+        # setLevel clears every logger cache, skip it when nothing changes
+        if logger.level != LOG_LEVEL[level]:
+            logger.setLevel(LOG_LEVEL[level])
+        if not name and not logger.handlers:
+            logger.addHandler(get_queue_handler())
         return logger
 
     def set_logger(self, name=''):
         self.logger = self.get_logger(name=name)
+
+
+class EntityLogger:
+    __slots__ = ('logger', 'prefix')
+
+    def __init__(self, logger, prefix=None):
+        self.logger = logger
+        self.prefix = prefix
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, args, **kwargs):
+        if self.logger.isEnabledFor(level):
+            if self.prefix:
+                msg = '{} - {}'.format(self.prefix, msg)
+            self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, args)
+
+    def exception(self, msg, *args, exc_info=True):
+        self.log(logging.ERROR, msg, args, exc_info=exc_info)
+
+
+class TopicSampler:
+    def __init__(self, rate=1):
+        self.rate = rate
+        self.counters = dict()
+
+    def sample(self, topic):
+        if self.rate <= 1:
+            return True
+        count = self.counters.get(topic, 0)
+        self.counters[topic] = count + 1
+        return count % self.rate == 0
@@ -1,58 +1,222 @@
+import asyncio
 import os
-import yaml
 from copy import copy
 from importlib import import_module
-from iotapp.config import DeviceManager
+from iotapp.aio import AsyncEngine
+from iotapp.config import ConfigCache, DeviceManager, EntityLibrary, load_yaml
+from iotapp.host import HOST_OPTIONS, AppHost
 from iotapp.logger import LoggerMixin
+from iotapp.router import topic_matches
+from iotapp.watcher import FileWatcher
 
 
 class AppManager(LoggerMixin):
-    def __init__(self, name=None, devices='', apps='', log_level=None, logger=None):
+    def __init__(self, name=None, devices='', apps='', cache_dir=None, create_app=True, client=None, log_level=None, logger=None):
         self.logger = logger or self.get_logger(name='app_manager', level=log_level)
         # App name
         self.name = name or os.environ.get('IOTAPP_NAME')
+        self.log_level = log_level
+        self.app_logger = logger
+        self.client = client
+        self.cache_dir = cache_dir or os.environ.get('IOTAPP_CACHE_DIR', None)
+        self.cache = None
+        # Config
+        if isinstance(devices, str):
+            devices = devices or os.environ.get('IOTAPP_DEVICES', 'devices.yml')
+        if isinstance(apps, str):
+            apps = apps or os.environ.get('IOTAPP_APPS')
+        self.devices_source = devices
+        self.apps_source = apps
+        self.host_name = 'iotapp'
+        self.load_config()
+        if create_app:
+            self.create_app()
+
+    def create_app(self):
+        if self.name and ',' not in self.name:
+            # Single app
+            app_data = copy(self.apps[self.name])
+            self.app = app_data.pop('app')
+            self.entities_config = app_data.pop('entities', dict()) or dict()
+            self.config = app_data
+            self.entities = EntityLibrary(self.device_manager.entities, self.entities_config)
+            self.app_class = self.get_app_class()
+            self.app_instance = self.app_class(name=self.name, entity_library=self.entities, client=self.client, **self.config)
+        else:
+            # Many apps sharing one connection
+            self.names = self.get_app_names()
+            self.entities_config = self.get_entities_config(self.names)
+            self.entities = EntityLibrary(self.device_manager.entities, self.entities_config)
+            self.host_config = self.get_host_config(self.names)
+            self.app_instance = AppHost(name=self.host_name, entity_library=self.entities, client=self.client, log_level=self.log_level, logger=self.app_logger, **self.host_config)
+            for name in self.names:
+                self.add_app(name)
+            self.logger.info('Hosting {} apps: {}'.format(len(self.names), ', '.join(self.names)))
+
+    def get_app_names(self):
+        if self.name:
+            return [name.strip() for name in self.name.split(',') if name.strip()]
+        return list(self.apps.keys())
+
+    def get_entities_config(self, names):
+        entities_config = dict()
+        for name in names:
+            for entity_name, config in (self.apps[name].get('entities', dict()) or dict()).items():
+                if entity_name in entities_config and entities_config[entity_name] != config:
+                    # Hosted apps share one instance per entity
+                    self.logger.warning('{} - entity {} configured differently by another app, using this configuration'.format(name, entity_name))
+                entities_config[entity_name] = config
+        return entities_config
+
+    def get_host_config(self, names):
+        host_config = dict()
+        for name in names:
+            for option in HOST_OPTIONS:
+                if option not in self.apps[name]:
+                    continue
+                if option in host_config and host_config[option] != self.apps[name][option]:
+                    # Hosted apps share one connection and engine
+                    self.logger.warning('{} - option {} configured differently by another app, using this configuration'.format(name, option))
+                host_config[option] = self.apps[name][option]
+        return host_config
+
+    def add_app(self, name):
+        app_data = copy(self.apps[name])
+        app_class = self.get_app_class(app_data.pop('app'))
+        app_data.pop('entities', None)
+        for option in HOST_OPTIONS:
+            app_data.pop(option, None)
+        return self.app_instance.add_app(name, app_class, **app_data)
+
+    def load_config(self):
+        devices = self.devices_source
+        apps = self.apps_source
         # Devices
+        devices_data = None
         if isinstance(devices, str):
-            file_name = devices or os.environ.get('IOTAPP_DEVICES', 'devices.yml')
-            devices_file = open(file_name, 'r')
-            self.devices = yaml.safe_load(devices_file)
-            devices_file.close()
+            devices_data = self.read_file(devices)
         else:
             self.devices = copy(devices)
         # Apps
+        apps_data = None
         if isinstance(apps, str):
-            file_name = apps or os.environ.get('IOTAPP_APPS')
-            apps_file = open(file_name, 'r')
-            self.apps = yaml.safe_load(apps_file)
-            apps_file.close()
+            apps_data = self.read_file(apps)
         else:
             self.apps = copy(apps)
-        # Config
-        app_data = copy(self.apps[self.name])
-        self.app = app_data.pop('app')
-        self.entities_config = app_data.pop('entities', dict())
-        self.config = app_data
-        # Entities
-        device_manager = DeviceManager(devices=self.devices, log_level=log_level, logger=logger)
-        self.entities = dict()
-        for entity_name, entity_data in device_manager.entities.items():
-            entity_class = entity_data['class']
-            entity_config = entity_data['config']
-            app_entity_config = self.entities_config.get(entity_name, dict()) or dict()
-            entity_config.update(app_entity_config)
-            self.entities[entity_name] = entity_class(**entity_config)
-        # App instance
-        self.app_class = self.get_app_class()
-        self.app_instance = self.app_class(name=self.name, entity_library=self.entities,  **self.config)
+        # Cache
+        cache_key = None
+        cached = None
+        if self.cache_dir and devices_data is not None and apps_data is not None:
+            self.cache = ConfigCache(self.cache_dir, logger=self.logger)
+            cache_key = self.cache.get_key(devices_data, apps_data)
+            cached = self.cache.load(cache_key)
+        if cached:
+            self.devices = cached['devices']
+            self.apps = cached['apps']
+            self.device_manager = DeviceManager(expanded=cached['expanded'], errors=cached.get('errors'), log_level=self.log_level, logger=self.app_logger)
+        else:
+            if devices_data is not None:
+                self.devices = load_yaml(devices_data)
+            if apps_data is not None:
+                self.apps = load_yaml(apps_data)
+            self.device_manager = DeviceManager(devices=self.devices, log_level=self.log_level, logger=self.app_logger)
+            if cache_key:
+                self.cache.save(cache_key, dict(devices=self.devices, apps=self.apps, expanded=self.device_manager.devices, errors=self.device_manager.errors))
+
+    def read_file(self, file_name):
+        with open(file_name, 'rb') as config_file:
+            return config_file.read()
+
+    def reload(self):
+        old_apps = self.apps
+        try:
+            self.load_config()
+        except:
+            self.logger.exception('reload - configuration discarded', exc_info=True)
+            return
+        app = self.app_instance
+        host = isinstance(app, AppHost)
+        if host:
+            names = [name for name in self.get_app_names() if name in self.apps]
+            self.entities_config = self.get_entities_config(names)
+            if self.get_host_config(names) != self.host_config:
+                self.logger.warning('reload - host options changed, restart required')
+        else:
+            app_data = copy(self.apps.get(self.name, dict()))
+            self.entities_config = app_data.pop('entities', dict()) or dict()
+            if app_data != dict(self.config, app=self.app):
+                self.logger.warning('reload - {} configuration changed, restart required'.format(self.name))
+        changed = self.entities.load(self.device_manager.entities, self.entities_config, set(app.entity_sources.values()))
+        with app.lock:
+            old_subscriptions = dict(app.get_subscriptions())
+            # Apps
+            if host:
+                for name in list(app.apps):
+                    if name not in names or self.apps[name] != old_apps.get(name):
+                        app.remove_app(name)
+            # Entities
+            for name, entity_name in list(app.entity_sources.items()):
+                if entity_name not in changed:
+                    continue
+                if entity_name not in self.entities:
+                    self.logger.warning('reload - entity {} removed, keeping the running one'.format(entity_name))
+                    continue
+                app.replace_entity(name, self.rebuild_entity(app, name, entity_name, old_subscriptions))
+            if host:
+                for name in names:
+                    if name not in app.apps:
+                        try:
+                            self.add_app(name)
+                        except:
+                            self.logger.exception('reload - app {}'.format(name), exc_info=True)
+                self.names = list(app.apps)
+            subscribed, unsubscribed = app.update_subscriptions(old_subscriptions)
+        self.logger.info('reload - {} entities changed, {} topics subscribed, {} unsubscribed'.format(
+            len(changed), len(subscribed), len(unsubscribed)))
 
-    def get_app_class(self):
-        parts = self.app.split('.')
+    def rebuild_entity(self, app, name, entity_name, old_subscriptions):
+        old_entity = app.app_entities[name]
+        entity = app.build_entity(name, entity_name)
+        topics = entity.get_subscribe_topics()
+        if topics == old_entity.get_subscribe_topics():
+            # Same topics, the broker will not send the retained messages again
+            entity.set_state(old_entity.get_state())
+        else:
+            # Subscribe again so the retained messages rebuild the state,
+            # through the wildcard or shared filters covering the topics
+            for subscription in list(old_subscriptions):
+                topic_filter = subscription
+                if topic_filter.startswith('$share/'):
+                    topic_filter = topic_filter.split('/', 2)[2]
+                if any(topic_matches(topic_filter, topic) for topic in topics):
+                    # Unsubscribed if it is gone, subscribed again otherwise
+                    old_subscriptions[subscription] = None
+        return entity
+
+    def get_app_class(self, app=None):
+        parts = (app or self.app).split('.')
         module_name = '.'.join(parts[0:-1])
         class_name = parts[-1]
         module = import_module(module_name)
         return getattr(module, class_name)
 
-    def run(self):
+    def get_watcher(self, callback, interval=None):
+        interval = interval or float(os.environ.get('IOTAPP_WATCH_INTERVAL', 2))
+        files = [source for source in [self.devices_source, self.apps_source] if isinstance(source, str)]
+        return FileWatcher(files, callback, interval=interval, logger=self.logger)
+
+    def watch(self, interval=None):
+        self.watcher = self.get_watcher(self.reload, interval=interval)
+        self.watcher.start()
+        return self.watcher
+
+    def run(self, engine='sync', watch=False):
+        if watch:
+            self.watch()
+        if engine == 'asyncio':
+            asyncio.run(AsyncEngine(self.app_instance).run())
+            return
+        self.app_instance.scheduler.start()
         config = self.app_instance.mqtt_config
         if config['username']:
             self.app_instance.client.username_pw_set(config['username'], password=config['password'])
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def get_quantile(self, quantile):
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        for index, total in enumerate(self.get_cumulative()):
+            if total >= rank:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                return float('inf')
+
+    def get_data(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            buckets=dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], self.get_cumulative())),
+        )
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.topic_messages = dict()
+        self.entity_messages = dict()
+        self.parse_time = Histogram(buckets)
+        self.handler_latency = dict()
+        self.publish_latency = Histogram(buckets)
+        self.exceptions = dict()
+        self.gauges = dict()
+
+    def count_message(self, topic):
+        with self.lock:
+            self.topic_messages[topic] = self.topic_messages.get(topic, 0) + 1
+
+    def count_entity(self, name):
+        with self.lock:
+            self.entity_messages[name] = self.entity_messages.get(name, 0) + 1
+
+    def count_exception(self, where):
+        with self.lock:
+            self.exceptions[where] = self.exceptions.get(where, 0) + 1
+
+    def observe_parse(self, seconds):
+        with self.lock:
+            self.parse_time.observe(seconds)
+
+    def observe_publish(self, seconds):
+        with self.lock:
+            self.publish_latency.observe(seconds)
+
+    def observe_handler(self, app, handler, seconds):
+        key = (app, handler)
+        with self.lock:
+            histogram = self.handler_latency.get(key)
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.handler_latency[key] = histogram
+            histogram.observe(seconds)
+
+    def add_gauge(self, name, func):
+        self.gauges[name] = func
+
+    def get_gauges(self):
+        return dict((name, func()) for name, func in self.gauges.items())
+
+    def get_data(self):
+        with self.lock:
+            return dict(
+                topic_messages=dict(self.topic_messages),
+                entity_messages=dict(self.entity_messages),
+                parse_time=self.parse_time.get_data(),
+                handler_latency=dict(
+                    ('{}.{}'.format(app, handler), histogram.get_data())
+                    for (app, handler), histogram in self.handler_latency.items()
+                ),
+                publish_latency=self.publish_latency.get_data(),
+                exceptions=dict(self.exceptions),
+                gauges=self.get_gauges(),
+            )
+
+    def get_prometheus(self, app, prefix='iotapp'):
+        lines = []
+        with self.lock:
+            lines.append('# TYPE {}_messages_total counter'.format(prefix))
+            for topic, count in self.topic_messages.items():
+                lines.append('{}_messages_total{} {}'.format(prefix, get_labels(app=app, topic=topic), count))
+            lines.append('# TYPE {}_entity_messages_total counter'.format(prefix))
+            for name, count in self.entity_messages.items():
+                lines.append('{}_entity_messages_total{} {}'.format(prefix, get_labels(app=app, entity=name), count))
+            lines.append('# TYPE {}_get_events_seconds histogram'.format(prefix))
+            lines += get_histogram_lines('{}_get_events_seconds'.format(prefix), self.parse_time, dict(app=app))
+            lines.append('# TYPE {}_handler_seconds histogram'.format(prefix))
+            for (handler_app, handler), histogram in self.handler_latency.items():
+                lines += get_histogram_lines('{}_handler_seconds'.format(prefix), histogram, dict(app=handler_app, handler=handler))
+            lines.append('# TYPE {}_publish_seconds histogram'.format(prefix))
+            lines += get_histogram_lines('{}_publish_seconds'.format(prefix), self.publish_latency, dict(app=app))
+            lines.append('# TYPE {}_exceptions_total counter'.format(prefix))
+            for where, count in self.exceptions.items():
+                lines.append('{}_exceptions_total{} {}'.format(prefix, get_labels(app=app, where=where), count))
+        for name, value in self.get_gauges().items():
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{}{} {}'.format(prefix, name, get_labels(app=app), value))
+        return '\n'.join(lines) + '\n'
+
+
+def get_labels(**labels):
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append('{}="{}"'.format(key, value))
+    return '{' + ','.join(items) + '}'
+
+
+def get_histogram_lines(name, histogram, labels):
+    lines = []
+    bounds = [str(bucket) for bucket in histogram.buckets] + ['+Inf']
+    for bound, count in zip(bounds, histogram.get_cumulative()):
+        lines.append('{}_bucket{} {}'.format(name, get_labels(le=bound, **labels), count))
+    lines.append('{}_sum{} {}'.format(name, get_labels(**labels), histogram.sum))
+    lines.append('{}_count{} {}'.format(name, get_labels(**labels), histogram.count))
+    return lines
+
+
+class MetricsReporter(threading.Thread):
+    def __init__(self, app, interval=60, topic=None, file_name=None, queue=None):
+        super().__init__(name='metrics', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.topic = topic
+        self.file_name = file_name
+        self.queue = queue
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self.stopped.set()
+
+    def report(self):
+        try:
+            if self.topic:
+                payload = json.dumps(self.app.metrics.get_data())
+                self.app.client.publish(self.topic, payload, retain=True)
+            if self.file_name:
+                temp_name = '{}.tmp'.format(self.file_name)
+                with open(temp_name, 'w') as metrics_file:
+                    metrics_file.write(self.app.metrics.get_prometheus(self.app.name))
+                os.replace(temp_name, self.file_name)
+            if self.queue is not None:
+                self.queue.put((os.getpid(), self.app.name, self.app.metrics.get_data()))
+        except:
+            self.app.logger.exception('metrics report', exc_info=True)
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+import paho.mqtt.client as mqtt
+from iotapp.logger import LoggerMixin
+
+
+class OutboundQueue(LoggerMixin, threading.Thread):
+    def __init__(self, client, max_depth=1000, max_inflight=100, batch_size=50, metrics=None, logger=None):
+        super().__init__(name='outbound', daemon=True)
+        self.client = client
+        self.max_depth = max_depth
+        self.max_inflight = max_inflight
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.logger = logger or self.get_logger()
+        self.condition = threading.Condition()
+        # One command per topic, a newer one replaces the queued one
+        self.pending = OrderedDict()
+        self.inflight = dict()
+        self.acked = set()
+        self.flushing = False
+        self.stopped = False
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self.condition:
+            if topic in self.pending:
+                del self.pending[topic]
+                self.merged += 1
+            elif len(self.pending) >= self.max_depth:
+                old_topic, _ = self.pending.popitem(last=False)
+                self.dropped += 1
+                self.logger.warning('Outbound queue full, dropped command for {}'.format(old_topic))
+            self.pending[topic] = (payload, qos, retain, time.perf_counter())
+            self.condition.notify()
+
+    def depth(self):
+        return len(self.pending)
+
+    def can_flush(self):
+        return self.pending and len(self.inflight) < self.max_inflight and self.client.is_connected()
+
+    def get_batch(self):
+        batch = []
+        with self.condition:
+            if not self.client.is_connected():
+                return batch
+            while self.pending and len(batch) < self.batch_size and len(self.inflight) + len(batch) < self.max_inflight:
+                batch.append(self.pending.popitem(last=False))
+            self.flushing = bool(batch)
+        return batch
+
+    def flush(self):
+        # The client lock is taken inside publish, never hold ours while calling it
+        batch = self.get_batch()
+        try:
+            for index, (topic, (payload, qos, retain, queued)) in enumerate(batch):
+                info = self.client.publish(topic, payload, qos=qos, retain=retain)
+                # paho keeps QoS > 0 messages when the connection drops, they go out on reconnect
+                if info.rc != mqtt.MQTT_ERR_SUCCESS and not (qos and info.rc == mqtt.MQTT_ERR_NO_CONN):
+                    self.requeue(batch[index:])
+                    return index
+                with self.condition:
+                    self.sent += 1
+                    if info.mid in self.acked:
+                        self.acked.discard(info.mid)
+                        self.observe(queued)
+                    else:
+                        self.inflight[info.mid] = queued
+            return len(batch)
+        finally:
+            with self.condition:
+                # Early acks only race with this flush, the rest are other publishes of the client
+                self.flushing = False
+                self.acked.clear()
+
+    def requeue(self, batch):
+        with self.condition:
+            for topic, command in reversed(batch):
+                # A command queued meanwhile is newer, keep it
+                if topic not in self.pending:
+                    self.failed += 1
+                    self.pending[topic] = command
+                    self.pending.move_to_end(topic, last=False)
+
+    def observe(self, queued):
+        if self.metrics:
+            self.metrics.observe_publish(time.perf_counter() - queued)
+
+    def on_publish(self, client, userdata, mid, *args):
+        with self.condition:
+            queued = self.inflight.pop(mid, None)
+            if queued is None:
+                if self.flushing:
+                    # Maybe acknowledged before flush recorded it
+                    self.acked.add(mid)
+            else:
+                self.observe(queued)
+            self.condition.notify()
+
+    def on_connect(self):
+        with self.condition:
+            # QoS 0 messages written before the drop are never acknowledged
+            self.inflight.clear()
+            self.acked.clear()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and not self.can_flush():
+                    # The timeout catches reconnects done outside on_connect
+                    self.condition.wait(1)
+                if self.stopped:
+                    return
+            self.flush()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
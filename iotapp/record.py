@@ -0,0 +1,125 @@
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+from iotapp.metrics import Histogram
+
+
+MAGIC = b'IOTREC1\n'
+# Timestamp, topic size, payload size, then the topic and payload bytes
+HEADER = struct.Struct('<dHI')
+
+
+class Recorder:
+    def __init__(self, file_name, flush_interval=1):
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = open(file_name, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.flushed = time.monotonic()
+        self.count = 0
+        atexit.register(self.close)
+
+    def record(self, topic, payload, timestamp=None):
+        topic = topic.encode('utf-8')
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b''
+        header = HEADER.pack(timestamp or time.time(), len(topic), len(payload))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(header + topic + payload)
+            self.count += 1
+            now = time.monotonic()
+            if now - self.flushed >= self.flush_interval:
+                self.file.flush()
+                self.flushed = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class RecordReader:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, 'rb')
+        if os.fstat(self.file.fileno()).st_size < len(MAGIC):
+            self.file.close()
+            raise ValueError('{} is not a record file'.format(file_name))
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('{} is not a record file'.format(file_name))
+
+    def __iter__(self):
+        data = self.data
+        size = len(data)
+        offset = len(MAGIC)
+        while offset + HEADER.size <= size:
+            timestamp, topic_size, payload_size = HEADER.unpack_from(data, offset)
+            offset += HEADER.size
+            end = offset + topic_size + payload_size
+            if end > size:
+                # Last record cut short while recording
+                break
+            topic = data[offset:offset + topic_size].decode('utf-8')
+            payload = data[offset + topic_size:end]
+            offset = end
+            yield timestamp, topic, payload
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def replay(app, reader, speed=1.0, clock=time.perf_counter, sleep=time.sleep):
+    # speed 0 replays as fast as the app consumes the messages
+    client = app.client
+    lag = Histogram()
+    count = 0
+    first = None
+    start = clock()
+    for timestamp, topic, payload in reader:
+        if speed:
+            if first is None:
+                first = timestamp
+            delay = start + (timestamp - first) / speed - clock()
+            if delay > 0:
+                sleep(delay)
+            lag.observe(max(-delay, 0))
+        client.receive(topic, payload)
+        count += 1
+    return get_report(app, count, clock() - start, lag)
+
+
+def get_report(app, count, seconds, lag):
+    handlers = dict()
+    for (handler_app, handler), histogram in app.metrics.handler_latency.items():
+        handlers['{}.{}'.format(handler_app, handler)] = get_summary(histogram)
+    return dict(
+        messages=count,
+        seconds=seconds,
+        rate=count / seconds if seconds else 0,
+        lag=get_summary(lag),
+        parse=get_summary(app.metrics.parse_time),
+        handlers=handlers,
+        exceptions=dict(app.metrics.exceptions),
+    )
+
+
+def get_summary(histogram):
+    return dict(
+        count=histogram.count,
+        mean=histogram.sum / histogram.count if histogram.count else None,
+        p50=histogram.get_quantile(0.5),
+        p99=histogram.get_quantile(0.99),
+    )
@@ -0,0 +1,104 @@
+import sys
+
+
+SINGLE_LEVEL = '+'
+MULTI_LEVEL = '#'
+
+
+class TopicNode:
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = dict()
+        self.values = []
+
+
+class TopicRouter:
+    def __init__(self):
+        self.root = TopicNode()
+        self.filters = dict()
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __contains__(self, topic_filter):
+        return topic_filter in self.filters
+
+    def add(self, topic_filter, value):
+        node = self.root
+        for level in topic_filter.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = TopicNode()
+                # Levels like "shellies", "white" or "status" repeat across thousands of nodes
+                node.children[sys.intern(level)] = child
+            node = child
+        if value not in node.values:
+            node.values.append(value)
+            self.filters.setdefault(topic_filter, []).append(value)
+
+    def remove(self, topic_filter, value):
+        path = [self.root]
+        for level in topic_filter.split('/'):
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if value not in node.values:
+            return False
+        node.values.remove(value)
+        self.filters[topic_filter].remove(value)
+        if not self.filters[topic_filter]:
+            del self.filters[topic_filter]
+        # Prune empty branches
+        levels = topic_filter.split('/')
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.values or node.children:
+                break
+            del path[index - 1].children[levels[index - 1]]
+        return True
+
+    def match(self, topic):
+        levels = topic.split('/')
+        depth = len(levels)
+        matched = dict()
+        nodes = [(self.root, 0)]
+        while nodes:
+            node, index = nodes.pop()
+            # Wildcards do not match topics starting with $ at the first level
+            wildcard = not (index == 0 and topic.startswith('$'))
+            if wildcard:
+                child = node.children.get(MULTI_LEVEL)
+                if child is not None:
+                    for value in child.values:
+                        matched[value] = None
+            if index == depth:
+                for value in node.values:
+                    matched[value] = None
+                continue
+            child = node.children.get(levels[index])
+            if child is not None:
+                nodes.append((child, index + 1))
+            if wildcard:
+                child = node.children.get(SINGLE_LEVEL)
+                if child is not None:
+                    nodes.append((child, index + 1))
+        return list(matched)
+
+
+
+def topic_matches(topic_filter, topic):
+    levels = topic.split('/')
+    filter_levels = topic_filter.split('/')
+    if topic.startswith('$') and filter_levels[0] in (SINGLE_LEVEL, MULTI_LEVEL):
+        return False
+    for index, level in enumerate(filter_levels):
+        if level == MULTI_LEVEL:
+            return True
+        if index >= len(levels):
+            return False
+        if level != SINGLE_LEVEL and level != levels[index]:
+            return False
+    return len(filter_levels) == len(levels)
@@ -0,0 +1,145 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from iotapp.logger import LoggerMixin
+
+
+class Scheduler(LoggerMixin, threading.Thread):
+    def __init__(self, compact_size=64, logger=None):
+        super().__init__(name='scheduler', daemon=True)
+        self.compact_size = compact_size
+        self.logger = logger or self.get_logger(name='scheduler')
+        self.condition = threading.Condition()
+        # Entries are [when, sequence, key, callback, args, group], cancelling clears the callback
+        self.heap = []
+        self.timers = dict()
+        self.groups = dict()
+        self.sequence = itertools.count()
+        self.cancelled = 0
+        self.loop = None
+        self.wakeup = None
+        self.stopped = False
+
+    def run_in(self, delay, callback, args=(), key=None, group=None):
+        return self.run_at(time.monotonic() + delay, callback, args=args, key=key, group=group)
+
+    def run_at(self, when, callback, args=(), key=None, group=None):
+        with self.condition:
+            sequence = next(self.sequence)
+            if key is None:
+                key = sequence
+            else:
+                # Rescheduling replaces the pending timer
+                self.cancel(key)
+            entry = [when, sequence, key, callback, args, group]
+            heapq.heappush(self.heap, entry)
+            self.timers[key] = entry
+            if group is not None:
+                self.groups.setdefault(group, set()).add(key)
+            if self.heap[0] is entry:
+                self.notify()
+        return key
+
+    def cancel(self, key):
+        with self.condition:
+            entry = self.timers.pop(key, None)
+            if entry is None:
+                return False
+            self.discard(entry)
+            entry[3] = None
+            self.cancelled += 1
+            if self.cancelled > self.compact_size and self.cancelled > len(self.heap) // 2:
+                self.heap = [item for item in self.heap if item[3] is not None]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+            return True
+
+    def cancel_group(self, group):
+        with self.condition:
+            keys = list(self.groups.get(group, ()))
+            for key in keys:
+                self.cancel(key)
+            return len(keys)
+
+    def discard(self, entry):
+        group = entry[5]
+        if group is not None:
+            keys = self.groups[group]
+            keys.discard(entry[2])
+            if not keys:
+                del self.groups[group]
+
+    def pending(self):
+        return len(self.timers)
+
+    def next_timeout(self, now=None):
+        with self.condition:
+            while self.heap and self.heap[0][3] is None:
+                heapq.heappop(self.heap)
+                self.cancelled -= 1
+            if not self.heap:
+                return None
+            return self.heap[0][0] - (now or time.monotonic())
+
+    def get_due(self, now):
+        due = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
+                if entry[3] is None:
+                    self.cancelled -= 1
+                    continue
+                del self.timers[entry[2]]
+                self.discard(entry)
+                due.append(entry)
+        return due
+
+    def run_pending(self, now=None):
+        # Callbacks run outside the lock, they may schedule or cancel timers
+        due = self.get_due(now or time.monotonic())
+        for when, sequence, key, callback, args, group in due:
+            try:
+                callback(*args)
+            except:
+                self.logger.exception('timer {}'.format(key), exc_info=True)
+        return len(due)
+
+    def notify(self):
+        self.condition.notify()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    timeout = self.next_timeout()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+            self.run_pending()
+
+    async def run_async(self):
+        self.wakeup = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        try:
+            while not self.stopped:
+                timeout = self.next_timeout()
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wakeup.clear()
+                self.run_pending()
+        finally:
+            self.loop = None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.notify()
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+from iotapp.logger import LoggerMixin
+
+
+class StateStore(LoggerMixin):
+    def __init__(self, file_name, compact_size=1000, logger=None):
+        self.file_name = file_name
+        self.compact_size = compact_size
+        self.logger = logger or self.get_logger(name='state')
+        self.lock = threading.Lock()
+        self.states = dict()
+        self.lines = 0
+        self.file = None
+
+    def load(self):
+        self.states = dict()
+        self.lines = 0
+        broken = 0
+        try:
+            with open(self.file_name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        name, state = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash, the rest of the log is still good
+                        broken += 1
+                        continue
+                    self.states[name] = state
+                    self.lines += 1
+        except FileNotFoundError:
+            pass
+        if broken:
+            self.logger.warning('State file {} - skipped {} broken lines'.format(self.file_name, broken))
+        if broken or self.needs_compact():
+            self.compact()
+        self.logger.info('Loaded state of {} entities from {}'.format(len(self.states), self.file_name))
+        return self.states
+
+    def get(self, name):
+        return self.states.get(name)
+
+    def save(self, name, state):
+        with self.lock:
+            if self.states.get(name) == state:
+                return False
+            self.states[name] = state
+            if self.file is None:
+                self.file = open(self.file_name, 'a', encoding='utf-8')
+            self.file.write(json.dumps([name, state], separators=(',', ':')) + '\n')
+            self.file.flush()
+            self.lines += 1
+            if self.needs_compact():
+                self.compact()
+            return True
+
+    def needs_compact(self):
+        # Only the last line of each entity counts, rewrite once most lines are stale
+        return self.lines > self.compact_size and self.lines > 2 * len(self.states)
+
+    def compact(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        temp_name = '{}.tmp'.format(self.file_name)
+        with open(temp_name, 'w', encoding='utf-8') as f:
+            for name, state in self.states.items():
+                f.write(json.dumps([name, state], separators=(',', ':')) + '\n')
+        os.replace(temp_name, self.file_name)
+        self.lines = len(self.states)
+        self.logger.debug('Compacted state file {} to {} lines'.format(self.file_name, self.lines))
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -3,22 +3,49 @@ class Message:
     payload = None
 
 
+class MessageInfo:
+    def __init__(self, mid, rc=0):
+        self.mid = mid
+        self.rc = rc
+
+
 class TestClient:
     def __init__(self):
+        self.connected = False
+        self.mid = 0
         self.on_connect = None
         self.on_message = None
         self.subscribed = []
+        self.subscribe_calls = []
+        self.unsubscribed = []
         self.published = []
         self.will_set_called = []
 
     def connect(self, *args, **kwargs):
+        self.connected = kwargs.get('rc', 0) == 0
         self.on_connect(client=None, userdata=None, flags=None, rc=kwargs.get('rc', 0))
 
     def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
         self.published.append((topic, payload))
+        self.mid += 1
+        return MessageInfo(self.mid)
+
+    def is_connected(self):
+        return self.connected
 
     def subscribe(self, topic, qos=0, options=None, properties=None):
-        self.subscribed.append(topic)
+        if isinstance(topic, list):
+            self.subscribe_calls.append(topic)
+            self.subscribed += [item[0] for item in topic]
+        else:
+            self.subscribe_calls.append([(topic, qos)])
+            self.subscribed.append(topic)
+
+    def unsubscribe(self, topic, properties=None):
+        if isinstance(topic, list):
+            self.unsubscribed += topic
+        else:
+            self.unsubscribed.append(topic)
 
     def will_set(self, topic, payload=None, qos=0, retain=False, properties=None):
         self.will_set_called.append((topic, payload))
@@ -26,7 +53,7 @@ class TestClient:
     def receive(self, topic, payload):
         msg = Message()
         msg.topic = topic
-        msg.payload = payload.encode('utf-8')
+        msg.payload = payload if isinstance(payload, bytes) else payload.encode('utf-8')
         self.on_message(client=self, userdata=None, msg=msg)
 
 
@@ -42,21 +69,26 @@ class TestLogger:
         self.level = level
         self.logged = []
 
-    def append(self, msg, type):
+    def append(self, msg, type, args=()):
         if self.level_order[type] >= self.level_order[self.level]:
+            if args:
+                msg = msg % args
             self.logged.append((type, msg))
 
-    def debug(self, msg):
-        self.append(msg, 'debug')
+    def isEnabledFor(self, level):
+        return level >= self.level_order[self.level]
+
+    def debug(self, msg, *args):
+        self.append(msg, 'debug', args)
 
-    def info(self, msg):
-        self.append(msg, 'info')
+    def info(self, msg, *args):
+        self.append(msg, 'info', args)
 
-    def warning(self, msg):
-        self.append(msg, 'warning')
+    def warning(self, msg, *args):
+        self.append(msg, 'warning', args)
 
-    def error(self, msg):
-        self.append(msg, 'error')
+    def error(self, msg, *args):
+        self.append(msg, 'error', args)
 
-    def exception(self, msg, exc_info=False):
-        self.append(msg, 'exception')
\ No newline at end of file
+    def exception(self, msg, *args, exc_info=False):
+        self.append(msg, 'exception', args)
\ No newline at end of file
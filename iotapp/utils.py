@@ -1,11 +1,51 @@
 import json as jsonlib
+from functools import lru_cache
 from jinja2 import Template
 
 
+TEMPLATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_template(template):
+    return Template(template)
+
+
+def compile_template(template):
+    if template:
+        return get_template(template)
+    return None
+
+
+def get_template_cache_info():
+    return get_template.cache_info()
+
+
+class Payload(str):
+    _json = None
+    _json_loaded = False
+
+    @classmethod
+    def decode(cls, data, encoding='utf-8'):
+        return cls(data.decode(encoding))
+
+    @property
+    def json(self):
+        if not self._json_loaded:
+            self._json = jsonlib.loads(self)
+            self._json_loaded = True
+        return self._json
+
+
 def get_template_value(value, template=None, json=True):
         if template:
             data = value
             if json:
-                data = jsonlib.loads(value)
-            return Template(template).render(value=data)
+                if isinstance(value, Payload):
+                    data = value.json
+                else:
+                    data = jsonlib.loads(value)
+            if not isinstance(template, Template):
+                template = get_template(template)
+            return template.render(value=data)
         return value
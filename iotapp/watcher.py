@@ -0,0 +1,45 @@
+import os
+import threading
+from iotapp.logger import LoggerMixin
+
+
+class FileWatcher(threading.Thread):
+    def __init__(self, files, callback, interval=2, logger=None):
+        super().__init__(name='watcher', daemon=True)
+        self.files = files
+        self.callback = callback
+        self.interval = interval
+        self.logger = logger or LoggerMixin().get_logger(name='watcher')
+        self.stopped = threading.Event()
+        self.state = self.get_state()
+
+    def get_state(self):
+        state = dict()
+        for file_name in self.files:
+            try:
+                stat = os.stat(file_name)
+                state[file_name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                state[file_name] = None
+        return state
+
+    def check(self):
+        state = self.get_state()
+        if state == self.state:
+            return False
+        self.state = state
+        changed = [file_name for file_name in self.files if state[file_name] is not None]
+        if changed:
+            self.logger.info('Configuration changed')
+            try:
+                self.callback()
+            except:
+                self.logger.exception('watcher callback', exc_info=True)
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from iotapp.logger import LoggerMixin
+from iotapp.metrics import MetricsReporter
+
+
+def get_partition(name, workers):
+    return zlib.crc32(name.encode('utf-8')) % workers
+
+
+def merge_counters(target, counters):
+    for key, value in counters.items():
+        target[key] = target.get(key, 0) + value
+
+
+class Supervisor(LoggerMixin):
+    def __init__(self, manager, workers=None, restart_delay=1, metrics_interval=None, logger=None):
+        self.logger = logger or self.get_logger(name='supervisor')
+        self.manager = manager
+        self.workers = workers or int(os.environ.get('IOTAPP_WORKERS', 0)) or os.cpu_count()
+        self.restart_delay = restart_delay
+        if metrics_interval is None:
+            metrics_interval = float(os.environ.get('IOTAPP_METRICS_INTERVAL', 0)) or 10
+        self.metrics_interval = metrics_interval
+        # Fork after imports and config loading: workers share that memory copy-on-write
+        self.context = multiprocessing.get_context('fork')
+        self.metrics_queue = self.context.Queue()
+        self.partitions = self.get_partitions()
+        self.processes = dict()
+        self.started = dict()
+        self.restarts = dict()
+        self.metrics = dict()
+        self.engine = 'sync'
+        self.watch = False
+        self.watcher = None
+        self.checked = 0
+        self.stopped = threading.Event()
+
+    def get_partitions(self):
+        partitions = dict()
+        for name in self.manager.get_app_names():
+            if name not in self.manager.apps:
+                continue
+            partitions.setdefault(get_partition(name, self.workers), []).append(name)
+        return partitions
+
+    def start_worker(self, index):
+        process = self.context.Process(target=self.run_worker, args=(index,), name='iotapp-{}'.format(index))
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+        self.logger.info('Worker {} started (pid {}): {}'.format(index, process.pid, ', '.join(self.partitions[index])))
+
+    def run_worker(self, index):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        client_id = os.environ.get('MQTT_CLIENT_ID')
+        if client_id:
+            os.environ['MQTT_CLIENT_ID'] = '{}-{}'.format(client_id, index)
+        for variable in ['IOTAPP_STATE_FILE', 'IOTAPP_RECORD_FILE']:
+            file_name = os.environ.get(variable)
+            if file_name:
+                os.environ[variable] = '{}-{}'.format(file_name, index)
+        manager = self.manager
+        manager.name = ','.join(self.partitions[index])
+        manager.host_name = 'iotapp-{}'.format(index)
+        manager.create_app()
+        app = manager.app_instance
+        if app.metrics_reporter is None:
+            app.metrics_reporter = MetricsReporter(app, interval=self.metrics_interval)
+        app.metrics_reporter.queue = self.metrics_queue
+        if app.metrics_reporter.ident is None:
+            app.metrics_reporter.start()
+        manager.run(engine=self.engine, watch=self.watch)
+
+    def check_workers(self):
+        for index, process in list(self.processes.items()):
+            if process.is_alive() or self.stopped.is_set() or self.processes.get(index) is not process:
+                continue
+            if time.monotonic() - self.started[index] < self.restart_delay:
+                # Crash loop: wait before restarting
+                continue
+            process.join()
+            self.restarts[index] = self.restarts.get(index, 0) + 1
+            self.logger.warning('Worker {} exited with code {}, restarting'.format(index, process.exitcode))
+            if self.watcher:
+                # The new worker watches from its start, it must not fork a stale configuration
+                self.watcher.check()
+                if self.processes.get(index) is not process:
+                    # Restarted or stopped by the reload
+                    continue
+            self.start_worker(index)
+
+    def check_files(self):
+        now = time.monotonic()
+        if self.watcher is None or now - self.checked < self.watcher.interval:
+            return False
+        self.checked = now
+        return self.watcher.check()
+
+    def reload(self):
+        # Workers reload their own entities, the supervisor starts the apps where they belong
+        try:
+            self.manager.load_config()
+        except:
+            self.logger.exception('reload - configuration discarded', exc_info=True)
+            return
+        old_partitions = self.partitions
+        self.partitions = self.get_partitions()
+        for index in sorted(set(old_partitions) | set(self.partitions)):
+            if self.partitions.get(index) == old_partitions.get(index):
+                continue
+            if index in self.processes:
+                self.stop_worker(index)
+            if index in self.partitions:
+                self.logger.info('reload - worker {} apps changed, restarting'.format(index))
+                self.start_worker(index)
+            else:
+                self.logger.info('reload - worker {} has no apps, stopped'.format(index))
+
+    def collect_metrics(self, timeout=0.5):
+        try:
+            pid, name, data = self.metrics_queue.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        for index, process in self.processes.items():
+            if process.pid == pid:
+                self.metrics[index] = data
+        return True
+
+    def get_metrics(self):
+        topic_messages = dict()
+        exceptions = dict()
+        for data in self.metrics.values():
+            merge_counters(topic_messages, data['topic_messages'])
+            merge_counters(exceptions, data['exceptions'])
+        return dict(
+            workers=len(self.processes),
+            restarts=sum(self.restarts.values()),
+            messages=sum(topic_messages.values()),
+            topic_messages=topic_messages,
+            exceptions=exceptions,
+        )
+
+    def run(self, engine='sync', watch=False):
+        self.engine = engine
+        self.watch = watch
+        if watch:
+            # Checked from this loop, never while it starts or stops workers
+            self.watcher = self.manager.get_watcher(self.reload)
+        for index in sorted(self.partitions):
+            self.start_worker(index)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        while not self.stopped.is_set():
+            self.collect_metrics()
+            self.check_files()
+            self.check_workers()
+        self.stop_workers()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stop_worker(self, index, timeout=5):
+        process = self.processes.pop(index)
+        self.started.pop(index, None)
+        self.metrics.pop(index, None)
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def stop_workers(self, timeout=5):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
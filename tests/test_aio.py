@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+import unittest
+from unittest import mock
+from iotapp import entities
+from iotapp.aio import AsyncEngine, AsyncioHelper
+from iotapp.apps.toggle import Toggle
+from iotapp.broker import Broker
+from iotapp.host import AppHost
+from iotapp.test import TestClient, TestLogger
+from tests.test_broker import Client, TIMEOUT
+
+
+class AsyncToggle(Toggle):
+    async def on_button_click(self):
+        await asyncio.sleep(0.01)
+        state = self.light.toggle()
+        self.logger.info('on_button_click -> light: {}'.format(state))
+
+
+class WrongAsyncToggle(Toggle):
+    async def on_button_click(self):
+        await asyncio.sleep(0)
+        a = 1 / 0
+
+
+class AsyncHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        self.entity_library = dict(
+            mybutton=entities.Button(state_topic='button/state'),
+            mylight=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+
+    def get_app(self, app_class):
+        app = app_class(entity_library=self.entity_library, button='mybutton', light='mylight', client=self.client, logger=self.logger)
+        app.button.logger = self.logger
+        app.light.logger = self.logger
+        return app
+
+    def test_loop(self):
+        app = self.get_app(AsyncToggle)
+
+        async def main():
+            app.loop = asyncio.get_running_loop()
+            self.client.receive('light/state', 'on')
+            for i in range(3):
+                self.client.receive('button/state', 'click')
+            # Messages are not blocked by running handlers
+            self.assertEqual(len(app.tasks), 3)
+            self.assertEqual(self.client.published, [])
+            await app.wait_tasks()
+
+        asyncio.run(main())
+        self.assertEqual(len(app.tasks), 0)
+        self.assertEqual(self.client.published, [('light/command', 'off')] * 3)
+
+    def test_no_loop(self):
+        app = self.get_app(AsyncToggle)
+        self.client.receive('light/state', 'off')
+        self.client.receive('button/state', 'click')
+        self.assertEqual(self.client.published, [('light/command', 'on')])
+        self.assertEqual(self.logger.logged, [('info', 'on_button_click -> light: on')])
+
+    def test_exception(self):
+        app = self.get_app(WrongAsyncToggle)
+
+        async def main():
+            app.loop = asyncio.get_running_loop()
+            self.client.receive('button/state', 'click')
+            await app.wait_tasks()
+
+        asyncio.run(main())
+        self.assertEqual(self.logger.logged, [('exception', 'on_button_click - event: click () {}')])
+
+    def test_sync_handler(self):
+        app = self.get_app(Toggle)
+
+        async def main():
+            app.loop = asyncio.get_running_loop()
+            self.client.receive('light/state', 'on')
+            self.client.receive('button/state', 'click')
+            self.assertEqual(len(app.tasks), 0)
+
+        asyncio.run(main())
+        self.assertEqual(self.client.published, [('light/command', 'off')])
+
+    def test_host(self):
+        host = AppHost(entity_library=self.entity_library, client=self.client, logger=self.logger)
+        app = host.add_app('toggle', AsyncToggle, button='mybutton', light='mylight', logger=self.logger)
+
+        async def main():
+            host.loop = asyncio.get_running_loop()
+            self.client.receive('light/state', 'on')
+            self.client.receive('button/state', 'click')
+            self.assertEqual(len(app.tasks), 1)
+            await host.wait_tasks()
+
+        asyncio.run(main())
+        self.assertEqual(self.client.published, [('light/command', 'off')])
+
+
+class AsyncioHelperTest(unittest.TestCase):
+    def test_callbacks(self):
+        client = TestClient()
+        loop = asyncio.new_event_loop()
+        try:
+            helper = AsyncioHelper(loop, client)
+            self.assertEqual(client.on_socket_open, helper.on_socket_open)
+            self.assertEqual(client.on_socket_close, helper.on_socket_close)
+            self.assertEqual(client.on_socket_register_write, helper.on_socket_register_write)
+            self.assertEqual(client.on_socket_unregister_write, helper.on_socket_unregister_write)
+        finally:
+            loop.close()
+
+
+class AsyncEngineBrokerTest(unittest.TestCase):
+    def test_toggle(self):
+        with Broker(logger=TestLogger()) as broker:
+            device = Client(broker, 'device')
+            device.subscribe('light/command')
+            device.client.publish('light/state', 'off', qos=1, retain=True).wait_for_publish(TIMEOUT)
+            entity_library = dict(
+                mybutton=entities.Button(state_topic='button/state'),
+                mylight=entities.Light(state_topic='light/state', command_topic='light/command'),
+            )
+            with mock.patch.dict(os.environ, broker.get_environ()):
+                app = AsyncToggle(entity_library=entity_library, button='mybutton', light='mylight', logger=TestLogger())
+            app.button.logger = app.logger
+            app.light.logger = app.logger
+            engine = AsyncEngine(app)
+            thread = threading.Thread(target=asyncio.run, args=(engine.run(),))
+            thread.start()
+            try:
+                for i in range(50):
+                    if app.light.state == 'off':
+                        break
+                    threading.Event().wait(0.1)
+                device.client.publish('button/state', 'click')
+                self.assertEqual(device.get(), ('light/command', b'on', False))
+                self.assertEqual(app.logger.logged[0], ('info', 'Connected to 127.0.0.1:{}'.format(broker.port)))
+            finally:
+                engine.loop.call_soon_threadsafe(engine.stop)
+                thread.join(TIMEOUT)
+                device.stop()
+            self.assertFalse(thread.is_alive())
@@ -1,6 +1,12 @@
+import os
 import unittest
+from unittest import mock
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
 from iotapp import entities
 from iotapp.base import IotApp
+from iotapp.config import DeviceManager
+from iotapp.events import Event
 from iotapp.test import TestClient, TestLogger
 
 
@@ -41,9 +47,246 @@ class IotAppTest(unittest.TestCase):
         self.client.receive('topic', 'data')
         self.assertEqual(self.logger.logged[0], ('debug', "on_message - topic b'data'"))
 
+    def test_receive_sampled(self):
+        self.logger = TestLogger(level='debug')
+        IotApp(log_sample_rate=2, client=self.client, logger=self.logger)
+        for i in range(3):
+            self.client.receive('topic', 'data{}'.format(i))
+        self.client.receive('other', 'data')
+        self.assertEqual(
+            self.logger.logged,
+            [('debug', "on_message - topic b'data0'"), ('debug', "on_message - topic b'data2'"), ('debug', "on_message - other b'data'")]
+        )
+
+    def test_receive_info(self):
+        app = IotApp(log_sample_rate=2, client=self.client, logger=self.logger)
+        self.client.receive('topic', 'data')
+        self.assertEqual(self.logger.logged, [])
+        self.assertEqual(app.log_sampler.counters, dict())
+
     def test_add_entity(self):
         self.logger = TestLogger(level='debug')
         app = IotApp(entity_library=dict(table_button=entities.Button()), client=self.client, logger=self.logger)
         app.add_entity('button', 'table_button')
         self.assertIsInstance(app.button, entities.Button)
         self.assertEqual(app.button.name, 'button')
+
+
+class IotAppRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        entity_library = dict()
+        for number in range(4):
+            entity_library['channel{}'.format(number)] = entities.Light(
+                availability_topic='shellies/rgbw2/online',
+                availability_online='true',
+                availability_offline='false',
+                state_topic='shellies/rgbw2/white/{}'.format(number),
+            )
+        self.app = IotApp(entity_library=entity_library, client=self.client, logger=self.logger)
+        for name in entity_library:
+            self.app.add_entity(name, name)
+
+    def test_shared_topic(self):
+        self.client.receive('shellies/rgbw2/online', 'true')
+        for number in range(4):
+            self.assertTrue(getattr(self.app, 'channel{}'.format(number)).available)
+
+    def test_own_topic(self):
+        self.client.receive('shellies/rgbw2/white/2', 'on')
+        self.assertEqual(self.app.channel1.state, None)
+        self.assertEqual(self.app.channel2.state, 'on')
+
+    def test_unknown_topic(self):
+        self.client.receive('unknown', 'on')
+        self.assertEqual(self.logger.logged, [])
+
+    def test_subscribe_deduplicated(self):
+        self.client.connect()
+        self.assertEqual(
+            self.client.subscribed,
+            [
+                'shellies/rgbw2/online',
+                'shellies/rgbw2/white/0',
+                'shellies/rgbw2/white/1',
+                'shellies/rgbw2/white/2',
+                'shellies/rgbw2/white/3',
+            ]
+        )
+        self.assertEqual(len(self.client.subscribe_calls), 1)
+
+    def test_subscribe_chunks(self):
+        self.app.mqtt_config['subscribe_chunk_size'] = 2
+        self.client.connect()
+        self.assertEqual(len(self.client.subscribe_calls), 3)
+        self.assertEqual(self.client.subscribe_calls[2], [('shellies/rgbw2/white/3', 0)])
+
+    def test_subscribe_qos(self):
+        self.app.channel1.qos = 1
+        self.app.channel2.topic_qos = {'shellies/rgbw2/white/2': 2}
+        self.app.subscriptions = None
+        subscriptions = self.app.get_subscriptions()
+        self.assertEqual(subscriptions['shellies/rgbw2/online'], 1)
+        self.assertEqual(subscriptions['shellies/rgbw2/white/0'], 0)
+        self.assertEqual(subscriptions['shellies/rgbw2/white/1'], 1)
+        self.assertEqual(subscriptions['shellies/rgbw2/white/2'], 2)
+
+
+class IotAppSubscribeWildcardsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        devices = dict(
+            button1=dict(type='aqara-button'),
+            button2=dict(type='aqara-button'),
+            rgbw2=dict(type='shelly-rgbw2', channel1='lamp1', channel2='lamp2'),
+        )
+        entity_library = dict()
+        for name, data in DeviceManager(devices=devices).entities.items():
+            entity_library[name] = data['class'](**data['config'])
+        self.app = IotApp(entity_library=entity_library, subscribe_wildcards=True, client=self.client, logger=self.logger)
+        for name in entity_library:
+            self.app.add_entity(name, name)
+
+    def test_subscribed(self):
+        self.client.connect()
+        self.assertEqual(self.client.subscribed, ['zigbee/+', 'shellies/#'])
+        self.assertEqual(self.app.subscription_report, dict(topics=7, subscriptions=2, saved=5, shared=0))
+        self.assertEqual(self.logger.logged[1], ('info', 'Subscribed 2 filters for 7 topics (5 saved)'))
+
+    def test_route(self):
+        self.client.receive('zigbee/button3', '{"click": "single"}')
+        self.client.receive('shellies/rgbw2/online', 'true')
+        self.client.receive('shellies/rgbw2/white/1', 'on')
+        self.client.receive('shellies/rgbw2/announce', '{}')
+        self.assertTrue(self.app.lamp1.available)
+        self.assertTrue(self.app.lamp2.available)
+        self.assertEqual(self.app.lamp1.state, None)
+        self.assertEqual(self.app.lamp2.state, 'on')
+
+    def test_environ(self):
+        with mock.patch.dict(os.environ, dict(IOTAPP_SUBSCRIBE_WILDCARDS='true')):
+            self.assertTrue(IotApp(entity_library=dict(), client=self.client, logger=self.logger).subscribe_wildcards)
+        with mock.patch.dict(os.environ, dict(IOTAPP_SUBSCRIBE_WILDCARDS='')):
+            self.assertFalse(IotApp(entity_library=dict(), client=self.client, logger=self.logger).subscribe_wildcards)
+
+    def test_single_topic(self):
+        self.app.unregister_entity('button2')
+        self.app.subscriptions = None
+        self.assertEqual(list(self.app.get_subscriptions()), ['zigbee/button1', 'shellies/#'])
+        self.app.mqtt_config['wildcard_min_topics'] = 1
+        self.app.subscriptions = None
+        self.assertEqual(list(self.app.get_subscriptions()), ['zigbee/+', 'shellies/#'])
+
+    def test_disabled(self):
+        self.app.subscribe_wildcards = False
+        self.client.connect()
+        self.assertEqual(len(self.client.subscribed), 7)
+        self.assertEqual(self.app.subscription_report, dict(topics=7, subscriptions=7, saved=0, shared=0))
+
+
+class IotAppShareGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        devices = dict(
+            button1=dict(type='aqara-button'),
+            button2=dict(type='aqara-button'),
+            rgbw2=dict(type='shelly-rgbw2', channel1='lamp1'),
+        )
+        entity_library = dict()
+        for name, data in DeviceManager(devices=devices).entities.items():
+            entity_library[name] = data['class'](**data['config'])
+        self.app = IotApp(entity_library=entity_library, subscribe_wildcards=True, client=self.client, logger=self.logger)
+        self.app.mqtt_config['share_group'] = 'toggle'
+        for name in entity_library:
+            self.app.add_entity(name, name)
+
+    def test_subscribed(self):
+        self.client.connect()
+        self.assertEqual(self.client.subscribed, ['$share/toggle/zigbee/button1', '$share/toggle/zigbee/button2', 'shellies/#'])
+        self.assertEqual(self.app.subscription_report, dict(topics=5, subscriptions=3, saved=2, shared=2))
+        self.assertIn(('info', 'Sharing 2 topics in group toggle'), self.logger.logged)
+
+    def test_unshareable_topic(self):
+        self.app.add_entity('listener', 'lamp1')
+        self.app.listener.state_topic = 'zigbee/button1'
+        self.app.unregister_entity('listener')
+        self.app.register_entity('listener', self.app.listener)
+        self.assertEqual(list(self.app.get_subscriptions()), ['zigbee/button1', '$share/toggle/zigbee/button2', 'shellies/#'])
+
+    def test_disabled(self):
+        self.app.mqtt_config['share_group'] = None
+        self.app.subscriptions = None
+        self.assertEqual(list(self.app.get_subscriptions()), ['zigbee/+', 'shellies/#'])
+
+    def test_route(self):
+        self.client.receive('zigbee/button1', '{"click": "single"}')
+        self.client.receive('shellies/rgbw2/white/0', 'on')
+        self.assertEqual(self.app.lamp1.state, 'on')
+
+
+class IotAppMqtt5Test(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        self.app = IotApp(availability_topic='iotapp/app/state', client=self.client, logger=self.logger)
+
+    def test_connect(self):
+        self.app.on_connect(self.client, None, dict(), ReasonCode(PacketTypes.CONNACK, identifier=0), properties=None)
+        self.assertEqual(self.client.published, [('iotapp/app/state', 'online')])
+
+    def test_connect_fail(self):
+        self.app.on_connect(self.client, None, dict(), ReasonCode(PacketTypes.CONNACK, identifier=135), properties=None)
+        self.assertEqual(self.logger.logged, [('error', 'Could not connect to localhost:1883 - Return code Not authorized (Not authorized)')])
+
+
+class HandlerApp(IotApp):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+        self.add_entity('button', 'table_button')
+
+    def on_button_click(self):
+        self.calls.append('click')
+
+    def on_button_availability(self, value):
+        self.calls.append(value)
+
+
+class IotAppHandlersTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger(level='debug')
+        entity_library = dict(table_button=entities.Button(state_topic='button/state', availability_topic='button/online'))
+        self.app = HandlerApp(entity_library=entity_library, client=self.client, logger=self.logger)
+        self.app.button.logger = TestLogger()
+
+    def test_table(self):
+        self.assertEqual(sorted(self.app.handlers.keys()), [('button', 'availability'), ('button', 'click')])
+        self.assertEqual(self.app.handlers[('button', 'click')], ('on_button_click', self.app.on_button_click))
+
+    def test_underscore_names(self):
+        class UnderscoreApp(IotApp):
+            def on_table_button_click(self):
+                pass
+
+            def on_table_state(self):
+                pass
+
+        app = UnderscoreApp(client=self.client, logger=self.logger)
+        self.assertEqual(app.get_handlers('table_button'), dict(click=('on_table_button_click', app.on_table_button_click)))
+        self.assertEqual(sorted(app.get_handlers('table')), ['button_click', 'state'])
+        self.assertEqual(app.get_handlers('button'), dict())
+
+    def test_dispatch(self):
+        self.client.receive('button/online', 'online')
+        self.client.receive('button/state', 'click')
+        self.assertEqual(self.app.calls, ['online', 'click'])
+
+    def test_no_handler(self):
+        self.app.process_event('button', Event('brightness_change', 10))
+        self.app.process_event('light', Event('click'))
+        self.assertEqual(self.app.calls, [])
+        self.assertEqual(self.logger.logged, [])
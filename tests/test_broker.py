@@ -0,0 +1,243 @@
+import os
+import queue
+import threading
+import unittest
+from unittest import mock
+import paho.mqtt.client as mqtt
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.broker import Broker, encode_length
+from iotapp.manager import AppManager
+from iotapp.test import TestLogger
+
+
+TIMEOUT = 5
+
+
+class Client:
+    def __init__(self, broker, client_id, will=None, keepalive=60):
+        self.messages = queue.Queue()
+        self.connected = threading.Event()
+        self.subscribed = threading.Event()
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = lambda client, userdata, flags, rc: self.connected.set()
+        self.client.on_subscribe = lambda *args: self.subscribed.set()
+        self.client.on_message = lambda client, userdata, msg: self.messages.put((msg.topic, msg.payload, msg.retain))
+        if will:
+            self.client.will_set(*will, retain=True)
+        self.client.connect(broker.host, broker.port, keepalive)
+        self.client.loop_start()
+        assert self.connected.wait(TIMEOUT)
+
+    def subscribe(self, topic, qos=0):
+        self.subscribed.clear()
+        self.client.subscribe(topic, qos)
+        assert self.subscribed.wait(TIMEOUT)
+
+    def get(self):
+        return self.messages.get(timeout=TIMEOUT)
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+class EncodeLengthTest(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(encode_length(0), b'\x00')
+        self.assertEqual(encode_length(127), b'\x7f')
+        self.assertEqual(encode_length(128), b'\x80\x01')
+        self.assertEqual(encode_length(16383), b'\xff\x7f')
+        self.assertEqual(encode_length(2097152), b'\x80\x80\x80\x01')
+
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker(logger=TestLogger()).start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop()
+        self.broker.stop()
+
+    def get_client(self, client_id, **kwargs):
+        client = Client(self.broker, client_id, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_publish_subscribe(self):
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('zigbee/+')
+        publisher = self.get_client('publisher')
+        publisher.client.publish('zigbee/button', '{"click": "single"}')
+        publisher.client.publish('zigbee/button/set', 'ignored')
+        publisher.client.publish('zigbee/lamp', 'on', qos=1)
+        self.assertEqual(subscriber.get(), ('zigbee/button', b'{"click": "single"}', False))
+        self.assertEqual(subscriber.get(), ('zigbee/lamp', b'on', False))
+
+    def test_retained(self):
+        publisher = self.get_client('publisher')
+        info = publisher.client.publish('shellies/lamp/online', 'true', qos=1, retain=True)
+        info.wait_for_publish(TIMEOUT)
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('shellies/#')
+        self.assertEqual(subscriber.get(), ('shellies/lamp/online', b'true', True))
+        # Empty payload clears retained message
+        publisher.client.publish('shellies/lamp/online', '', qos=1, retain=True).wait_for_publish(TIMEOUT)
+        self.assertEqual(self.broker.retained, dict())
+
+    def test_will(self):
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('iotapp/+/state')
+        client = Client(self.broker, 'app', will=('iotapp/app/state', 'offline'))
+        client.client.loop_stop()
+        client.client.socket().close()
+        self.assertEqual(subscriber.get(), ('iotapp/app/state', b'offline', False))
+        self.assertEqual(self.broker.retained['iotapp/app/state'], (b'offline', 0))
+
+    def test_clean_disconnect(self):
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('#')
+        client = Client(self.broker, 'app', will=('iotapp/app/state', 'offline'))
+        client.stop()
+        client = self.get_client('app2')
+        client.client.publish('done', 'true')
+        self.assertEqual(subscriber.get(), ('done', b'true', False))
+
+    def test_unsubscribe(self):
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('a')
+        subscriber.subscribe('b')
+        subscriber.client.unsubscribe('a')
+        publisher = self.get_client('publisher')
+        publisher.client.publish('a', '1', qos=1).wait_for_publish(TIMEOUT)
+        publisher.client.publish('b', '2')
+        self.assertEqual(subscriber.get(), ('b', b'2', False))
+
+    def test_takeover(self):
+        first = self.get_client('same')
+        first.client.loop_stop()
+        first_session = self.broker.sessions['same']
+        second = self.get_client('same')
+        second.subscribe('a')
+        self.assertIsNot(self.broker.sessions['same'], first_session)
+        self.assertTrue(first_session.closed)
+        self.assertEqual(len(self.broker.sessions), 1)
+
+
+    def test_shared_subscription(self):
+        first = self.get_client('first')
+        first.subscribe('$share/group/zigbee/+')
+        second = self.get_client('second')
+        second.subscribe('$share/group/zigbee/+')
+        other = self.get_client('other')
+        other.subscribe('$share/other/zigbee/#')
+        publisher = self.get_client('publisher')
+        for i in range(4):
+            publisher.client.publish('zigbee/button', str(i), qos=1).wait_for_publish(TIMEOUT)
+        self.assertEqual([first.get()[1], first.get()[1]], [b'0', b'2'])
+        self.assertEqual([second.get()[1], second.get()[1]], [b'1', b'3'])
+        self.assertEqual([other.get()[1] for i in range(4)], [b'0', b'1', b'2', b'3'])
+        self.assertTrue(first.messages.empty())
+        # Leaving the group
+        second.client.unsubscribe('$share/group/zigbee/+')
+        second.client.publish('sync', '').wait_for_publish(TIMEOUT)
+        for i in range(2):
+            publisher.client.publish('zigbee/button', str(i), qos=1).wait_for_publish(TIMEOUT)
+        self.assertEqual([first.get()[1], first.get()[1]], [b'0', b'1'])
+
+    def test_shared_subscription_retained(self):
+        publisher = self.get_client('publisher')
+        publisher.client.publish('zigbee/button', 'retained', qos=1, retain=True).wait_for_publish(TIMEOUT)
+        subscriber = self.get_client('subscriber')
+        subscriber.subscribe('$share/group/zigbee/+')
+        subscriber.subscribe('zigbee/+')
+        self.assertEqual(subscriber.get(), ('zigbee/button', b'retained', True))
+        self.assertTrue(subscriber.messages.empty())
+
+    def test_shared_subscription_invalid(self):
+        subscriber = self.get_client('subscriber')
+        granted = []
+        subscriber.client.on_subscribe = lambda client, userdata, mid, qos: granted.extend(qos) or subscriber.subscribed.set()
+        subscriber.subscribe('$share/zigbee')
+        self.assertEqual(granted, [0x80])
+        self.assertEqual(self.broker.share_groups, dict())
+
+
+class Counter(Toggle):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.clicks = 0
+
+    def on_button_click(self):
+        self.clicks += 1
+        super().on_button_click()
+
+
+class SharedReplicasTest(unittest.TestCase):
+    def test_replicas(self):
+        entity_library = dict(
+            button=entities.Button(state_topic='zigbee/button', state_value_click='single', state_template='{{ value.click }}'),
+            light=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        with Broker(logger=TestLogger()) as broker:
+            device = Client(broker, 'device')
+            device.subscribe('light/command')
+            device.client.publish('light/state', 'on', qos=1, retain=True).wait_for_publish(TIMEOUT)
+            environ = dict(broker.get_environ(), MQTT_SHARE_GROUP='counter')
+            replicas = []
+            for i in range(2):
+                with mock.patch.dict(os.environ, environ):
+                    app = Counter(name='counter', button='button', light='light', entity_library=entity_library, logger=TestLogger())
+                subscribed = threading.Event()
+                app.client.on_subscribe = lambda *args, subscribed=subscribed: subscribed.set()
+                app.client.connect(broker.host, broker.port)
+                app.client.loop_start()
+                replicas.append(app)
+                self.assertTrue(subscribed.wait(TIMEOUT))
+            try:
+                for i in range(10):
+                    device.client.publish('zigbee/button', '{"click": "single"}', qos=1).wait_for_publish(TIMEOUT)
+                commands = [device.get() for i in range(10)]
+                self.assertEqual(len(commands), 10)
+                self.assertEqual([app.clicks for app in replicas], [5, 5])
+                # Light state is not shared: every replica tracks it
+                self.assertEqual([app.light.state for app in replicas], ['on', 'on'])
+            finally:
+                for app in replicas:
+                    app.client.disconnect()
+                    app.client.loop_stop()
+                device.stop()
+
+
+class AppManagerBrokerTest(unittest.TestCase):
+    def test_toggle(self):
+        devices = dict(
+            button=dict(type='aqara-button'),
+            light=dict(type='shelly-rgbw2', channel1='light'),
+        )
+        apps = dict(app=dict(app='iotapp.apps.toggle.Toggle', button='button', light='light'))
+        with Broker(logger=TestLogger()) as broker:
+            device = Client(broker, 'device')
+            device.subscribe('shellies/light/white/0/command')
+            device.client.publish('shellies/light/white/0', 'on', qos=1, retain=True).wait_for_publish(TIMEOUT)
+            with mock.patch.dict(os.environ, broker.get_environ()):
+                manager = AppManager(name='app', devices=devices, apps=apps, logger=TestLogger())
+            app = manager.app_instance
+            app.logger = TestLogger()
+            thread = threading.Thread(target=manager.run)
+            thread.start()
+            try:
+                for i in range(50):
+                    if app.light.state == 'on':
+                        break
+                    threading.Event().wait(0.1)
+                self.assertEqual(app.light.state, 'on')
+                device.client.publish('zigbee/button', '{"click": "single"}')
+                self.assertEqual(device.get(), ('shellies/light/white/0/command', b'off', False))
+                self.assertEqual(broker.retained['iotapp/app/state'], (b'online', 0))
+            finally:
+                app.client.disconnect()
+                thread.join(TIMEOUT)
+                device.stop()
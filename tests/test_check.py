@@ -0,0 +1,114 @@
+import unittest
+from iotapp.apps.toggle import Toggle
+from iotapp.check import check_config, get_app_options, load_app_class
+
+
+class TimerToggle(Toggle):
+    def __init__(self, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+
+class CheckConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.devices = dict(
+            button=dict(type='aqara-button'),
+            light=dict(type='shelly-rgbw2', channel1='kitchen', channel2='bedroom'),
+        )
+        self.apps = dict(
+            kitchen=dict(app='iotapp.apps.toggle.Toggle', button='button', light='kitchen'),
+            bedroom=dict(
+                app='iotapp.apps.toggle.Toggle',
+                entities=dict(bedroom=dict(log_level='debug')),
+                button='button',
+                light='bedroom',
+                log_level='debug',
+            ),
+        )
+
+    def test_ok(self):
+        self.assertEqual(check_config(self.devices, self.apps), [])
+
+    def test_empty(self):
+        self.assertEqual(check_config(None, None), [])
+
+    def test_none_default_option(self):
+        self.apps['kitchen'].update(app='tests.test_check.TimerToggle', timeout=30)
+        self.assertEqual(check_config(self.devices, self.apps), [])
+        self.apps['kitchen']['light'] = 'hall'
+        self.assertEqual(check_config(self.devices, self.apps), [('apps', 'kitchen', 'Entity "hall" not available.')])
+
+    def test_host_options(self):
+        self.apps['kitchen']['command_interval'] = 1
+        self.assertEqual(check_config(self.devices, self.apps), [])
+        self.apps['bedroom']['command_interval'] = 2
+        self.assertEqual(check_config(self.devices, self.apps), [('apps', 'bedroom', 'Option "command_interval" differs from app "kitchen", hosted apps share it.')])
+
+    def test_devices(self):
+        devices = dict(
+            no_type=dict(),
+            wrong_type=dict(type=1),
+            unknown_type=dict(type='tasmota'),
+            wrong_option=dict(type='aqara-button', channel1='x'),
+            not_a_dict='button',
+            other_light=dict(type='shelly-rgbw2', channel1='kitchen'),
+        )
+        self.devices.update(devices)
+        self.assertEqual(check_config(self.devices, dict()), [
+            ('devices', 'no_type', 'Missing type.'),
+            ('devices', 'wrong_type', 'Wrong type.'),
+            ('devices', 'unknown_type', 'Unknown type "tasmota".'),
+            ('devices', 'wrong_option', "Wrong configuration: Button.__init__() got an unexpected keyword argument 'channel1'"),
+            ('devices', 'not_a_dict', 'Wrong configuration.'),
+            ('devices', 'other_light', 'Duplicated entity "kitchen", already defined by "light".'),
+        ])
+
+    def test_apps(self):
+        apps = dict(
+            no_app=dict(button='button'),
+            wrong_module=dict(app='iotapp.apps.missing.Toggle'),
+            wrong_app=dict(app='Toggle'),
+            missing_entity=dict(app='iotapp.apps.toggle.Toggle', button='tv', light='kitchen'),
+            missing_override=dict(app='iotapp.apps.toggle.Toggle', button='button', entities=dict(tv=None)),
+            unknown_option=dict(app='iotapp.apps.toggle.Toggle', button='button', colour='red'),
+        )
+        errors = check_config(self.devices, apps)
+        self.assertEqual(errors, [
+            ('apps', 'no_app', 'Missing app.'),
+            ('apps', 'wrong_module', 'Cannot import "iotapp.apps.missing.Toggle": No module named \'iotapp.apps.missing\''),
+            ('apps', 'wrong_app', 'Wrong app "Toggle".'),
+            ('apps', 'missing_entity', 'Entity "tv" not available.'),
+            ('apps', 'missing_override', 'Entity "tv" not available.'),
+            ('apps', 'unknown_option', 'Unknown option "colour".'),
+        ])
+
+    def test_all_errors(self):
+        self.devices['other_light'] = dict(type='shelly-rgbw2', channel1='kitchen')
+        self.apps['kitchen']['light'] = 'hall'
+        self.apps['bedroom']['colour'] = 'red'
+        self.assertEqual(len(check_config(self.devices, self.apps)), 3)
+
+
+class AppOptionsTest(unittest.TestCase):
+    def test_toggle(self):
+        entity_options, options = get_app_options(Toggle)
+        self.assertEqual(entity_options, {'button', 'light'})
+        self.assertIn('log_level', options)
+        self.assertIn('availability_topic', options)
+        self.assertNotIn('client', options)
+
+    def test_subclass(self):
+        class Counter(Toggle):
+            entity_options = ('counter',)
+
+            def __init__(self, counter=None, step=1, timeout=None, **kwargs):
+                super().__init__(**kwargs)
+        entity_options, options = get_app_options(Counter)
+        self.assertEqual(entity_options, {'button', 'light', 'counter'})
+        self.assertIn('step', options)
+        self.assertIn('timeout', options)
+        self.assertNotIn('counter', options)
+
+    def test_load_app_class(self):
+        self.assertIs(load_app_class('iotapp.apps.toggle.Toggle'), Toggle)
+        self.assertEqual(load_app_class('iotapp.apps.toggle.Missing'), 'Cannot import "iotapp.apps.toggle.Missing": module \'iotapp.apps.toggle\' has no attribute \'Missing\'')
@@ -0,0 +1,124 @@
+import threading
+import unittest
+from unittest import mock
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.commands import CommandCoalescer
+from iotapp.test import TestClient, TestLogger
+
+
+class CommandCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.now = 100.0
+        self.timers = []
+        patchers = [
+            mock.patch('iotapp.commands.time.monotonic', side_effect=lambda: self.now),
+            mock.patch('iotapp.commands.threading.Timer', side_effect=self.get_timer),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.coalescer = CommandCoalescer(self.client, interval=0.5)
+
+    def get_timer(self, interval, function, args):
+        timer = mock.Mock(interval=interval, function=function, args=args)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self, timer):
+        timer.function(*timer.args)
+
+    def test_leading_edge(self):
+        self.coalescer.publish('light/set', '10')
+        self.assertEqual(self.client.published, [('light/set', '10')])
+        self.assertEqual(self.timers, [])
+
+    def test_trailing_edge(self):
+        for value in range(10, 60, 10):
+            self.coalescer.publish('light/set', str(value))
+            self.now += 0.01
+        self.assertEqual(self.client.published, [('light/set', '10')])
+        self.assertEqual(len(self.timers), 1)
+        self.assertAlmostEqual(self.timers[0].interval, 0.49)
+        self.timers[0].start.assert_called_once_with()
+        self.fire(self.timers[0])
+        self.assertEqual(self.client.published, [('light/set', '10'), ('light/set', '50')])
+        self.assertEqual((self.coalescer.sent, self.coalescer.merged, self.coalescer.dropped), (2, 3, 0))
+
+    def test_dropped(self):
+        self.coalescer.publish('light/command', 'on')
+        self.coalescer.publish('light/command', 'off')
+        self.coalescer.publish('light/command', 'off')
+        self.fire(self.timers[0])
+        self.assertEqual(self.client.published, [('light/command', 'on'), ('light/command', 'off')])
+        self.assertEqual((self.coalescer.sent, self.coalescer.merged, self.coalescer.dropped), (2, 0, 1))
+
+    def test_interval_elapsed(self):
+        self.coalescer.publish('light/set', '10')
+        self.now += 0.5
+        self.coalescer.publish('light/set', '20')
+        self.assertEqual(self.client.published, [('light/set', '10'), ('light/set', '20')])
+        self.assertEqual(self.timers, [])
+
+    def test_topics(self):
+        self.coalescer.publish('kitchen/set', '10')
+        self.coalescer.publish('bedroom/set', '10')
+        self.assertEqual(self.client.published, [('kitchen/set', '10'), ('bedroom/set', '10')])
+
+    def test_flush_all(self):
+        self.coalescer.publish('light/set', '10')
+        self.coalescer.publish('light/set', '20')
+        self.coalescer.flush_all()
+        self.timers[0].cancel.assert_called_once_with()
+        self.assertEqual(self.client.published, [('light/set', '10'), ('light/set', '20')])
+        self.fire(self.timers[0])
+        self.assertEqual(len(self.client.published), 2)
+
+
+class CommandCoalescerTimerTest(unittest.TestCase):
+    def test_timer(self):
+        client = TestClient()
+        coalescer = CommandCoalescer(client, interval=0.05)
+        published = threading.Event()
+        coalescer.publish('light/set', '10')
+        coalescer.publish('light/set', '20')
+        client.publish = lambda topic, payload=None, qos=0, retain=False: published.set()
+        self.assertTrue(published.wait(1))
+        self.assertEqual(coalescer.sent, 2)
+
+
+class CommandIntervalAppTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        entity_library = dict(
+            button=entities.Button(state_topic='button/state'),
+            light=entities.Light(
+                state_topic='light/state',
+                command_topic='light/command',
+                brightness_command_topic='light/set',
+                brightness_command_template='{{ value }}',
+            ),
+        )
+        self.app = Toggle(button='button', light='light', entity_library=entity_library, command_interval=10, client=self.client, logger=TestLogger())
+
+    def test_publisher(self):
+        self.assertIsInstance(self.app.publisher, CommandCoalescer)
+        self.assertIs(self.app.light.publisher, self.app.publisher)
+        self.assertIs(self.app.light.client, self.client)
+
+    def test_coalesced(self):
+        for value in range(5):
+            self.app.light.brightness = value
+        self.app.light.turn_on()
+        self.app.light.turn_off()
+        self.assertEqual(self.client.published, [('light/set', '0'), ('light/command', 'on')])
+        self.app.publisher.flush_all()
+        self.assertEqual(self.client.published[2:], [('light/set', '4'), ('light/command', 'off')])
+        gauges = self.app.metrics.get_gauges()
+        self.assertEqual((gauges['commands_sent'], gauges['commands_merged'], gauges['commands_dropped']), (4, 3, 0))
+
+    def test_disabled(self):
+        app = Toggle(button='button', light='light', entity_library=self.app.entity_library, client=self.client, logger=TestLogger())
+        self.assertIsNone(app.publisher)
+        self.assertIs(app.light.publisher, self.client)
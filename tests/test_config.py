@@ -1,7 +1,8 @@
 import os
+import tempfile
 import unittest
 from iotapp import entities
-from iotapp.config import DeviceManager
+from iotapp.config import ConfigCache, DeviceManager, EntityLibrary, load_yaml
 from iotapp.config import get_entities, validate_devices, validate_apps
 from iotapp.test import TestLogger
 
@@ -31,6 +32,7 @@ class DevicesManagerTest(unittest.TestCase):
         self.assertEqual(config['state_topic'], 'zigbee/button')
         self.assertEqual(config['state_value_click'], 'single')
         self.assertEqual(config['state_template'], '{{ value.click }}')
+        self.assertEqual(config['subscribe_wildcard'], 'zigbee/+')
         # kitchen
         entity = manager.entities['kitchen']
         self.assertEqual(entity['class'], entities.Light)
@@ -61,6 +63,59 @@ class DevicesManagerTest(unittest.TestCase):
         self.assertEqual(config['command_topic'], 'shellies/kitchen/white/0/command')
 
 
+class EntityLibraryTest(unittest.TestCase):
+    def setUp(self):
+        devices = dict(
+            button=dict(type='aqara-button'),
+            kitchen=dict(type='shelly-rgbw2', channel1='kitchen_lamp', channel2='pantry_lamp'),
+        )
+        self.device_manager = DeviceManager(devices=devices)
+        self.library = EntityLibrary(self.device_manager.entities, dict(button=dict(log_level='debug')))
+
+    def test_lazy(self):
+        self.assertEqual(len(self.library), 3)
+        self.assertEqual(list(self.library), ['button', 'kitchen_lamp', 'pantry_lamp'])
+        self.assertIn('button', self.library)
+        self.assertNotIn('other', self.library)
+        self.assertEqual(self.library.cache, dict())
+        entity = self.library['button']
+        self.assertIsInstance(entity, entities.Button)
+        self.assertEqual(entity.log_level, 'debug')
+        self.assertIs(self.library['button'], entity)
+        self.assertEqual(list(self.library.cache), ['button'])
+        with self.assertRaises(KeyError):
+            self.library['other']
+
+    def test_build(self):
+        entity = self.library.build('kitchen_lamp')
+        self.assertIsInstance(entity, entities.Light)
+        self.assertIsNot(self.library.build('kitchen_lamp'), entity)
+        self.assertEqual(self.library.cache, dict())
+
+    def test_load(self):
+        button = self.library['button']
+        kitchen_lamp = self.library['kitchen_lamp']
+        entities_config = dict(kitchen_lamp=dict(log_level='debug'))
+        names = ['button', 'kitchen_lamp', 'pantry_lamp']
+        changed = self.library.load(self.device_manager.entities, entities_config, names)
+        self.assertEqual(changed, {'button', 'kitchen_lamp'})
+        self.assertIsNot(self.library['kitchen_lamp'], kitchen_lamp)
+        self.assertIsNot(self.library['button'], button)
+        pantry_lamp = self.library['pantry_lamp']
+        self.assertEqual(self.library.load(self.device_manager.entities, entities_config, names), set())
+        self.assertIs(self.library['pantry_lamp'], pantry_lamp)
+
+    def test_load_unused(self):
+        button = self.library['button']
+        devices = dict(kitchen=dict(type='shelly-rgbw2', channel1='kitchen_lamp'))
+        changed = self.library.load(DeviceManager(devices=devices).entities, dict(), ['kitchen_lamp'])
+        # Entities no app uses are not compared, only dropped from the cache
+        self.assertEqual(changed, set())
+        self.assertEqual(self.library.cache, dict())
+        self.assertNotIn('button', self.library)
+        self.assertIsInstance(self.library['kitchen_lamp'], entities.Light)
+
+
 class ValidateDevicesTest(unittest.TestCase):
     def test_ok(self):
         devices = dict(kitchen=dict(type='tasmota-sonoff'))
@@ -176,3 +231,66 @@ class ValidateAppsTest(unittest.TestCase):
         ok, ko = validate_apps(devices, apps)
         self.assertEqual(ok, dict())
         self.assertEqual(ko, dict())
+
+
+class LoadYamlTest(unittest.TestCase):
+    def test_load(self):
+        self.assertEqual(load_yaml(b'kitchen:\n  type: aqara-button\n'), dict(kitchen=dict(type='aqara-button')))
+
+
+class ConfigCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger = TestLogger()
+        self.cache = ConfigCache(os.path.join(self.directory.name, 'cache'), logger=self.logger)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_key(self):
+        key = self.cache.get_key(b'devices', b'apps')
+        self.assertEqual(key, self.cache.get_key(b'devices', b'apps'))
+        self.assertNotEqual(key, self.cache.get_key(b'devices', b'apps2'))
+        self.assertNotEqual(key, self.cache.get_key(b'devicesa', b'pps'))
+
+    def test_save_load(self):
+        key = self.cache.get_key(b'devices', b'apps')
+        self.assertEqual(self.cache.load(key), None)
+        manager = DeviceManager(devices=dict(button=dict(type='aqara-button')))
+        self.cache.save(key, dict(expanded=manager.devices))
+        data = self.cache.load(key)
+        self.assertEqual(data['expanded']['button']['button']['class'], entities.Button)
+        self.assertEqual(os.listdir(self.cache.directory), ['{}.pickle'.format(key)])
+
+    def test_stale_entries(self):
+        os.makedirs(self.cache.directory)
+        with open(os.path.join(self.cache.directory, 'other.pickle'), 'wb') as other_file:
+            other_file.write(b'not ours')
+        keys = []
+        for index in range(4):
+            key = self.cache.get_key(b'devices', str(index).encode('utf-8'))
+            self.cache.save(key, dict())
+            os.utime(self.cache.get_file_name(key), (index, index))
+            keys.append(key)
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), sorted(['other.pickle'] + ['{}.pickle'.format(key) for key in keys[1:]]))
+
+    def test_cached_errors(self):
+        devices = dict(button=dict(type='aqara-button', wrong=True))
+        manager = DeviceManager(devices=devices, logger=TestLogger())
+        self.assertEqual(list(manager.errors), ['button'])
+        DeviceManager(expanded=manager.devices, errors=manager.errors, logger=self.logger)
+        self.assertEqual(self.logger.logged, [('error', 'device discarded: button - {}'.format(manager.errors['button']))])
+        self.assertIn('wrong', manager.errors['button'])
+
+    def test_corrupted(self):
+        key = self.cache.get_key(b'devices', b'apps')
+        os.makedirs(self.cache.directory)
+        with open(self.cache.get_file_name(key), 'wb') as cache_file:
+            cache_file.write(b'garbage')
+        self.assertEqual(self.cache.load(key), None)
+        self.assertEqual(self.logger.logged, [('warning', 'Discarding unreadable config cache {}'.format(key))])
+
+    def test_expanded(self):
+        expanded = DeviceManager(devices=dict(button=dict(type='aqara-button'))).devices
+        manager = DeviceManager(expanded=expanded)
+        self.assertEqual(list(manager.entities.keys()), ['button'])
@@ -20,6 +20,7 @@ class Rgbw2Test(unittest.TestCase):
         self.assertEqual(config['brightness_state_template'], '{{ value.brightness }}')
         self.assertEqual(config['brightness_command_topic'], 'shellies/kitchen/white/0/set')
         self.assertEqual(config['brightness_command_template'], '{"brightness": {{ value }}}')
+        self.assertEqual(config['subscribe_wildcard'], 'shellies/#')
         # pantry_lamp
         entity = device.get_entities()['pantry_lamp']
         self.assertEqual(entity['class'], entities.Light)
@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.dispatch import PoolDispatcher
+from iotapp.test import TestClient, TestLogger
+
+
+class PoolDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = TestLogger()
+        self.result = dict()
+        self.lock = threading.Lock()
+
+    def append(self, key, value):
+        with self.lock:
+            self.result.setdefault(key, []).append(value)
+
+    def test_wrong_overflow(self):
+        with self.assertRaises(ValueError):
+            PoolDispatcher(overflow='wrong')
+
+    def test_ordering(self):
+        dispatcher = PoolDispatcher(workers=4, logger=self.logger)
+        dispatcher.start()
+        for number in range(200):
+            for key in ['a', 'b', 'c', 'd', 'e']:
+                dispatcher.submit(key, self.append, key, number)
+        dispatcher.join()
+        dispatcher.stop()
+        for key in ['a', 'b', 'c', 'd', 'e']:
+            self.assertEqual(self.result[key], list(range(200)))
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats['submitted'], 1000)
+        self.assertEqual(stats['processed'], 1000)
+        self.assertEqual(stats['depth'], 0)
+        self.assertGreaterEqual(stats['max_lag'], stats['lag'])
+
+    def test_same_worker(self):
+        dispatcher = PoolDispatcher(workers=8)
+        self.assertIs(dispatcher.get_queue('light'), dispatcher.get_queue('light'))
+
+    def test_drop_new(self):
+        dispatcher = PoolDispatcher(workers=1, queue_size=2, overflow='drop_new', logger=self.logger)
+        self.assertTrue(dispatcher.submit('a', self.append, 'a', 1))
+        self.assertTrue(dispatcher.submit('a', self.append, 'a', 2))
+        self.assertFalse(dispatcher.submit('a', self.append, 'a', 3))
+        self.assertEqual(dispatcher.depth(), 2)
+        dispatcher.start()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(self.result['a'], [1, 2])
+        self.assertEqual(dispatcher.dropped, 1)
+        self.assertEqual(self.logger.logged, [('warning', 'Queue full, event dropped')])
+
+    def test_drop_old(self):
+        dispatcher = PoolDispatcher(workers=1, queue_size=2, overflow='drop_old', logger=self.logger)
+        for number in range(5):
+            dispatcher.submit('a', self.append, 'a', number)
+        dispatcher.start()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(self.result['a'], [3, 4])
+        self.assertEqual(dispatcher.dropped, 3)
+
+    def test_drop_log_interval(self):
+        dispatcher = PoolDispatcher(workers=1, queue_size=1, overflow='drop_new', drop_log_interval=100, logger=self.logger)
+        for number in range(251):
+            dispatcher.submit('a', self.append, 'a', number)
+        self.assertEqual(dispatcher.dropped, 250)
+        self.assertEqual(self.logger.logged, [
+            ('warning', 'Queue full, event dropped'),
+            ('warning', 'Queue full, 100 events dropped'),
+            ('warning', 'Queue full, 200 events dropped'),
+        ])
+
+    def test_exception(self):
+        dispatcher = PoolDispatcher(workers=1, logger=self.logger)
+        dispatcher.start()
+        dispatcher.submit('a', lambda: 1 / 0)
+        dispatcher.submit('a', self.append, 'a', 1)
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertEqual(self.result['a'], [1])
+        self.assertEqual(self.logger.logged[0][0], 'exception')
+
+    def test_lag(self):
+        dispatcher = PoolDispatcher(workers=1)
+        dispatcher.submit('a', self.append, 'a', 1)
+        time.sleep(0.02)
+        dispatcher.start()
+        dispatcher.join()
+        dispatcher.stop()
+        self.assertGreaterEqual(dispatcher.max_lag, 0.02)
+
+
+class IotAppDispatchTest(unittest.TestCase):
+    def test_toggle(self):
+        client = TestClient()
+        logger = TestLogger()
+        entity_library = dict(
+            mybutton=entities.Button(state_topic='button/state'),
+            mylight=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        app = Toggle(entity_library=entity_library, button='mybutton', light='mylight', dispatch_workers=2, client=client, logger=logger)
+        self.assertEqual(len(app.dispatcher.threads), 2)
+        app.button.logger = logger
+        app.light.logger = logger
+        client.receive('light/state', 'on')
+        client.receive('button/state', 'click')
+        app.dispatcher.join()
+        app.dispatcher.stop()
+        self.assertEqual(client.published, [('light/command', 'off')])
+        self.assertEqual(logger.logged, [('info', 'on_button_click -> light: off')])
+        self.assertEqual(app.dispatcher.processed, 1)
@@ -22,6 +22,27 @@ class EntityTest(unittest.TestCase):
         self.assertEqual(entity.get_subscribe_topics(), [])
         self.assertEqual(entity.available, None)
 
+    def test_shareable_topics(self):
+        self.assertEqual(entities.Entity(availability_topic='status').get_shareable_topics(), [])
+        self.assertEqual(entities.Light(state_topic='light/state').get_shareable_topics(), [])
+        self.assertEqual(entities.Button(state_topic='button/state', availability_topic='status').get_shareable_topics(), ['button/state'])
+
+    def test_slots(self):
+        for entity in [entities.Entity(), entities.Button(), entities.Light()]:
+            self.assertFalse(hasattr(entity, '__dict__'))
+
+    def test_shared_logger(self):
+        kitchen = entities.Light(name='kitchen')
+        bedroom = entities.Light(name='bedroom')
+        debug = entities.Light(name='hall', log_level='debug')
+        self.assertIs(kitchen.logger.logger, bedroom.logger.logger)
+        self.assertEqual(kitchen.logger.logger.name, 'app.entity.light')
+        self.assertEqual(kitchen.logger.prefix, 'kitchen')
+        self.assertEqual(debug.logger.logger.name, 'app.entity.light.debug')
+        kitchen.set_name('pantry')
+        kitchen.set_logger()
+        self.assertEqual(kitchen.logger.prefix, 'pantry')
+
 
 class EntityAvailabilityTest(unittest.TestCase):
     def setUp(self):
@@ -103,6 +124,10 @@ class ButtonTest(unittest.TestCase):
         button = entities.Button(state_topic = 'state/topic')
         self.assertEqual(button.get_subscribe_topics(), ['state/topic'])
 
+    def test_get_subscriptions(self):
+        button = entities.Button(state_topic='state/topic', availability_topic='status', qos=1, topic_qos={'status': 0})
+        self.assertEqual(button.get_subscriptions(), [('status', 0), ('state/topic', 1)])
+
 
 class LightShellyRgbw2Test(unittest.TestCase):
     def setUp(self):
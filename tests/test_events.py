@@ -10,5 +10,8 @@ class EventTest(unittest.TestCase):
     def test_not_equal(self):
         self.assertNotEqual(Event('status', 'online'), Event('status', 'offline'))
 
+    def test_slots(self):
+        self.assertFalse(hasattr(Event('status', 'online'), '__dict__'))
+
     def test_repr(self):
         self.assertEqual(str(Event('status', 'online')), "status ('online',) {}")
@@ -0,0 +1,87 @@
+import unittest
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.host import AppHost
+from iotapp.test import TestClient, TestLogger
+
+
+class Counter(Toggle):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.clicks = 0
+
+    def on_button_click(self):
+        self.clicks += 1
+
+
+class AppHostTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        entity_library = dict(
+            table_button=entities.Button(state_topic='button/state'),
+            kitchen_lamp=entities.Light(state_topic='kitchen/state', command_topic='kitchen/command'),
+            bedroom_lamp=entities.Light(state_topic='bedroom/state', command_topic='bedroom/command'),
+        )
+        self.host = AppHost(entity_library=entity_library, client=self.client, logger=self.logger)
+        self.kitchen = self.host.add_app('kitchen', Toggle, button='table_button', light='kitchen_lamp', logger=self.logger)
+        self.bedroom = self.host.add_app('bedroom', Toggle, button='table_button', light='bedroom_lamp', logger=self.logger)
+        self.counter = self.host.add_app('counter', Counter, button='table_button', light='kitchen_lamp', logger=self.logger)
+        for entity in self.host.app_entities.values():
+            entity.logger = self.logger
+
+    def test_apps(self):
+        self.assertEqual(list(self.host.apps.keys()), ['kitchen', 'bedroom', 'counter'])
+        self.assertIs(self.kitchen.client, self.client)
+        self.assertIs(self.client.on_message.__self__, self.host)
+
+    def test_shared_entities(self):
+        self.assertEqual(len(self.host.app_entities), 3)
+        self.assertIs(self.kitchen.button, self.bedroom.button)
+        self.assertIs(self.kitchen.light, self.counter.light)
+        self.assertIsNot(self.kitchen.light, self.bedroom.light)
+
+    def test_connect(self):
+        self.client.connect()
+        self.assertEqual(self.client.subscribed, ['button/state', 'kitchen/state', 'bedroom/state'])
+        self.assertEqual(self.client.published, [
+            ('iotapp/iotapp/state', 'online'),
+            ('iotapp/kitchen/state', 'online'),
+            ('iotapp/bedroom/state', 'online'),
+            ('iotapp/counter/state', 'online'),
+        ])
+
+    def test_host_options(self):
+        app = self.host.add_app('hall', Toggle, button='table_button', light='kitchen_lamp', command_interval=1, logger=self.logger)
+        self.assertIs(app.publisher, self.host.publisher)
+        self.assertEqual(self.logger.logged, [('warning', 'hall - option command_interval ignored, hosted apps use the host one')])
+
+    def test_availability_on_reload(self):
+        self.client.connect()
+        self.client.published = []
+        self.host.remove_app('counter')
+        self.host.add_app('hall', Toggle, button='table_button', light='kitchen_lamp', logger=self.logger)
+        self.assertEqual(self.client.published, [('iotapp/counter/state', 'offline'), ('iotapp/hall/state', 'online')])
+
+    def test_click(self):
+        self.client.receive('kitchen/state', 'on')
+        self.client.receive('bedroom/state', 'off')
+        self.client.receive('button/state', 'click')
+        self.assertEqual(self.client.published, [('kitchen/command', 'off'), ('bedroom/command', 'on')])
+        self.assertEqual(self.counter.clicks, 1)
+        self.assertEqual(
+            self.logger.logged,
+            [('info', 'on_button_click -> light: off'), ('info', 'on_button_click -> light: on')]
+        )
+
+    def test_handlers(self):
+        self.assertEqual(list(self.host.handlers.keys()), [('table_button', 'click')])
+        self.assertEqual(
+            self.host.handlers[('table_button', 'click')],
+            [(self.kitchen, 'button'), (self.bedroom, 'button'), (self.counter, 'button')]
+        )
+
+    def test_state_shared(self):
+        self.client.receive('kitchen/state', 'on')
+        self.assertEqual(self.kitchen.light.state, 'on')
+        self.assertEqual(self.counter.light.state, 'on')
@@ -0,0 +1,66 @@
+import logging
+import unittest
+from logging.handlers import QueueHandler
+from unittest import mock
+from iotapp.logger import EntityLogger, LoggerMixin, TopicSampler
+
+
+class LoggerMixinTest(unittest.TestCase):
+    def test_single_handler(self):
+        mixin = LoggerMixin()
+        logger = mixin.get_logger()
+        mixin.get_logger()
+        mixin.get_logger(level='debug')
+        self.assertEqual(logger.name, 'app')
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+        self.assertEqual(logger.level, logging.DEBUG)
+
+    def test_name(self):
+        logger = LoggerMixin().get_logger(name='entity', level='warning')
+        self.assertEqual(logger.name, 'app.entity')
+        self.assertEqual(logger.handlers, [])
+        self.assertEqual(logger.level, logging.WARNING)
+
+
+    def test_same_level(self):
+        logger = LoggerMixin().get_logger(name='entity', level='warning')
+        with mock.patch.object(logger, 'setLevel') as set_level:
+            LoggerMixin().get_logger(name='entity', level='warning')
+        set_level.assert_not_called()
+
+
+class EntityLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = mock.Mock()
+        self.logger.isEnabledFor.side_effect = lambda level: level >= logging.INFO
+
+    def test_prefix(self):
+        EntityLogger(self.logger, 'kitchen').info('state %s', 'on')
+        self.logger.log.assert_called_once_with(logging.INFO, 'kitchen - state %s', 'on')
+
+    def test_no_prefix(self):
+        EntityLogger(self.logger).warning('offline')
+        self.logger.log.assert_called_once_with(logging.WARNING, 'offline')
+
+    def test_disabled(self):
+        logger = EntityLogger(self.logger, 'kitchen')
+        logger.debug('state %s', 'on')
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+        self.logger.log.assert_not_called()
+
+    def test_exception(self):
+        EntityLogger(self.logger, 'kitchen').exception('error')
+        self.logger.log.assert_called_once_with(logging.ERROR, 'kitchen - error', exc_info=True)
+
+
+class TopicSamplerTest(unittest.TestCase):
+    def test_disabled(self):
+        sampler = TopicSampler()
+        self.assertEqual([sampler.sample('a') for i in range(3)], [True, True, True])
+        self.assertEqual(sampler.counters, dict())
+
+    def test_rate(self):
+        sampler = TopicSampler(3)
+        self.assertEqual([sampler.sample('a') for i in range(7)], [True, False, False, True, False, False, True])
+        self.assertTrue(sampler.sample('b'))
@@ -1,9 +1,12 @@
 import os
+import tempfile
 import unittest
+from unittest import mock
 from iotapp.apps.toggle import Toggle
 from iotapp import entities
+from iotapp.host import AppHost
 from iotapp.manager import AppManager
-from iotapp.test import TestLogger
+from iotapp.test import TestClient, TestLogger
 
 
 class AppManagerTest(unittest.TestCase):
@@ -32,6 +35,18 @@ class AppManagerTest(unittest.TestCase):
         # App Instance
         self.assertIsInstance(manager.app_instance, Toggle)
 
+    def test_cache(self):
+        devices = os.path.join(os.path.dirname(__file__), 'devices.yml')
+        apps = os.path.join(os.path.dirname(__file__), 'apps.yml')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            AppManager(name='toggle_kitchen_lamp', devices=devices, apps=apps, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            with mock.patch('iotapp.manager.load_yaml', side_effect=AssertionError('cache not used')):
+                manager = AppManager(name='toggle_kitchen_lamp', devices=devices, apps=apps, cache_dir=cache_dir)
+        self.assertEqual(manager.config, dict(button='table_button', light='kitchen_lamp'))
+        self.assertEqual(manager.entities['kitchen_lamp'].state_topic, 'shellies/kitchen_lamp/white/0')
+        self.assertIsInstance(manager.app_instance, Toggle)
+
     def test_apps_entity_override(self):
         devices = dict(
             button=dict(type='aqara-button'),
@@ -50,4 +65,219 @@ class AppManagerTest(unittest.TestCase):
         manager = AppManager(name='app', devices=devices, apps=apps)
         # button
         entity = manager.entities['button']
-        self.assertEqual(entity.log_level, 'debug')
\ No newline at end of file
+        self.assertEqual(entity.log_level, 'debug')
+
+    def test_lazy_entities(self):
+        devices = dict(('light{}'.format(i), dict(type='shelly-rgbw2', channel1='lamp{}'.format(i))) for i in range(100))
+        devices['button'] = dict(type='aqara-button')
+        apps = dict(app=dict(app='iotapp.apps.toggle.Toggle', button='button', light='lamp42'))
+        with mock.patch('iotapp.entities.Light.__init__', side_effect=entities.Light.__init__, autospec=True) as light_init:
+            manager = AppManager(name='app', devices=devices, apps=apps)
+        self.assertEqual(len(manager.entities), 101)
+        self.assertEqual(light_init.call_count, 1)
+        self.assertEqual(manager.entities.cache, dict())
+        self.assertEqual(manager.app_instance.light.state_topic, 'shellies/light42/white/0')
+
+    def test_many_apps(self):
+        devices = dict(
+            button=dict(type='aqara-button'),
+            light=dict(type='shelly-rgbw2', channel1='kitchen', channel2='bedroom'),
+        )
+        apps = dict(
+            kitchen=dict(app='iotapp.apps.toggle.Toggle', button='button', light='kitchen'),
+            bedroom=dict(
+                app='iotapp.apps.toggle.Toggle',
+                entities=dict(bedroom=dict(log_level='debug')),
+                button='button',
+                light='bedroom',
+            ),
+            other=dict(app='iotapp.apps.toggle.Toggle', button='button', light='kitchen'),
+        )
+        manager = AppManager(name='kitchen, bedroom', devices=devices, apps=apps, logger=self.logger)
+        self.assertEqual(manager.entities.cache, dict())
+        self.assertEqual(manager.names, ['kitchen', 'bedroom'])
+        self.assertIsInstance(manager.app_instance, AppHost)
+        self.assertEqual(list(manager.app_instance.apps.keys()), ['kitchen', 'bedroom'])
+        self.assertEqual(manager.entities['bedroom'].log_level, 'debug')
+        self.assertIs(manager.app_instance.apps['kitchen'].button, manager.app_instance.apps['bedroom'].button)
+        self.assertEqual(self.logger.logged, [('info', 'Hosting 2 apps: kitchen, bedroom')])
+        # All apps
+        manager = AppManager(devices=devices, apps=apps, logger=self.logger)
+        self.assertEqual(manager.names, ['kitchen', 'bedroom', 'other'])
+
+
+    def test_host_options(self):
+        devices = dict(
+            button=dict(type='aqara-button'),
+            light=dict(type='shelly-rgbw2', channel1='kitchen', channel2='bedroom'),
+        )
+        apps = dict(
+            kitchen=dict(app='iotapp.apps.toggle.Toggle', button='button', light='kitchen', subscribe_wildcards=True, command_interval=1),
+            bedroom=dict(app='iotapp.apps.toggle.Toggle', button='button', light='bedroom', command_interval=2),
+        )
+        manager = AppManager(devices=devices, apps=apps, logger=self.logger)
+        host = manager.app_instance
+        self.assertEqual(manager.host_config, dict(subscribe_wildcards=True, command_interval=2))
+        self.assertTrue(host.subscribe_wildcards)
+        self.assertEqual(host.publisher.interval, 2)
+        self.assertIs(host.apps['kitchen'].publisher, host.publisher)
+        self.assertIn(('warning', 'bedroom - option command_interval configured differently by another app, using this configuration'), self.logger.logged)
+
+
+class AppManagerReloadTest(unittest.TestCase):
+    devices = '''
+button:
+  type: aqara-button
+light:
+  type: shelly-rgbw2
+  channel1: kitchen
+  channel2: bedroom
+'''
+    apps = '''
+kitchen:
+  app: iotapp.apps.toggle.Toggle
+  button: button
+  light: kitchen
+bedroom:
+  app: iotapp.apps.toggle.Toggle
+  button: button
+  light: bedroom
+'''
+
+    def setUp(self):
+        self.logger = TestLogger()
+        self.directory = tempfile.TemporaryDirectory()
+        self.devices_file = os.path.join(self.directory.name, 'devices.yml')
+        self.apps_file = os.path.join(self.directory.name, 'apps.yml')
+        self.write(self.devices_file, self.devices)
+        self.write(self.apps_file, self.apps)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, file_name, data):
+        with open(file_name, 'w') as f:
+            f.write(data)
+
+    def get_manager(self, name=None):
+        manager = AppManager(name=name, devices=self.devices_file, apps=self.apps_file, logger=self.logger)
+        manager.app_instance.client = self.client = TestClient()
+        manager.app_instance.client.connect = lambda *args, **kwargs: None
+        self.client.subscribe(list(manager.app_instance.get_subscriptions().items()))
+        self.client.subscribed = []
+        return manager
+
+    def test_unchanged(self):
+        manager = self.get_manager()
+        host = manager.app_instance
+        kitchen = host.apps['kitchen']
+        light = host.app_entities['kitchen']
+        manager.reload()
+        self.assertIs(host.apps['kitchen'], kitchen)
+        self.assertIs(host.app_entities['kitchen'], light)
+        self.assertEqual(self.client.subscribed, [])
+        self.assertEqual(self.client.unsubscribed, [])
+        self.assertEqual(self.logger.logged[-1], ('info', 'reload - 0 entities changed, 0 topics subscribed, 0 unsubscribed'))
+
+    def test_entity_changed(self):
+        manager = self.get_manager()
+        host = manager.app_instance
+        button = host.app_entities['button']
+        bedroom = host.app_entities['bedroom']
+        bedroom.state = True
+        self.write(self.devices_file, self.devices.replace('channel1: kitchen', 'channel1: kitchen\n  channel3: hall').replace('  channel2: bedroom\n', ''))
+        manager.reload()
+        # Untouched entity keeps its instance
+        self.assertIs(host.app_entities['button'], button)
+        self.assertIs(host.apps['kitchen'].button, button)
+        # Removed entity keeps running
+        self.assertIs(host.apps['bedroom'].light, bedroom)
+        self.assertIn(('warning', 'reload - entity bedroom removed, keeping the running one'), self.logger.logged)
+        self.assertEqual(self.client.subscribed, [])
+        self.assertEqual(self.client.unsubscribed, [])
+
+    def test_entity_topic_changed(self):
+        manager = self.get_manager(name='kitchen')
+        app = manager.app_instance
+        button = app.button
+        self.write(self.apps_file, self.apps.replace('  button: button\n', '  button: button\n  entities:\n    kitchen:\n      state_topic: kitchen/state\n', 1))
+        manager.reload()
+        self.assertIs(app.button, button)
+        self.assertIsNot(app.light, manager.entities['kitchen'])
+        self.assertEqual(app.light.state_topic, 'kitchen/state')
+        self.assertEqual(app.router.match('kitchen/state'), ['light'])
+        self.assertEqual(app.router.match('shellies/light/white/0'), [])
+        self.assertEqual(self.client.unsubscribed, ['shellies/light/white/0'])
+        # All the light topics again, the retained messages rebuild its state
+        self.assertEqual(self.client.subscribed, ['shellies/light/online', 'kitchen/state', 'shellies/light/white/0/status'])
+        self.assertNotIn(('warning', 'reload - kitchen configuration changed, restart required'), self.logger.logged)
+
+    def test_entity_topic_changed_wildcards(self):
+        self.write(self.apps_file, self.apps.replace('  light: kitchen\n', '  light: kitchen\n  subscribe_wildcards: true\n', 1))
+        manager = self.get_manager(name='kitchen')
+        app = manager.app_instance
+        self.assertIn('shellies/#', app.get_subscriptions())
+        self.write(self.apps_file, self.apps.replace('  light: kitchen\n', '  light: kitchen\n  subscribe_wildcards: true\n  entities:\n    kitchen:\n      state_topic: shellies/light/white/0/state\n', 1))
+        manager.reload()
+        self.assertEqual(app.light.state_topic, 'shellies/light/white/0/state')
+        # The wildcard covers the new topic, subscribing it again sends the retained messages
+        self.assertEqual(self.client.subscribed, ['shellies/#'])
+        self.assertEqual(self.client.unsubscribed, [])
+
+    def test_entity_value_changed(self):
+        manager = self.get_manager(name='kitchen')
+        app = manager.app_instance
+        self.client.on_message = app.on_message
+        self.client.receive('shellies/light/online', 'true')
+        self.client.receive('shellies/light/white/0', 'on')
+        self.client.receive('shellies/light/white/0/status', '{"ison": true, "brightness": 50}')
+        state = app.light.get_state()
+        self.assertEqual(state, dict(available=True, state='on', brightness=50))
+        self.write(self.apps_file, self.apps.replace('  button: button\n', '  button: button\n  entities:\n    kitchen:\n      command_value_on: "1"\n', 1))
+        manager.reload()
+        self.assertEqual(app.light.command_value_on, '1')
+        self.assertEqual(app.light.get_state(), state)
+        self.assertEqual(self.client.subscribed, [])
+        app.light.toggle()
+        self.assertEqual(self.client.published[-1], ('shellies/light/white/0/command', 'off'))
+
+    def test_conflicting_entity_config(self):
+        self.write(self.apps_file, self.apps
+            .replace('  light: kitchen\n', '  light: kitchen\n  entities:\n    button:\n      log_level: debug\n')
+            .replace('  light: bedroom\n', '  light: bedroom\n  entities:\n    button:\n      log_level: info\n'))
+        manager = self.get_manager()
+        self.assertIn(('warning', 'bedroom - entity button configured differently by another app, using this configuration'), self.logger.logged)
+        self.assertEqual(manager.app_instance.app_entities['button'].log_level, 'info')
+
+    def test_app_added_and_removed(self):
+        manager = self.get_manager()
+        host = manager.app_instance
+        self.write(self.apps_file, self.apps.replace('bedroom:', 'hall:').replace('light: bedroom', 'light: kitchen'))
+        manager.reload()
+        self.assertEqual(manager.names, ['kitchen', 'hall'])
+        self.assertEqual(list(host.app_entities), ['button', 'kitchen'])
+        self.assertIs(host.apps['hall'].light, host.app_entities['kitchen'])
+        self.assertEqual(host.handlers[('button', 'click')], [(host.apps['kitchen'], 'button'), (host.apps['hall'], 'button')])
+        self.assertEqual(self.client.unsubscribed, ['shellies/light/white/1', 'shellies/light/white/1/status'])
+        self.assertEqual(self.client.subscribed, [])
+
+    def test_host_options_changed(self):
+        manager = self.get_manager()
+        self.write(self.apps_file, self.apps.replace('  light: kitchen\n', '  light: kitchen\n  outbound_size: 100\n', 1))
+        manager.reload()
+        self.assertIn(('warning', 'reload - host options changed, restart required'), self.logger.logged)
+        self.assertIsNone(manager.app_instance.outbound)
+
+    def test_app_config_changed(self):
+        manager = self.get_manager(name='kitchen')
+        self.write(self.apps_file, self.apps.replace('light: kitchen', 'light: bedroom'))
+        manager.reload()
+        self.assertIn(('warning', 'reload - kitchen configuration changed, restart required'), self.logger.logged)
+
+    def test_invalid_config(self):
+        manager = self.get_manager()
+        entities = manager.entities
+        self.write(self.devices_file, 'button: [')
+        manager.reload()
+        self.assertIs(manager.entities, entities)
+        self.assertEqual(self.logger.logged[-1], ('exception', 'reload - configuration discarded'))
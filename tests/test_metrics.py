@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.metrics import Histogram, Metrics, MetricsReporter
+from iotapp.test import TestClient, TestLogger
+
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        for value in [0.5, 1, 1.5, 3, 10]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.get_cumulative(), [2, 3, 4, 5])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+        self.assertEqual(histogram.get_data()['buckets'], {'1': 2, '2': 3, '5': 4, '+Inf': 5})
+
+    def test_quantile(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        self.assertEqual(histogram.get_quantile(0.5), None)
+        for value in [0.5] * 50 + [1.5] * 49 + [10]:
+            histogram.observe(value)
+        self.assertEqual(histogram.get_quantile(0.5), 1)
+        self.assertEqual(histogram.get_quantile(0.99), 2)
+        self.assertEqual(histogram.get_quantile(1), float('inf'))
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.1, 1))
+        self.metrics.count_message('a/b')
+        self.metrics.count_message('a/b')
+        self.metrics.count_entity('lamp')
+        self.metrics.count_exception('on_message')
+        self.metrics.observe_parse(0.05)
+        self.metrics.observe_handler('app', 'on_button_click', 0.5)
+        self.metrics.add_gauge('dispatch_queue_depth', lambda: 3)
+
+    def test_data(self):
+        data = self.metrics.get_data()
+        self.assertEqual(data['topic_messages'], {'a/b': 2})
+        self.assertEqual(data['entity_messages'], {'lamp': 1})
+        self.assertEqual(data['exceptions'], {'on_message': 1})
+        self.assertEqual(data['parse_time']['count'], 1)
+        self.assertEqual(data['handler_latency']['app.on_button_click']['buckets'], {'0.1': 0, '1': 1, '+Inf': 1})
+        self.assertEqual(data['gauges'], {'dispatch_queue_depth': 3})
+
+    def test_prometheus(self):
+        text = self.metrics.get_prometheus('app')
+        lines = text.splitlines()
+        self.assertIn('# TYPE iotapp_messages_total counter', lines)
+        self.assertIn('iotapp_messages_total{app="app",topic="a/b"} 2', lines)
+        self.assertIn('iotapp_entity_messages_total{app="app",entity="lamp"} 1', lines)
+        self.assertIn('iotapp_get_events_seconds_bucket{le="0.1",app="app"} 1', lines)
+        self.assertIn('iotapp_get_events_seconds_count{app="app"} 1', lines)
+        self.assertIn('iotapp_handler_seconds_bucket{le="+Inf",app="app",handler="on_button_click"} 1', lines)
+        self.assertIn('iotapp_exceptions_total{app="app",where="on_message"} 1', lines)
+        self.assertIn('iotapp_dispatch_queue_depth{app="app"} 3', lines)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_label_escape(self):
+        self.metrics.count_message('a"b')
+        self.assertIn('topic="a\\"b"', self.metrics.get_prometheus('app'))
+
+
+class IotAppMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        self.logger = TestLogger()
+        entity_library = dict(
+            mybutton=entities.Button(state_topic='button/state'),
+            mylight=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        self.app = Toggle(
+            name='toggle',
+            entity_library=entity_library,
+            button='mybutton',
+            light='mylight',
+            metrics_interval=60,
+            client=self.client,
+            logger=self.logger,
+        )
+        self.app.button.logger = self.logger
+        self.app.light.logger = self.logger
+
+    def test_instrumentation(self):
+        self.client.receive('light/state', 'on')
+        self.client.receive('button/state', 'click')
+        self.client.receive('button/state', 'click')
+        data = self.app.metrics.get_data()
+        self.assertEqual(data['topic_messages'], {'light/state': 1, 'button/state': 2})
+        self.assertEqual(data['entity_messages'], {'light': 1, 'button': 2})
+        self.assertEqual(data['parse_time']['count'], 3)
+        self.assertEqual(data['handler_latency']['toggle.on_button_click']['count'], 2)
+        self.assertEqual(data['exceptions'], dict())
+
+    def test_exception(self):
+        with mock.patch.object(entities.Light, 'get_events', side_effect=ZeroDivisionError):
+            self.client.receive('light/state', 'on')
+        self.assertEqual(self.app.metrics.exceptions, {'on_message': 1})
+
+    def test_report_topic(self):
+        reporter = self.app.metrics_reporter
+        self.assertEqual(reporter.topic, 'iotapp/toggle/metrics')
+        self.client.receive('light/state', 'on')
+        reporter.report()
+        topic, payload = self.client.published[0]
+        self.assertEqual(topic, 'iotapp/toggle/metrics')
+        self.assertEqual(json.loads(payload)['topic_messages'], {'light/state': 1})
+
+    def test_report_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'iotapp.prom')
+            reporter = MetricsReporter(self.app, file_name=file_name)
+            self.client.receive('light/state', 'on')
+            reporter.report()
+            with open(file_name) as metrics_file:
+                self.assertIn('iotapp_messages_total{app="toggle",topic="light/state"} 1', metrics_file.read())
+            self.assertEqual(os.listdir(directory), ['iotapp.prom'])
+
+    def test_start_on_connect(self):
+        self.client.connect()
+        self.assertTrue(self.app.metrics_reporter.is_alive())
+        self.app.metrics_reporter.stop()
+        self.app.metrics_reporter.join()
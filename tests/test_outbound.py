@@ -0,0 +1,170 @@
+import threading
+import unittest
+from unittest import mock
+import paho.mqtt.client as mqtt
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.commands import CommandCoalescer
+from iotapp.metrics import Metrics
+from iotapp.outbound import OutboundQueue
+from iotapp.test import MessageInfo, TestClient, TestLogger
+
+
+class QosClient(TestClient):
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if self.rc != mqtt.MQTT_ERR_SUCCESS:
+            return MessageInfo(0, rc=self.rc)
+        self.commands.append((topic, payload, qos, retain))
+        return super().publish(topic, payload, qos=qos, retain=retain)
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.client = QosClient()
+        self.client.connected = True
+        self.metrics = Metrics()
+        self.queue = OutboundQueue(self.client, max_depth=3, max_inflight=4, batch_size=2, metrics=self.metrics, logger=TestLogger())
+
+    def test_batches(self):
+        for index in range(3):
+            self.queue.publish('light{}/command'.format(index), 'on', qos=1, retain=True)
+        self.assertEqual(self.client.commands, [])
+        self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(self.client.commands, [('light0/command', 'on', 1, True), ('light1/command', 'on', 1, True)])
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(self.queue.sent, 3)
+
+    def test_max_depth(self):
+        for index in range(4):
+            self.queue.publish('light{}/command'.format(index), 'on')
+        self.assertEqual(list(self.queue.pending), ['light1/command', 'light2/command', 'light3/command'])
+        self.assertEqual(self.queue.dropped, 1)
+        self.assertEqual(self.queue.logger.logged, [('warning', 'Outbound queue full, dropped command for light0/command')])
+
+    def test_offline_coalesced(self):
+        self.client.connected = False
+        self.queue.publish('light/set', '10')
+        self.queue.publish('light/command', 'on')
+        self.queue.publish('light/set', '20')
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.queue.merged, 1)
+        self.client.connected = True
+        self.queue.flush()
+        self.assertEqual(self.client.published, [('light/command', 'on'), ('light/set', '20')])
+
+    def test_max_inflight(self):
+        self.queue.max_depth = 10
+        for index in range(6):
+            self.queue.publish('light{}/command'.format(index), 'on')
+        self.queue.flush()
+        self.queue.flush()
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(len(self.queue.inflight), 4)
+        self.queue.on_publish(self.client, None, 1)
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.metrics.publish_latency.count, 1)
+
+    def test_acked_before_recorded(self):
+        publish = self.client.publish
+
+        def publish_acked(topic, payload=None, qos=0, retain=False):
+            info = publish(topic, payload, qos=qos, retain=retain)
+            self.queue.on_publish(self.client, None, info.mid)
+            return info
+
+        self.client.publish = publish_acked
+        self.queue.publish('light/command', 'on')
+        self.queue.flush()
+        self.assertEqual(self.queue.inflight, dict())
+        self.assertEqual(self.queue.acked, set())
+        self.assertEqual(self.metrics.publish_latency.count, 1)
+
+    def test_foreign_acks(self):
+        # Availability and metrics go straight to the client
+        for mid in range(1000, 2000):
+            self.queue.on_publish(self.client, None, mid)
+        self.assertEqual(self.queue.acked, set())
+        self.client.mid = 999
+        self.queue.publish('light/command', 'on')
+        self.queue.flush()
+        self.assertEqual(self.queue.inflight, {1000: mock.ANY})
+        self.assertEqual(self.metrics.publish_latency.count, 0)
+
+    def test_requeue(self):
+        self.queue.publish('light/set', '10')
+        self.queue.publish('light/command', 'on')
+        self.client.rc = mqtt.MQTT_ERR_NO_CONN
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(list(self.queue.pending), ['light/set', 'light/command'])
+        self.assertEqual(self.queue.failed, 2)
+        self.client.rc = mqtt.MQTT_ERR_SUCCESS
+        self.queue.flush()
+        self.assertEqual(self.client.published, [('light/set', '10'), ('light/command', 'on')])
+
+    def test_on_connect(self):
+        self.queue.publish('light/command', 'on')
+        self.queue.flush()
+        self.queue.on_connect()
+        self.assertEqual(self.queue.inflight, dict())
+
+
+class OutboundQueueThreadTest(unittest.TestCase):
+    def test_thread(self):
+        client = TestClient()
+        client.connected = True
+        queue = OutboundQueue(client, logger=TestLogger())
+        published = threading.Event()
+        client.publish = lambda topic, payload=None, qos=0, retain=False: published.set() or MessageInfo(1)
+        queue.start()
+        queue.publish('light/command', 'on')
+        self.assertTrue(published.wait(1))
+        queue.stop()
+        queue.join(1)
+        self.assertFalse(queue.is_alive())
+
+
+class OutboundAppTest(unittest.TestCase):
+    def setUp(self):
+        self.client = QosClient()
+        entity_library = dict(
+            button=entities.Button(state_topic='button/state'),
+            light=entities.Light(
+                state_topic='light/state',
+                command_topic='light/command',
+                command_qos=1,
+                command_retain=True,
+                brightness_command_topic='light/set',
+                brightness_command_template='{{ value }}',
+            ),
+        )
+        self.app = Toggle(button='button', light='light', entity_library=entity_library, outbound_size=10, client=self.client, logger=TestLogger())
+        self.addCleanup(self.app.outbound.stop)
+
+    def test_publisher(self):
+        self.assertIs(self.app.light.publisher, self.app.outbound)
+        self.assertEqual(self.client.on_publish, self.app.outbound.on_publish)
+
+    def test_entity_qos(self):
+        self.app.outbound.stop()
+        self.app.outbound.join(1)
+        self.app.light.turn_on()
+        self.app.light.brightness = 10
+        self.client.connect()
+        self.app.outbound.flush()
+        self.assertEqual(self.client.commands[1:], [('light/command', 'on', 1, True), ('light/set', '10', 1, True)])
+        self.assertEqual(self.client.commands[0][:2], ('iotapp/toggle/state', 'online'))
+        gauges = self.app.metrics.get_gauges()
+        self.assertEqual((gauges['outbound_queue_depth'], gauges['outbound_inflight']), (0, 2))
+
+    def test_coalescer(self):
+        app = Toggle(button='button', light='light', entity_library=self.app.entity_library, outbound_size=10, command_interval=10, client=self.client, logger=TestLogger())
+        self.addCleanup(app.outbound.stop)
+        self.assertIsInstance(app.publisher, CommandCoalescer)
+        self.assertIs(app.publisher.client, app.outbound)
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.record import MAGIC, RecordReader, Recorder, replay
+from iotapp.test import TestClient, TestLogger
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.file_name = os.path.join(self.directory.name, 'iotapp.rec')
+
+    def read(self):
+        reader = RecordReader(self.file_name)
+        self.addCleanup(reader.close)
+        return list(reader)
+
+    def test_round_trip(self):
+        recorder = Recorder(self.file_name)
+        recorder.record('button/state', b'click', timestamp=10.5)
+        recorder.record('light/state', 'on', timestamp=11.0)
+        recorder.record('light/availability', None, timestamp=12.0)
+        recorder.close()
+        self.assertEqual(self.read(), [
+            (10.5, 'button/state', b'click'),
+            (11.0, 'light/state', b'on'),
+            (12.0, 'light/availability', b''),
+        ])
+        self.assertEqual(recorder.count, 3)
+
+    def test_append(self):
+        for timestamp in [1.0, 2.0]:
+            recorder = Recorder(self.file_name)
+            recorder.record('light/state', 'on', timestamp=timestamp)
+            recorder.close()
+        self.assertEqual([record[0] for record in self.read()], [1.0, 2.0])
+
+    def test_truncated(self):
+        recorder = Recorder(self.file_name)
+        recorder.record('light/state', 'on', timestamp=1.0)
+        recorder.record('light/state', 'off', timestamp=2.0)
+        recorder.close()
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(os.path.getsize(self.file_name) - 1)
+        self.assertEqual(self.read(), [(1.0, 'light/state', b'on')])
+
+    def test_not_a_record(self):
+        with open(self.file_name, 'wb') as f:
+            f.write(b'light/state on\n')
+        with self.assertRaises(ValueError):
+            RecordReader(self.file_name)
+        open(self.file_name, 'wb').close()
+        with self.assertRaises(ValueError):
+            RecordReader(self.file_name)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        entity_library = dict(
+            button=entities.Button(state_topic='button/state'),
+            light=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        self.app = Toggle(button='button', light='light', entity_library=entity_library, client=self.client, logger=TestLogger())
+        self.records = [
+            (100.0, 'light/state', b'on'),
+            (100.5, 'button/state', b'click'),
+            (101.0, 'button/state', b'click'),
+        ]
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_speed(self):
+        report = replay(self.app, self.records, speed=2, clock=self.clock, sleep=self.sleep)
+        self.assertEqual(self.sleeps, [0.25, 0.25])
+        self.assertEqual(self.client.published, [('light/command', 'off'), ('light/command', 'off')])
+        self.assertEqual((report['messages'], report['seconds'], report['rate']), (3, 0.5, 6.0))
+        self.assertEqual(report['lag']['count'], 3)
+        self.assertEqual(report['handlers']['toggle.on_button_click']['count'], 2)
+        self.assertEqual(report['parse']['count'], 3)
+
+    def test_max_speed(self):
+        report = replay(self.app, self.records, speed=0, clock=self.clock, sleep=self.sleep)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(report['lag']['count'], 0)
+        self.assertEqual(report['rate'], 0)
+
+
+class RecordAppTest(unittest.TestCase):
+    def test_on_message(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_name = os.path.join(directory.name, 'iotapp.rec')
+        client = TestClient()
+        entity_library = dict(
+            button=entities.Button(state_topic='button/state'),
+            light=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        app = Toggle(button='button', light='light', entity_library=entity_library, record_file=file_name, client=client, logger=TestLogger())
+        client.receive('light/state', 'on')
+        client.receive('other/topic', 'x')
+        app.recorder.close()
+        reader = RecordReader(file_name)
+        self.addCleanup(reader.close)
+        self.assertEqual([record[1:] for record in reader], [('light/state', b'on'), ('other/topic', b'x')])
+        self.assertEqual(app.metrics.get_gauges()['recorded_messages'], 2)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(len(MAGIC)), MAGIC)
@@ -0,0 +1,102 @@
+import unittest
+from iotapp.router import TopicRouter, topic_matches
+
+
+class TopicRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = TopicRouter()
+
+    def test_exact(self):
+        self.router.add('a/b', 'x')
+        self.assertEqual(self.router.match('a/b'), ['x'])
+        self.assertEqual(self.router.match('a'), [])
+        self.assertEqual(self.router.match('a/b/c'), [])
+
+    def test_interned_levels(self):
+        self.router.add('shellies/{}/white'.format('kitchen'), 'x')
+        self.router.add('shellies/{}/white'.format('bedroom'), 'y')
+        kitchen = self.router.root.children['shellies'].children['kitchen']
+        bedroom = self.router.root.children['shellies'].children['bedroom']
+        self.assertIs(list(kitchen.children)[0], list(bedroom.children)[0])
+
+    def test_many_values(self):
+        for name in ['ch1', 'ch2', 'ch3', 'ch4']:
+            self.router.add('shellies/rgbw2/online', name)
+        self.assertEqual(self.router.match('shellies/rgbw2/online'), ['ch1', 'ch2', 'ch3', 'ch4'])
+
+    def test_duplicate(self):
+        self.router.add('a/b', 'x')
+        self.router.add('a/b', 'x')
+        self.assertEqual(self.router.match('a/b'), ['x'])
+        self.assertEqual(len(self.router), 1)
+
+    def test_single_level(self):
+        self.router.add('zigbee/+', 'x')
+        self.assertEqual(self.router.match('zigbee/button'), ['x'])
+        self.assertEqual(self.router.match('zigbee/button/set'), [])
+        self.assertEqual(self.router.match('zigbee'), [])
+        self.router.add('a/+/c', 'y')
+        self.assertEqual(self.router.match('a/b/c'), ['y'])
+        self.assertEqual(self.router.match('a//c'), ['y'])
+
+    def test_multi_level(self):
+        self.router.add('shellies/#', 'x')
+        self.assertEqual(self.router.match('shellies'), ['x'])
+        self.assertEqual(self.router.match('shellies/a'), ['x'])
+        self.assertEqual(self.router.match('shellies/a/white/0'), ['x'])
+        self.assertEqual(self.router.match('zigbee/a'), [])
+
+    def test_all(self):
+        self.router.add('#', 'x')
+        self.assertEqual(self.router.match('a/b'), ['x'])
+        self.assertEqual(self.router.match('$SYS/uptime'), [])
+
+    def test_dollar(self):
+        self.router.add('+/uptime', 'x')
+        self.router.add('$SYS/#', 'y')
+        self.assertEqual(self.router.match('$SYS/uptime'), ['y'])
+
+    def test_fan_out(self):
+        self.router.add('a/b', 'exact')
+        self.router.add('a/+', 'single')
+        self.router.add('a/#', 'multi')
+        self.router.add('#', 'exact')
+        self.assertEqual(sorted(self.router.match('a/b')), ['exact', 'multi', 'single'])
+
+    def test_remove(self):
+        self.router.add('a/b/c', 'x')
+        self.router.add('a/b/c', 'y')
+        self.assertTrue(self.router.remove('a/b/c', 'x'))
+        self.assertEqual(self.router.match('a/b/c'), ['y'])
+        self.assertFalse(self.router.remove('a/b/c', 'x'))
+        self.assertFalse(self.router.remove('a/z', 'x'))
+        self.assertTrue(self.router.remove('a/b/c', 'y'))
+        self.assertEqual(self.router.match('a/b/c'), [])
+        self.assertEqual(self.router.root.children, dict())
+        self.assertEqual(len(self.router), 0)
+
+    def test_contains(self):
+        self.router.add('a/+', 'x')
+        self.assertIn('a/+', self.router)
+        self.assertNotIn('a/b', self.router)
+
+
+class TopicMatchesTest(unittest.TestCase):
+    def test_exact(self):
+        self.assertTrue(topic_matches('a/b', 'a/b'))
+        self.assertFalse(topic_matches('a/b', 'a/c'))
+        self.assertFalse(topic_matches('a/b', 'a/b/c'))
+
+    def test_single_level(self):
+        self.assertTrue(topic_matches('zigbee/+', 'zigbee/button'))
+        self.assertFalse(topic_matches('zigbee/+', 'zigbee/button/set'))
+        self.assertFalse(topic_matches('zigbee/+', 'zigbee'))
+
+    def test_multi_level(self):
+        self.assertTrue(topic_matches('shellies/#', 'shellies'))
+        self.assertTrue(topic_matches('shellies/#', 'shellies/a/white/0'))
+        self.assertFalse(topic_matches('shellies/#', 'zigbee/a'))
+
+    def test_dollar(self):
+        self.assertFalse(topic_matches('#', '$SYS/uptime'))
+        self.assertTrue(topic_matches('$SYS/#', '$SYS/uptime'))
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.scheduler import Scheduler
+from iotapp.test import TestClient, TestLogger
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(compact_size=2, logger=TestLogger())
+        self.calls = []
+
+    def call(self, *args):
+        self.calls.append(args)
+
+    def test_order(self):
+        self.scheduler.run_at(20, self.call, args=('b',))
+        self.scheduler.run_at(10, self.call, args=('a',))
+        self.scheduler.run_at(20, self.call, args=('c',))
+        self.assertEqual(self.scheduler.next_timeout(now=5), 5)
+        self.assertEqual(self.scheduler.run_pending(now=15), 1)
+        self.assertEqual(self.scheduler.run_pending(now=20), 2)
+        self.assertEqual(self.calls, [('a',), ('b',), ('c',)])
+        self.assertIsNone(self.scheduler.next_timeout())
+
+    def test_reschedule(self):
+        self.scheduler.run_at(10, self.call, args=(1,), key='debounce')
+        self.scheduler.run_at(30, self.call, args=(2,), key='debounce')
+        self.assertEqual(self.scheduler.pending(), 1)
+        self.assertEqual(self.scheduler.run_pending(now=20), 0)
+        self.scheduler.run_pending(now=30)
+        self.assertEqual(self.calls, [(2,)])
+
+    def test_cancel(self):
+        self.scheduler.run_at(10, self.call, key='a')
+        self.assertTrue(self.scheduler.cancel('a'))
+        self.assertFalse(self.scheduler.cancel('a'))
+        self.assertIsNone(self.scheduler.next_timeout())
+        self.assertEqual(self.scheduler.cancelled, 0)
+
+    def test_cancel_group(self):
+        self.scheduler.run_at(10, self.call, key=('light', 'off'), group='light')
+        self.scheduler.run_at(10, self.call, key=('light', 'dim'), group='light')
+        self.scheduler.run_at(10, self.call, args=('button',), key=('button', 'click'), group='button')
+        self.assertEqual(self.scheduler.cancel_group('light'), 2)
+        self.assertEqual(self.scheduler.cancel_group('light'), 0)
+        self.scheduler.run_pending(now=10)
+        self.assertEqual(self.calls, [('button',)])
+        self.assertEqual(self.scheduler.groups, dict())
+
+    def test_compact(self):
+        for index in range(6):
+            self.scheduler.run_at(index, self.call, key=index)
+        for index in range(4):
+            self.scheduler.cancel(index)
+        self.assertEqual(len(self.scheduler.heap), 2)
+        self.assertEqual(self.scheduler.cancelled, 0)
+
+    def test_exception(self):
+        self.scheduler.run_at(1, lambda: 1 / 0, key='broken')
+        self.scheduler.run_at(1, self.call)
+        self.assertEqual(self.scheduler.run_pending(now=1), 2)
+        self.assertEqual(self.calls, [()])
+        self.assertEqual(self.scheduler.logger.logged, [('exception', 'timer broken')])
+
+    def test_thread(self):
+        called = threading.Event()
+        self.scheduler.start()
+        self.scheduler.run_in(0.01, called.set)
+        self.assertTrue(called.wait(1))
+        self.scheduler.stop()
+        self.scheduler.join(1)
+        self.assertFalse(self.scheduler.is_alive())
+
+    def test_async(self):
+        async def run():
+            called = asyncio.Event()
+            task = asyncio.get_running_loop().create_task(self.scheduler.run_async())
+            await asyncio.sleep(0)
+            self.scheduler.run_in(0.01, called.set)
+            await asyncio.wait_for(called.wait(), 1)
+            self.scheduler.stop()
+            await task
+
+        asyncio.run(run())
+        self.assertIsNone(self.scheduler.loop)
+
+
+class DelayedToggle(Toggle):
+    def on_button_click(self):
+        self.light.turn_on()
+        self.run_in(600, self.light.turn_off, entity='light', name='off')
+
+
+class SchedulerAppTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient()
+        entity_library = dict(
+            button=entities.Button(state_topic='button/state'),
+            light=entities.Light(state_topic='light/state', command_topic='light/command'),
+        )
+        self.app = DelayedToggle(button='button', light='light', entity_library=entity_library, client=self.client, logger=TestLogger())
+
+    def test_run_in(self):
+        self.client.receive('button/state', 'click')
+        self.client.receive('button/state', 'click')
+        self.assertEqual(self.app.scheduler.pending(), 1)
+        self.assertEqual(self.app.metrics.get_gauges()['timers_pending'], 1)
+        when = self.app.scheduler.heap[-1][0]
+        self.app.scheduler.run_pending(now=when)
+        self.assertEqual(self.client.published, [('light/command', 'on'), ('light/command', 'on'), ('light/command', 'off')])
+        self.assertEqual(self.app.metrics.handler_latency[('delayedtoggle', 'off')].count, 1)
+
+    def test_cancel_timer(self):
+        self.client.receive('button/state', 'click')
+        self.assertTrue(self.app.cancel_timer(entity='light', name='off'))
+        self.client.receive('button/state', 'click')
+        self.assertEqual(self.app.cancel_timer(entity='light'), 1)
+        self.assertEqual(self.app.scheduler.pending(), 0)
+
+    def test_exception(self):
+        self.app.run_in(0, lambda: 1 / 0, name='broken')
+        self.app.scheduler.run_pending()
+        self.assertEqual(self.app.metrics.exceptions, dict(broken=1))
+        self.assertEqual(self.app.logger.logged[-1], ('exception', 'broken - timer'))
+
+    def test_dispatcher(self):
+        app = DelayedToggle(button='button', light='light', entity_library=self.app.entity_library, dispatch_workers=2, client=self.client, logger=TestLogger())
+        self.addCleanup(app.dispatcher.stop)
+        app.dispatcher.submit = mock.Mock()
+        app.run_in(0, app.light.turn_off, entity='light', name='off')
+        app.run_in(0, app.light.turn_on, name='on')
+        app.scheduler.run_pending()
+        # Same queue as the entity events, never concurrent with its handlers
+        self.assertEqual(app.dispatcher.submit.call_args_list, [
+            mock.call('light', app.run_timer, 'off', app.light.turn_off, ()),
+            mock.call('delayedtoggle', app.run_timer, 'on', app.light.turn_on, ()),
+        ])
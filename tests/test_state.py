@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from iotapp import entities
+from iotapp.apps.toggle import Toggle
+from iotapp.state import StateStore
+from iotapp.test import TestClient, TestLogger
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, 'state.log')
+        self.store = StateStore(self.file_name, compact_size=4, logger=TestLogger())
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def read_lines(self):
+        with open(self.file_name) as f:
+            return f.read().splitlines()
+
+    def test_missing_file(self):
+        self.assertEqual(self.store.load(), dict())
+
+    def test_append(self):
+        self.assertTrue(self.store.save('light', dict(state='on')))
+        self.assertFalse(self.store.save('light', dict(state='on')))
+        self.assertTrue(self.store.save('light', dict(state='off')))
+        self.assertEqual(self.read_lines(), ['["light",{"state":"on"}]', '["light",{"state":"off"}]'])
+        self.store.close()
+        store = StateStore(self.file_name, logger=TestLogger())
+        self.assertEqual(store.load(), dict(light=dict(state='off')))
+
+    def test_compact(self):
+        for index in range(5):
+            self.store.save('light', dict(brightness=index))
+        self.assertEqual(self.read_lines(), ['["light",{"brightness":4}]'])
+        self.assertEqual(self.store.lines, 1)
+        self.store.save('button', dict(state='click'))
+        self.assertEqual(len(self.read_lines()), 2)
+
+    def test_broken_line(self):
+        with open(self.file_name, 'w') as f:
+            f.write('["light",{"state":"on"}]\n["button",{"sta')
+        self.assertEqual(self.store.load(), dict(light=dict(state='on')))
+        self.assertEqual(self.read_lines(), ['["light",{"state":"on"}]'])
+        self.assertEqual(self.store.logger.logged[0], ('warning', 'State file {} - skipped 1 broken lines'.format(self.file_name)))
+
+
+class StateAppTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.state_file = os.path.join(self.directory.name, 'state.log')
+        self.entity_library = dict(
+            table_button=entities.Button(state_topic='button/state'),
+            kitchen=entities.Light(
+                state_topic='light/state',
+                command_topic='light/command',
+                availability_topic='light/availability',
+                brightness_state_topic='light/brightness',
+            ),
+            bedroom=entities.Light(state_topic='bedroom/state', command_topic='bedroom/command'),
+        )
+
+    def get_app(self, client, light='kitchen'):
+        app = Toggle(button='table_button', light=light, entity_library=self.entity_library, state_file=self.state_file, client=client, logger=TestLogger())
+        self.addCleanup(app.state_store.close)
+        return app
+
+    def test_warm_start(self):
+        client = TestClient()
+        self.get_app(client)
+        client.receive('light/availability', 'online')
+        client.receive('light/state', 'on')
+        client.receive('light/brightness', '120')
+        client = TestClient()
+        app = self.get_app(client)
+        self.assertEqual(app.light.get_state(), dict(available=True, state='on', brightness=120))
+        self.assertEqual(app.button.get_state(), dict(available=None, state=None))
+        self.assertEqual(client.published, [])
+        client.receive('button/state', 'click')
+        self.assertEqual(client.published, [('light/command', 'off')])
+
+    def test_reconcile(self):
+        client = TestClient()
+        self.get_app(client)
+        client.receive('light/state', 'on')
+        client = TestClient()
+        app = self.get_app(client)
+        client.receive('light/state', 'off')
+        self.assertEqual(app.light.state, 'off')
+        self.assertEqual(app.state_store.get('kitchen')['state'], 'off')
+
+    def test_entity_key(self):
+        client = TestClient()
+        self.get_app(client)
+        client.receive('light/state', 'on')
+        app = self.get_app(TestClient(), light='bedroom')
+        self.assertEqual(app.light.get_state(), dict(available=None, state=None, brightness=None))
+        self.assertEqual(list(app.state_store.states), ['kitchen'])
+
+    def test_disabled(self):
+        app = Toggle(button='table_button', light='kitchen', entity_library=self.entity_library, client=TestClient(), logger=TestLogger())
+        self.assertIsNone(app.state_store)
@@ -27,3 +27,22 @@ class TestLoggerTest(unittest.TestCase):
         logger = test.TestLogger(level='debug')
         logger.exception('msg')
         self.assertEqual(logger.logged, [('exception', 'msg')])
+
+    def test_args(self):
+        logger = test.TestLogger(level='debug')
+        logger.debug('msg %s %s', 'a', 1)
+        self.assertEqual(logger.logged, [('debug', 'msg a 1')])
+
+    def test_is_enabled_for(self):
+        logger = test.TestLogger(level='info')
+        self.assertFalse(logger.isEnabledFor(10))
+        self.assertTrue(logger.isEnabledFor(20))
+
+
+class TestClientTest(unittest.TestCase):
+    def test_subscribe(self):
+        client = test.TestClient()
+        client.subscribe('a', qos=1)
+        client.subscribe([('b', 0), ('c', 2)])
+        self.assertEqual(client.subscribed, ['a', 'b', 'c'])
+        self.assertEqual(client.subscribe_calls, [[('a', 1)], [('b', 0), ('c', 2)]])
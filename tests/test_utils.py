@@ -0,0 +1,59 @@
+import unittest
+from iotapp import utils
+
+
+class GetTemplateValueTest(unittest.TestCase):
+    def test_no_template(self):
+        self.assertEqual(utils.get_template_value('value'), 'value')
+
+    def test_json(self):
+        self.assertEqual(utils.get_template_value('{"click": "single"}', '{{ value.click }}'), 'single')
+
+    def test_text(self):
+        self.assertEqual(utils.get_template_value(20, '{"brightness": {{ value }}}', json=False), '{"brightness": 20}')
+
+    def test_compiled(self):
+        template = utils.compile_template('{{ value.click }}')
+        self.assertEqual(utils.get_template_value('{"click": "double"}', template), 'double')
+
+    def test_compile_empty(self):
+        self.assertEqual(utils.compile_template(''), None)
+
+
+class TemplateCacheTest(unittest.TestCase):
+    def test_hits_misses(self):
+        utils.get_template.cache_clear()
+        utils.get_template_value('{"a": 1}', '{{ value.a }}')
+        utils.get_template_value('{"a": 2}', '{{ value.a }}')
+        utils.get_template_value('{"b": 3}', '{{ value.b }}')
+        info = utils.get_template_cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.currsize, 2)
+
+    def test_same_instance(self):
+        self.assertIs(utils.get_template('{{ value }}'), utils.get_template('{{ value }}'))
+
+
+class PayloadTest(unittest.TestCase):
+    def test_str(self):
+        payload = utils.Payload.decode(b'online')
+        self.assertEqual(payload, 'online')
+        self.assertIsInstance(payload, str)
+
+    def test_json_once(self):
+        payload = utils.Payload('{"brightness": 11}')
+        data = payload.json
+        self.assertEqual(data, dict(brightness=11))
+        self.assertIs(payload.json, data)
+
+    def test_shared(self):
+        payload = utils.Payload('{"brightness": 11, "ison": true}')
+        self.assertEqual(utils.get_template_value(payload, '{{ value.brightness }}'), '11')
+        self.assertEqual(utils.get_template_value(payload, '{{ value.ison }}'), 'True')
+        self.assertEqual(payload._json, dict(brightness=11, ison=True))
+
+    def test_invalid_json(self):
+        payload = utils.Payload('not json')
+        with self.assertRaises(ValueError):
+            payload.json
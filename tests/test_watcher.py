@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from iotapp.test import TestLogger
+from iotapp.watcher import FileWatcher
+
+
+class FileWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, 'apps.yml')
+        with open(self.file_name, 'w') as f:
+            f.write('a: 1\n')
+        self.calls = []
+        self.logger = TestLogger()
+        self.watcher = FileWatcher([self.file_name], lambda: self.calls.append(1), interval=0.01, logger=self.logger)
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.directory.cleanup()
+
+    def test_unchanged(self):
+        self.assertFalse(self.watcher.check())
+        self.assertEqual(self.calls, [])
+
+    def test_changed(self):
+        with open(self.file_name, 'w') as f:
+            f.write('a: 12\n')
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(self.calls, [1])
+        self.assertFalse(self.watcher.check())
+        self.assertEqual(self.logger.logged, [('info', 'Configuration changed')])
+
+    def test_removed(self):
+        os.remove(self.file_name)
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(self.calls, [])
+
+    def test_callback_exception(self):
+        self.watcher.callback = lambda: 1 / 0
+        os.utime(self.file_name, ns=(0, 0))
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(self.logger.logged[-1], ('exception', 'watcher callback'))
+
+    def test_thread(self):
+        self.watcher.start()
+        os.utime(self.file_name, ns=(0, 0))
+        for _ in range(100):
+            if self.calls:
+                break
+            self.watcher.stopped.wait(0.01)
+        self.assertEqual(self.calls, [1])
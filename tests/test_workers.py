@@ -0,0 +1,131 @@
+import os
+import signal
+import time
+import unittest
+from unittest import mock
+from iotapp.broker import Broker
+from iotapp.manager import AppManager
+from iotapp.test import TestLogger
+from iotapp.workers import Supervisor, get_partition, merge_counters
+
+
+TIMEOUT = 5
+
+
+def wait_for(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class PartitionTest(unittest.TestCase):
+    def test_partition(self):
+        self.assertEqual(get_partition('kitchen', 4), get_partition('kitchen', 4))
+        self.assertEqual(set(get_partition('app{}'.format(i), 4) for i in range(100)), {0, 1, 2, 3})
+
+    def test_merge_counters(self):
+        counters = dict(a=1)
+        merge_counters(counters, dict(a=2, b=3))
+        self.assertEqual(counters, dict(a=3, b=3))
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.devices = dict(
+            button=dict(type='aqara-button'),
+            light=dict(type='shelly-rgbw2', channel1='kitchen', channel2='bedroom', channel3='hall'),
+        )
+        self.apps = dict(
+            kitchen=dict(app='iotapp.apps.toggle.Toggle', button='button', light='kitchen'),
+            bedroom=dict(app='iotapp.apps.toggle.Toggle', button='button', light='bedroom'),
+            hall=dict(app='iotapp.apps.toggle.Toggle', button='button', light='hall'),
+        )
+
+    def get_supervisor(self, **kwargs):
+        manager = AppManager(devices=self.devices, apps=self.apps, create_app=False, logger=TestLogger())
+        return Supervisor(manager, logger=TestLogger(), **kwargs)
+
+    def test_not_created(self):
+        manager = AppManager(devices=self.devices, apps=self.apps, create_app=False, logger=TestLogger())
+        self.assertFalse(hasattr(manager, 'app_instance'))
+
+    def test_partitions(self):
+        supervisor = self.get_supervisor(workers=2)
+        names = sorted(name for partition in supervisor.partitions.values() for name in partition)
+        self.assertEqual(names, ['bedroom', 'hall', 'kitchen'])
+        for index, partition in supervisor.partitions.items():
+            for name in partition:
+                self.assertEqual(get_partition(name, 2), index)
+
+    def test_workers(self):
+        with Broker(logger=TestLogger()) as broker:
+            environ = dict(broker.get_environ(), MQTT_CLIENT_ID='gateway')
+            with mock.patch.dict(os.environ, environ):
+                supervisor = self.get_supervisor(workers=2, restart_delay=0, metrics_interval=0.1)
+                for index in supervisor.partitions:
+                    supervisor.start_worker(index)
+            try:
+                # Every worker is online with its own connection, hosting its apps when it has many
+                topics = []
+                for index, partition in supervisor.partitions.items():
+                    topics.append('iotapp/{}/state'.format(partition[0] if len(partition) == 1 else 'iotapp-{}'.format(index)))
+                self.assertTrue(wait_for(lambda: all(topic in broker.retained for topic in topics)))
+                client_ids = sorted(broker.sessions)
+                self.assertEqual(client_ids, sorted('gateway-{}'.format(index) for index in supervisor.partitions))
+                # Metrics
+                self.assertTrue(wait_for(lambda: supervisor.collect_metrics() and len(supervisor.metrics) == len(supervisor.processes)))
+                self.assertEqual(supervisor.get_metrics()['workers'], len(supervisor.processes))
+                # Crash and restart
+                index, process = next(iter(supervisor.processes.items()))
+                os.kill(process.pid, signal.SIGKILL)
+                process.join(TIMEOUT)
+                supervisor.check_workers()
+                self.assertEqual(supervisor.restarts, {index: 1})
+                self.assertTrue(supervisor.processes[index].is_alive())
+                self.assertNotEqual(supervisor.processes[index].pid, process.pid)
+                self.assertEqual(supervisor.get_metrics()['restarts'], 1)
+            finally:
+                supervisor.stop_workers()
+            self.assertFalse(any(process.is_alive() for process in supervisor.processes.values()))
+
+    def test_reload(self):
+        supervisor = self.get_supervisor(workers=2)
+        supervisor.processes = dict((index, mock.Mock()) for index in supervisor.partitions)
+        supervisor.start_worker = mock.Mock()
+        supervisor.stop_worker = mock.Mock()
+        self.apps['garage'] = dict(app='iotapp.apps.toggle.Toggle', button='button', light='hall')
+        index = get_partition('garage', 2)
+        supervisor.reload()
+        self.assertIn('garage', supervisor.partitions[index])
+        self.assertEqual(supervisor.start_worker.call_args_list, [mock.call(index)])
+        self.assertEqual(supervisor.stop_worker.call_args_list, [mock.call(index)] if index in supervisor.processes else [])
+        # Unchanged configuration, nothing restarted
+        supervisor.start_worker.reset_mock()
+        supervisor.reload()
+        self.assertEqual(supervisor.start_worker.call_args_list, [])
+
+    def test_restart_reloads(self):
+        supervisor = self.get_supervisor(workers=1)
+        process = mock.Mock()
+        process.is_alive.return_value = False
+        supervisor.processes[0] = process
+        supervisor.started[0] = 0
+        supervisor.start_worker = mock.Mock()
+        supervisor.watcher = mock.Mock()
+        supervisor.watcher.check.side_effect = lambda: self.assertEqual(supervisor.start_worker.call_count, 0)
+        supervisor.check_workers()
+        supervisor.watcher.check.assert_called_once_with()
+        supervisor.start_worker.assert_called_once_with(0)
+
+    def test_stopped(self):
+        supervisor = self.get_supervisor(workers=1)
+        process = mock.Mock()
+        process.is_alive.return_value = False
+        supervisor.processes[0] = process
+        supervisor.started[0] = 0
+        supervisor.stop()
+        supervisor.check_workers()
+        self.assertEqual(supervisor.restarts, dict())